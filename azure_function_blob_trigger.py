@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 import azure.functions as func
 from azure.identity import DefaultAzureCredential
@@ -7,6 +8,25 @@ import requests
 # Environment variables required:
 # AZURE_SUBSCRIPTION_ID, AZURE_RESOURCE_GROUP, AZURE_CONTAINER_APP_NAME, ACA_CONTAINER_IMAGE, ACA_ENVIRONMENT, ACA_RESOURCE_GROUP
 # Optionally: ACA_COMMAND (default: python fetch_videos.py --blob <container> <blob_name>)
+#
+# New videos are handed to the long-running workers (worker.py) as a queue task instead of starting a
+# Container App job per blob. Queue mode needs AZURE_STORAGE_ACCOUNT_NAME / AZURE_STORAGE_ACCOUNT_KEY and
+# optionally WORK_QUEUE_NAME; set DISPATCH_MODE=job to keep launching one job per blob.
+
+def enqueue_video_task(blob_name):
+    from azure.storage.queue import QueueClient
+    from azure.core.exceptions import ResourceExistsError
+    account_url = f"https://{os.environ['AZURE_STORAGE_ACCOUNT_NAME']}.queue.core.windows.net"
+    queue_name = os.environ.get("WORK_QUEUE_NAME", "transcription-tasks")
+    # Same task schema as utils.work_queue.video_task
+    task = {"kind": "video", "video_blob": blob_name}
+    with QueueClient(account_url, queue_name, credential=os.environ.get("AZURE_STORAGE_ACCOUNT_KEY")) as queue:
+        try:
+            queue.create_queue()
+        except ResourceExistsError:
+            pass
+        queue.send_message(json.dumps(task))
+    logging.info(f"Enqueued {task} on {queue_name}")
 
 def main(myblob: func.InputStream):
     logging.info(f"Blob trigger function processed blob: {myblob.name}, Size: {myblob.length} bytes")
@@ -15,6 +35,16 @@ def main(myblob: func.InputStream):
     container_name = myblob.blob_service.container_name
     blob_name = myblob.name
 
+    videos_container = os.environ.get("AZURE_BLOB_VIDEOS_CONTAINER", "videos")
+    if container_name == videos_container and os.environ.get("DISPATCH_MODE", "queue") == "queue":
+        # Trigger paths include the container ('videos/abc.mp4'); tasks carry the blob name within it
+        prefix = f"{container_name}/"
+        enqueue_video_task(blob_name[len(prefix):] if blob_name.startswith(prefix) else blob_name)
+        return
+
+    start_aca_job(container_name, blob_name)
+
+def start_aca_job(container_name, blob_name):
     # ACA config from environment
     subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
     resource_group = os.environ["AZURE_RESOURCE_GROUP"]
@@ -0,0 +1,99 @@
+"""
+bench_alignment.py
+
+Compares the interval-sweep speaker alignment in utils/alignment.py with the original
+per-segment linear scan on synthetic transcripts, reporting wall time and how often each
+method picks the speaker that actually produced the segment.
+
+Usage: python benchmarks/bench_alignment.py [num_segments] [num_turns]
+"""
+
+import bisect
+import random
+import sys
+import time
+from pathlib import Path
+
+# Ensure project root is in sys.path for imports
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from utils.alignment import assign_speakers
+
+
+def make_synthetic(num_segments: int, num_turns: int, num_speakers: int = 8, seed: int = 0):
+    """Build diarization turns and Whisper-like segments (with word timestamps) over the same timeline."""
+    rng = random.Random(seed)
+    turns = []
+    t = 0.0
+    for _ in range(num_turns):
+        duration = rng.uniform(1.0, 12.0)
+        turns.append({'start': t, 'end': t + duration, 'speaker': f"Speaker {rng.randrange(num_speakers) + 1}"})
+        # Occasional short gaps and overlaps, like real diarization output
+        t += duration + rng.uniform(-0.3, 0.5)
+    total = t
+    segments = []
+    seg_length = total / num_segments
+    for i in range(num_segments):
+        start = i * seg_length + rng.uniform(0.0, 0.2)
+        end = (i + 1) * seg_length
+        num_words = rng.randint(3, 12)
+        word_length = (end - start) / num_words
+        words = [
+            {'word': f" w{j}", 'start': start + j * word_length, 'end': start + (j + 1) * word_length}
+            for j in range(num_words)
+        ]
+        segments.append({'start': start, 'end': end, 'text': f"segment {i}", 'words': words})
+    return segments, turns
+
+
+def true_speakers(segments, turns):
+    """Ground truth: the speaker covering the most of each segment (turns are generated in start order)."""
+    starts = [turn['start'] for turn in turns]
+    longest = max(turn['end'] - turn['start'] for turn in turns)
+    result = []
+    for seg in segments:
+        coverage = {}
+        lo = bisect.bisect_left(starts, seg['start'] - longest)
+        hi = bisect.bisect_left(starts, seg['end'])
+        for turn in turns[lo:hi]:
+            overlap = min(seg['end'], turn['end']) - max(seg['start'], turn['start'])
+            if overlap > 0:
+                coverage[turn['speaker']] = coverage.get(turn['speaker'], 0.0) + overlap
+        result.append(max(coverage.items(), key=lambda item: item[1])[0] if coverage else "Unknown")
+    return result
+
+
+def linear_scan(segments, turns):
+    """The original approach: first turn containing the segment start."""
+    result = []
+    for seg in segments:
+        speaker = "Unknown"
+        for turn in turns:
+            if turn['start'] <= seg['start'] <= turn['end']:
+                speaker = turn['speaker']
+                break
+        result.append(speaker)
+    return result
+
+
+def main():
+    num_segments = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_turns = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    segments, turns = make_synthetic(num_segments, num_turns)
+    num_words = sum(len(seg['words']) for seg in segments)
+    print(f"{num_segments} segments ({num_words} words) x {num_turns} turns")
+
+    started = time.perf_counter()
+    expected = true_speakers(segments, turns)
+    print(f"ground truth:                {time.perf_counter() - started:8.3f}s")
+
+    for name, align in (("linear scan", linear_scan), ("interval sweep", assign_speakers)):
+        started = time.perf_counter()
+        speakers = align(segments, turns)
+        elapsed = time.perf_counter() - started
+        accuracy = sum(a == b for a, b in zip(speakers, expected)) / len(expected)
+        print(f"{name + ':':28s} {elapsed:8.3f}s  agreement with ground truth {accuracy:.1%}")
+
+
+if __name__ == "__main__":
+    main()
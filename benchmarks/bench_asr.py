@@ -0,0 +1,78 @@
+"""
+bench_asr.py
+
+Transcribes one local audio/video fixture with each ASR backend in utils/whisper_wrapper.py and
+reports model load time, real-time factor (transcription wall time / audio duration) and how
+many words each backend agrees on with the first one (the reference).
+
+Usage: python benchmarks/bench_asr.py <fixture> [model] [backend ...]
+       e.g. python benchmarks/bench_asr.py meeting.wav base openai-whisper faster-whisper
+"""
+
+import difflib
+import re
+import sys
+import time
+from pathlib import Path
+
+# Ensure project root is in sys.path for imports
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from utils.pcm import SAMPLE_RATE, decode_audio_pcm
+from utils.whisper_wrapper import BACKENDS, get_model, get_model_cache_stats, resolve_model_config, transcribe_audio_sync
+
+
+def normalized_words(result):
+    """Lower-cased words without punctuation, in transcript order."""
+    words = []
+    for seg in result['segments']:
+        for word in seg.get('words', []):
+            token = re.sub(r"[^\w']", "", word['word'].lower())
+            if token:
+                words.append(token)
+    return words
+
+
+def word_agreement(reference, hypothesis):
+    """Fraction of words matched in order between two transcripts, relative to the longer one."""
+    if not reference and not hypothesis:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, reference, hypothesis, autojunk=False)
+    matched = sum(block.size for block in matcher.get_matching_blocks())
+    return matched / max(len(reference), len(hypothesis))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    fixture = sys.argv[1]
+    model_name = sys.argv[2] if len(sys.argv) > 2 else "base"
+    backends = sys.argv[3:] or list(BACKENDS)
+
+    audio = decode_audio_pcm(fixture)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"{fixture}: {duration:.1f}s of audio, model {model_name}")
+
+    reference = None
+    for backend in backends:
+        _, _, device, dtype = resolve_model_config(model_name, backend=backend)
+        load_before = get_model_cache_stats()["load_seconds"]
+        get_model(model_name, backend=backend)
+        load_seconds = get_model_cache_stats()["load_seconds"] - load_before
+
+        started = time.perf_counter()
+        result = transcribe_audio_sync(audio, model_name, backend)
+        elapsed = time.perf_counter() - started
+
+        words = normalized_words(result)
+        if reference is None:
+            reference = words
+        agreement = word_agreement(reference, words)
+        print(f"{backend + ' (' + device + ', ' + dtype + '):':32s} load {load_seconds:6.2f}s  "
+              f"transcribe {elapsed:8.2f}s  RTF {elapsed / duration:6.3f}  "
+              f"{len(words):6d} words  agreement with {backends[0]} {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
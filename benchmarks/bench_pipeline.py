@@ -0,0 +1,300 @@
+"""
+bench_pipeline.py
+
+End-to-end pipeline benchmark that runs offline: blob storage is the local directory backend
+(STORAGE_BACKEND=local, see utils/storage.py), the input is synthetic speech-like audio of any length (or a real
+recording tiled to that length), and Whisper runs with a tiny model. It times
+
+  - chunk_and_upload_audio    download, decode, chunk and upload
+  - transcribe_and_upload     chunk transcription, optional diarization and publishing
+  - alignment                 assign_speakers over the published transcript
+  - speaker identification    speaker/main.py, when --speaker-python points at its Python 3.8 env
+
+and writes a JSON report with per-stage wall time, real-time factor and peak RSS (built from the
+utils/metrics records of the run, including the inner stages and model loads), keyed by commit.
+--compare prints the change against an earlier report and exits 1 on regressions.
+
+Usage: python benchmarks/bench_pipeline.py [--duration 600] [--chunk-length 120] [--model tiny]
+       python benchmarks/bench_pipeline.py --compare benchmarks/results/<commit>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Ensure project root is in sys.path for imports
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+import ffmpeg
+import numpy as np
+
+import download_and_prepare
+import transcribe_with_whisper
+from utils.alignment import assign_speakers
+from utils.executors import shutdown_executors
+from utils.metrics import stage_timer
+from utils.pcm import SAMPLE_RATE, decode_audio_pcm, write_wav
+from utils.storage import get_storage
+
+# Containers the pipeline uses by default; all of them are directories under the local store
+VIDEOS, AUDIO, PROCESSED, TRANSCRIPTS = 'videos', 'audio', 'videos-processed', 'transcripts'
+# Top-level stages compared between reports; inner stages are reported but not gated
+BENCH_STAGES = ['chunk_and_upload_audio', 'transcribe_and_upload', 'alignment', 'speaker_identification']
+
+
+def synthetic_speech(duration_sec: float, num_speakers: int = 3, seed: int = 0):
+    """
+    Speech-like mono float32 audio: turns of harmonic 'syllables' at a per-speaker pitch, separated by
+    pauses over a low noise floor, so VAD and silence chunking see a realistic voiced/unvoiced pattern.
+    Returns (samples, turns) where turns are the ground-truth {'start', 'end', 'speaker'} intervals.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(duration_sec * SAMPLE_RATE)
+    audio = rng.normal(0.0, 0.003, total).astype(np.float32)
+    pitches = np.linspace(110.0, 240.0, num_speakers)
+    harmonics = np.arange(1, 11)
+    turns = []
+    t = rng.uniform(0.2, 1.0)
+    while t < duration_sec:
+        speaker = int(rng.integers(num_speakers))
+        turn_end = min(t + rng.uniform(1.5, 8.0), duration_sec)
+        start = t
+        while t < turn_end:
+            length = int(rng.uniform(0.12, 0.3) * SAMPLE_RATE)
+            begin = int(t * SAMPLE_RATE)
+            length = min(length, total - begin)
+            if length <= 0:
+                break
+            time_axis = np.arange(length) / SAMPLE_RATE
+            f0 = pitches[speaker] * rng.uniform(0.9, 1.1)
+            wave = (np.sin(2 * np.pi * f0 * harmonics[:, None] * time_axis) / harmonics[:, None]).sum(axis=0)
+            audio[begin:begin + length] += 0.15 * np.hanning(length) * wave
+            t += length / SAMPLE_RATE + rng.uniform(0.02, 0.08)
+        turns.append({'start': round(start, 3), 'end': round(min(t, duration_sec), 3), 'speaker': f"SPEAKER_{speaker:02d}"})
+        t += rng.uniform(0.3, 2.0)
+    return np.clip(audio, -1.0, 1.0), turns
+
+
+def tiled_fixture(path: str, duration_sec: float):
+    """A real recording repeated (and cut) to duration_sec, for benchmarks where the transcript text matters."""
+    pcm = decode_audio_pcm(path)
+    repeats = int(np.ceil(duration_sec * SAMPLE_RATE / len(pcm)))
+    return np.tile(pcm, repeats)[:int(duration_sec * SAMPLE_RATE)]
+
+
+def write_video(samples, path: str) -> str:
+    """Encode samples as the AAC audio track of an MP4, the input format the pipeline expects."""
+    wav_path = write_wav(path + '.wav', samples)
+    ffmpeg.input(wav_path).output(path, acodec='aac', audio_bitrate='64k').overwrite_output().run(quiet=True)
+    os.remove(wav_path)
+    return path
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status.strip())
+
+
+def run_speaker_identification(args, store, video_id, turns, work_dir):
+    """Run speaker/main.py in its own interpreter on the full wav and the diarization (or ground-truth turns)."""
+    audio_path = store.path(AUDIO, f'{video_id}_full.wav')
+    diarization_path = os.path.join(work_dir, 'diarization.json')
+    published = store.path(TRANSCRIPTS, f'{video_id}_diarization.json')
+    if os.path.exists(published):
+        shutil.copyfile(published, diarization_path)
+    else:
+        with open(diarization_path, 'w') as f:
+            json.dump({'segments': turns}, f)
+    embeddings_path = args.speaker_embeddings
+    if not embeddings_path:
+        # A random roster in the embedding model's dimension; scores are meaningless but the work is the same
+        embeddings_path = os.path.join(work_dir, 'embeddings.pt')
+        subprocess.run([
+            args.speaker_python, '-c',
+            f"import torch; torch.manual_seed(0); "
+            f"torch.save({{f'speaker {{i}}': torch.randn(192) for i in range({args.known_speakers})}}, {embeddings_path!r})",
+        ], check=True)
+    output_path = os.path.join(work_dir, 'speakers.json')
+    with stage_timer('speaker_identification', video_id=video_id) as record:
+        record['audio_sec'] = sum(turn['end'] - turn['start'] for turn in turns)
+        subprocess.run([args.speaker_python, str(ROOT / 'speaker' / 'main.py'), audio_path, diarization_path,
+                        embeddings_path, output_path], cwd=ROOT / 'speaker', check=True)
+
+
+async def run_benchmark(args, store, samples, video_id, turns, work_dir):
+    video_path = write_video(samples, os.path.join(work_dir, f'{video_id}.mp4'))
+    await store.upload_blob_async(video_path, VIDEOS, f'{video_id}.mp4')
+    audio_sec = len(samples) / SAMPLE_RATE
+
+    with stage_timer('chunk_and_upload_audio', video_id=video_id) as record:
+        record['audio_sec'] = audio_sec
+        await download_and_prepare.chunk_and_upload_audio(f'{video_id}.mp4', VIDEOS, AUDIO, PROCESSED, args.chunk_length)
+
+    with stage_timer('transcribe_and_upload', video_id=video_id) as record:
+        record['audio_sec'] = audio_sec
+        await transcribe_with_whisper.transcribe_and_upload(video_id, enable_diarization=args.diarize)
+
+    segments = json.loads(await store.download_bytes_async(TRANSCRIPTS, f'{video_id}_transcript.json'))['segments']
+    diarization = await store.download_bytes_async(TRANSCRIPTS, f'{video_id}_diarization.json')
+    speaker_turns = json.loads(diarization)['segments'] if diarization else turns
+    with stage_timer('alignment', video_id=video_id, segments=len(segments), turns=len(speaker_turns)) as record:
+        record['audio_sec'] = audio_sec
+        for _ in range(args.alignment_repeats):
+            assign_speakers(segments, speaker_turns)
+
+
+def summarize(metrics_path: str):
+    """Fold the run's metric records into per-stage totals and per-model load times."""
+    stages, model_loads = {}, {}
+    with open(metrics_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['event'] == 'model_load':
+                model_loads[record['model']] = round(model_loads.get(record['model'], 0.0) + record['seconds'], 3)
+                continue
+            if record['event'] != 'stage':
+                continue
+            stage = stages.setdefault(record['stage'], {'count': 0, 'wall_sec': 0.0, 'audio_sec': 0.0, 'peak_rss_bytes': 0,
+                                                        'worker_peak_rss_bytes': 0, 'errors': 0})
+            stage['count'] += 1
+            stage['wall_sec'] += record['wall_sec']
+            stage['audio_sec'] += record.get('audio_sec') or 0.0
+            stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], record['peak_rss_bytes'])
+            stage['worker_peak_rss_bytes'] = max(stage['worker_peak_rss_bytes'], record.get('worker_peak_rss_bytes', 0))
+            stage['errors'] += record['status'] != 'ok'
+    for stage in stages.values():
+        stage['wall_sec'] = round(stage['wall_sec'], 3)
+        if stage['audio_sec']:
+            stage['rtf'] = round(stage['wall_sec'] / stage['audio_sec'], 4)
+    return stages, model_loads
+
+
+def compare(report, baseline, threshold: float) -> bool:
+    """Print wall time per stage against the baseline report; returns True if any benchmarked stage regressed."""
+    print(f"\nCompared with {baseline['commit']}{' (dirty)' if baseline.get('dirty') else ''}:")
+    regressed = False
+    for name in sorted(set(report['stages']) | set(baseline['stages'])):
+        now, before = report['stages'].get(name), baseline['stages'].get(name)
+        if now is None or before is None:
+            print(f"  {name:32s} {'only in ' + ('baseline' if now is None else 'this run'):>40s}")
+            continue
+        change = (now['wall_sec'] - before['wall_sec']) / before['wall_sec'] if before['wall_sec'] else 0.0
+        # Tiny stages are noisy; a regression has to be both relatively and absolutely significant
+        flagged = name in BENCH_STAGES and change > threshold and now['wall_sec'] - before['wall_sec'] > 0.05
+        regressed |= flagged
+        print(f"  {name:32s} {before['wall_sec']:10.3f}s -> {now['wall_sec']:10.3f}s  {change:+7.1%}{'  REGRESSION' if flagged else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a local blob store")
+    parser.add_argument("--duration", type=float, default=600, help="seconds of audio to generate (default: 600)")
+    parser.add_argument("--chunk-length", type=int, default=120, help="chunk length in seconds (default: 120)")
+    parser.add_argument("--model", default="tiny", help="Whisper model (default: tiny)")
+    parser.add_argument("--backend", default=None, help="ASR backend (default: ASR_BACKEND or openai-whisper)")
+    parser.add_argument("--fixture", help="tile this recording instead of generating synthetic audio")
+    parser.add_argument("--speakers", type=int, default=3, help="speakers in the synthetic audio (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--diarize", action="store_true", help="run pyannote diarization (needs HUGGINGFACE_TOKEN)")
+    parser.add_argument("--alignment-repeats", type=int, default=10, help="assign_speakers runs to time (default: 10)")
+    parser.add_argument("--speaker-python", default=os.getenv("SPEAKER_PYTHON"),
+                        help="Python 3.8 interpreter with speaker/requirements.txt installed; speaker identification is skipped without it")
+    parser.add_argument("--speaker-embeddings", help="known speakers for speaker/main.py (default: a random roster)")
+    parser.add_argument("--known-speakers", type=int, default=50, help="size of the random roster (default: 50)")
+    parser.add_argument("--report", help="where to write the JSON report (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown that counts as a regression (default: 0.10)")
+    parser.add_argument("--keep", action="store_true", help="keep the local blob store and work files")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+    # Set before the inference pool spawns, so its workers inherit them
+    os.environ['METRICS_JSONL'] = metrics_path
+    os.environ['WHISPER_MODEL'] = args.model
+    if args.backend:
+        os.environ['ASR_BACKEND'] = args.backend
+    # Every run must do the full work, not reuse results from an earlier one
+    os.environ['TRANSCRIPTION_CACHE'] = '0'
+    os.environ['STORAGE_BACKEND'] = 'local'
+    os.environ['STORAGE_LOCAL_ROOT'] = os.path.join(work_dir, 'store')
+    store = get_storage()
+
+    if args.fixture:
+        samples, turns = tiled_fixture(args.fixture, args.duration), []
+    else:
+        samples, turns = synthetic_speech(args.duration, args.speakers, args.seed)
+    if not turns:
+        # Alignment and speaker identification still need turns; use fixed-length alternating ones
+        turns = [{'start': float(t), 'end': float(min(t + 5, args.duration)), 'speaker': f"SPEAKER_{(t // 5) % args.speakers:02d}"}
+                 for t in range(0, int(args.duration), 5)]
+
+    video_id = 'bench'
+    started = time.perf_counter()
+    cwd = os.getcwd()
+    # The pipeline writes its temporary wavs to the working directory
+    os.chdir(work_dir)
+    try:
+        asyncio.run(run_benchmark(args, store, samples, video_id, turns, work_dir))
+        if args.speaker_python:
+            run_speaker_identification(args, store, video_id, turns, work_dir)
+    finally:
+        os.chdir(cwd)
+        shutdown_executors()
+
+    commit, dirty = git_revision()
+    stages, model_loads = summarize(metrics_path)
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {
+            'duration_sec': args.duration, 'chunk_length_sec': args.chunk_length, 'model': args.model,
+            'backend': transcribe_with_whisper.model_version(), 'fixture': args.fixture, 'diarize': args.diarize,
+            'chunking': download_and_prepare.chunking_mode(), 'inference_workers': os.getenv('INFERENCE_WORKERS', '1'),
+        },
+        'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpu_count': os.cpu_count()},
+        'total_sec': round(time.perf_counter() - started, 3),
+        'stages': stages,
+        'model_loads': model_loads,
+        'storage': store.stats,
+    }
+
+    report_path = args.report or str(ROOT / 'benchmarks' / 'results' / f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{args.duration:.0f}s of audio, model {report['config']['backend']}, commit {commit}{' (dirty)' if dirty else ''}")
+    for name in BENCH_STAGES + sorted(set(stages) - set(BENCH_STAGES)):
+        if name in stages:
+            stage = stages[name]
+            print(f"  {name:32s} x{stage['count']:<4d} {stage['wall_sec']:10.3f}s  RTF {stage.get('rtf', 0):7.4f}  "
+                  f"peak RSS {stage['peak_rss_bytes'] / 2**20:8.1f} MiB, workers {stage['worker_peak_rss_bytes'] / 2**20:8.1f} MiB")
+    for model, seconds in model_loads.items():
+        print(f"  load {model:27s} {seconds:10.3f}s")
+    print(f"Report written to {report_path}")
+
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(report, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,200 @@
 import asyncio
 import logging
-from utils.azure_blob import download_blob_async, upload_blob_async
-from utils.ffmpeg_tools import extract_audio_to_wav
+from utils.azure_blob import BlobSession, download_blob_async, upload_blob_async, copy_blob_async, delete_blob_async, list_blobs_async
+from utils.ffmpeg_tools import extract_audio_to_wav, segment_audio_to_wavs
+from utils.executors import run_blocking, shutdown_executors
+from utils.pcm import SAMPLE_RATE, decode_audio_pcm, chunk_bounds, memmap_wav, write_wav, wav_duration, WavSlice
+from utils.metrics import stage_timer
+from utils.vad import detect_speech, pack_chunks, timeline_samples
+from utils.chunking import silence_cut_points, overlapping_chunks
+from utils.manifest import VideoManifest, load_manifest, save_manifest, file_sha256
 import os
-import math
 import tempfile
-import ffmpeg
+import numpy as np
+
+async def download_video(video_blob_name: str, videos_container: str = 'videos') -> str:
+    """Download a video blob to a temp file and return its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_video:
+        tmp_video_path = tmp_video.name
+    await download_blob_async(videos_container, video_blob_name, tmp_video_path)
+    return tmp_video_path
+
+def chunking_mode() -> str:
+    """
+    'fixed' cuts fixed-length chunks; 'vad' builds chunks from detected speech only; 'silence' cuts at the
+    quietest point near each chunk boundary and overlaps neighbouring chunks by CHUNK_OVERLAP_SEC.
+    """
+    return os.getenv('AUDIO_CHUNKING', 'fixed')
+
+def plan_silence_chunks(samples, chunk_length_sec: int):
+    """Return [{'timeline': ..., 'owned': ...}, ...] for silence-aligned, overlapping chunks of samples."""
+    search_sec = float(os.getenv('CHUNK_SEARCH_SEC', '30'))
+    overlap_sec = float(os.getenv('CHUNK_OVERLAP_SEC', '2'))
+    cuts = silence_cut_points(samples, chunk_length_sec, search_sec)
+    return overlapping_chunks(cuts, len(samples) / SAMPLE_RATE, overlap_sec)
+
+def write_voiced_chunks(full_wav_path: str, video_id: str, chunk_length_sec: int):
+    """Run VAD over the full wav and write speech-only chunk wavs. Returns [(chunk_path, timeline, owned), ...]."""
+    samples = memmap_wav(full_wav_path)
+    chunks = []
+    for i, timeline in enumerate(pack_chunks(detect_speech(samples), chunk_length_sec)):
+        chunk_path = write_wav(f'{video_id}_chunk_{i+1}.wav', timeline_samples(samples, timeline))
+        chunks.append((chunk_path, timeline, None))
+    return chunks
+
+def write_silence_chunks(full_wav_path: str, video_id: str, chunk_length_sec: int):
+    """Cut the full wav at silence into overlapping chunk wavs. Returns [(chunk_path, timeline, owned), ...]."""
+    samples = memmap_wav(full_wav_path)
+    chunks = []
+    for i, plan in enumerate(plan_silence_chunks(samples, chunk_length_sec)):
+        chunk_path = write_wav(f'{video_id}_chunk_{i+1}.wav', timeline_samples(samples, plan['timeline']))
+        chunks.append((chunk_path, plan['timeline'], plan['owned']))
+    return chunks
 
 async def chunk_and_upload_audio(video_blob_name: str, videos_container: str = 'videos', audio_container: str = 'audio', processed_container: str = 'videos-processed', chunk_length_sec: int = 1800):
     """
     Download video from blob, split audio into 30-min chunks, upload each chunk to audio container, move video to processed container.
     """
+    tmp_video_path = await download_video(video_blob_name, videos_container)
+    await prepare_audio(video_blob_name, tmp_video_path, videos_container, audio_container, processed_container, chunk_length_sec)
+
+async def prepare_audio(video_blob_name: str, tmp_video_path: str, videos_container: str = 'videos', audio_container: str = 'audio', processed_container: str = 'videos-processed', chunk_length_sec: int = 1800, manifest: VideoManifest = None):
+    """
+    Split the audio of an already-downloaded video into chunks, upload them, move the video to the processed container
+    and remove the local video file. Chunk hashes are recorded in the video's manifest so unchanged chunks keep their transcripts.
+    """
     video_id = os.path.splitext(os.path.basename(video_blob_name))[0]
-    # Download video to temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_video:
-        tmp_video_path = tmp_video.name
-    await download_blob_async(videos_container, video_blob_name, tmp_video_path)
-    # Extract full audio to temp wav
+    manifest = manifest or await load_manifest(video_id)
+    manifest.mark_stage('prepare', 'running')
+    try:
+        chunk_blobs = await upload_audio_chunks(tmp_video_path, video_id, audio_container, chunk_length_sec, manifest)
+        # Move video to processed container
+        await copy_blob_async(videos_container, processed_container, video_blob_name)
+        await delete_blob_async(videos_container, video_blob_name)
+        logging.info(f"Moved {video_blob_name} to {processed_container}")
+        await remove_stale_chunks(video_id, audio_container, chunk_blobs)
+        manifest.retain_chunks(chunk_blobs)
+        manifest.mark_stage('prepare', 'done', chunking=chunking_mode(), chunk_length_sec=chunk_length_sec, num_chunks=len(chunk_blobs))
+        await save_manifest(manifest)
+    finally:
+        if os.path.exists(tmp_video_path):
+            os.remove(tmp_video_path)
+
+async def remove_stale_chunks(video_id: str, audio_container: str, chunk_blobs):
+    """Delete chunk blobs of a video that a re-prepare (shorter audio, another chunking mode) no longer produced."""
+    prefix = f"{video_id}_chunk_"
+    stale = [blob for blob in await list_blobs_async(audio_container, prefix=prefix)
+             if blob.startswith(prefix) and blob not in chunk_blobs]
+    await asyncio.gather(*(delete_blob_async(audio_container, blob) for blob in stale))
+    if stale:
+        logging.info(f"Deleted {len(stale)} stale chunk(s) of {video_id}: {stale}")
+
+async def prepare_audio_stream(source: str, video_id: str, audio_container: str = 'audio', chunk_length_sec: int = 1800, input_options: dict = None):
+    """
+    Prepare a video from an audio-only source (a local file or a stream URL ffmpeg can read, with input_options as
+    extra ffmpeg input flags) without a video file or the 'videos' container: decode straight into the 16 kHz mono
+    full wav and chunks, upload them and record them in the manifest.
+    """
+    manifest = await load_manifest(video_id)
+    manifest.mark_stage('prepare', 'running')
+    chunk_blobs = await upload_audio_chunks(source, video_id, audio_container, chunk_length_sec, manifest, input_options)
+    await remove_stale_chunks(video_id, audio_container, chunk_blobs)
+    manifest.retain_chunks(chunk_blobs)
+    manifest.mark_stage('prepare', 'done', chunking=chunking_mode(), chunk_length_sec=chunk_length_sec, num_chunks=len(chunk_blobs), source='audio')
+    await save_manifest(manifest)
+    return manifest
+
+async def upload_audio_chunks(source: str, video_id: str, audio_container: str, chunk_length_sec: int, manifest: VideoManifest, input_options: dict = None):
+    """
+    Decode source once into the full wav and chunk wavs, upload them and record chunk hashes and timelines in the
+    manifest. Local wavs are removed afterwards. Returns the set of chunk blob names.
+    """
     full_wav_path = f'{video_id}_full.wav'
-    await extract_audio_to_wav(tmp_video_path, full_wav_path)
-    # Upload full wav for diarization
-    await upload_blob_async(full_wav_path, container=audio_container, blob_name=full_wav_path)
-    logging.info(f"Uploaded full audio {full_wav_path} to {audio_container}")
-    # Get total duration using ffmpeg probe
-    probe = ffmpeg.probe(full_wav_path)
-    total_sec = float(probe['format']['duration'])
-    num_chunks = math.ceil(total_sec / chunk_length_sec)
     chunk_paths = []
-    for i in range(num_chunks):
-        start = i * chunk_length_sec
-        duration = min(chunk_length_sec, total_sec - start)
-        chunk_file = f'{video_id}_chunk_{i+1}.wav'
-        (
-            ffmpeg
-            .input(full_wav_path, ss=start, t=duration)
-            .output(chunk_file, acodec='pcm_s16le', ac=1, ar='16k')
-            .overwrite_output()
-            .run(quiet=True)
-        )
-        await upload_blob_async(chunk_file, container=audio_container, blob_name=chunk_file)
-        logging.info(f"Uploaded audio chunk {chunk_file} to {audio_container}")
-        chunk_paths.append(chunk_file)
-    # Move video to processed container
-    from azure.storage.blob.aio import BlobServiceClient
-    AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    blob_service_client = BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    )
-    src_client = blob_service_client.get_blob_client(videos_container, video_blob_name)
-    dest_client = blob_service_client.get_blob_client(processed_container, video_blob_name)
-    src_url = src_client.url
-    await dest_client.start_copy_from_url(src_url)
-    await src_client.delete_blob()
-    logging.info(f"Moved {video_blob_name} to {processed_container}")
-    # Clean up
-    for f in [tmp_video_path, full_wav_path] + chunk_paths:
-        if os.path.exists(f):
-            os.remove(f)
+    uploads = []
+    mode = chunking_mode()
+    with stage_timer('prepare_audio', video_id=video_id, chunking=mode) as record:
+        try:
+            if mode in ('vad', 'silence'):
+                # Chunks are cut from the full wav; each chunk's timeline in the manifest restores original timestamps later
+                await extract_audio_to_wav(source, full_wav_path, input_options)
+                uploads.append(asyncio.create_task(upload_blob_async(full_wav_path, container=audio_container, blob_name=full_wav_path)))
+                write_chunks = write_voiced_chunks if mode == 'vad' else write_silence_chunks
+                for chunk_file, timeline, owned in await run_blocking(write_chunks, full_wav_path, video_id, chunk_length_sec):
+                    chunk_paths.append(chunk_file)
+                    manifest.record_chunk(os.path.basename(chunk_file), await run_blocking(file_sha256, chunk_file), timeline, owned)
+                    uploads.append(asyncio.create_task(upload_blob_async(chunk_file, container=audio_container, blob_name=os.path.basename(chunk_file))))
+            else:
+                # Decode once into the full wav and all chunk wavs; upload each chunk as soon as it is finalized
+                async for chunk_file in segment_audio_to_wavs(source, full_wav_path, f'{video_id}_chunk_%d.wav', chunk_length_sec, input_options):
+                    chunk_paths.append(chunk_file)
+                    # Chunk N starts (N-1) * chunk_length_sec into the recording
+                    offset = float((len(chunk_paths) - 1) * chunk_length_sec)
+                    manifest.record_chunk(os.path.basename(chunk_file), await run_blocking(file_sha256, chunk_file),
+                                          [[0.0, offset, float(chunk_length_sec)]])
+                    uploads.append(asyncio.create_task(upload_blob_async(chunk_file, container=audio_container, blob_name=os.path.basename(chunk_file))))
+                # Upload full wav for diarization
+                uploads.append(asyncio.create_task(upload_blob_async(full_wav_path, container=audio_container, blob_name=full_wav_path)))
+            await asyncio.gather(*uploads)
+            record['audio_sec'] = wav_duration(full_wav_path)
+            record['bytes'] = sum(os.path.getsize(path) for path in [full_wav_path] + chunk_paths)
+            logging.info(f"Uploaded full audio and {len(chunk_paths)} chunks for {video_id} to {audio_container}")
+        finally:
+            for task in uploads:
+                task.cancel()
+            for f in [full_wav_path] + chunk_paths:
+                if os.path.exists(f):
+                    os.remove(f)
+    return {os.path.basename(path) for path in chunk_paths}
+
+async def prepare_local_audio(video_path: str, chunk_length_sec: int = 1800):
+    """
+    Local (same-node) alternative to prepare_audio: decode the video once, write the samples to a single local
+    WAV and return (wav_path, chunks) where chunks is a list of (timeline, WavSlice, owned). Inference workers
+    memory-map their slice of the file instead of receiving a pickled copy of the samples. In VAD mode the
+    speech each chunk gathers is written once to a second WAV that the chunks slice instead.
+    Nothing is uploaded; the caller removes the WAV files.
+    """
+    pcm = await run_blocking(decode_audio_pcm, video_path)
+    base = os.path.splitext(os.path.basename(video_path))[0]
+    wav_path = await run_blocking(write_wav, f'/tmp/{base}_local.wav', pcm)
+    mode = chunking_mode()
+    if mode == 'vad':
+        timelines = pack_chunks(await run_blocking(detect_speech, pcm), chunk_length_sec)
+        if not timelines:
+            # No speech at all (silence, music): nothing to transcribe, as in the upload path
+            logging.info(f"No speech detected in {video_path}")
+            return wav_path, []
+        speech = [timeline_samples(pcm, timeline) for timeline in timelines]
+        speech_path = await run_blocking(write_wav, f'/tmp/{base}_local_speech.wav', np.concatenate(speech))
+        chunks, start = [], 0
+        for timeline, samples in zip(timelines, speech):
+            chunks.append((timeline, WavSlice(speech_path, start, start + len(samples)), None))
+            start += len(samples)
+    elif mode == 'silence':
+        plans = await run_blocking(plan_silence_chunks, pcm, chunk_length_sec)
+        chunks = []
+        for plan in plans:
+            _, start, duration = plan['timeline'][0]
+            start = int(start * SAMPLE_RATE)
+            end = min(start + int(duration * SAMPLE_RATE), len(pcm))
+            chunks.append((plan['timeline'], WavSlice(wav_path, start, end), plan['owned']))
+    else:
+        chunks = [
+            ([[0.0, start / SAMPLE_RATE, (end - start) / SAMPLE_RATE]], WavSlice(wav_path, start, end), None)
+            for start, end in chunk_bounds(len(pcm), chunk_length_sec)
+        ]
+    logging.info(f"Decoded {video_path}: {len(pcm) / SAMPLE_RATE:.1f}s of audio in {len(chunks)} chunks")
+    return wav_path, chunks
+
+async def main(video_blob_name: str):
+    async with BlobSession():
+        await chunk_and_upload_audio(video_blob_name)
 
 if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(chunk_and_upload_audio(sys.argv[1]))
+    try:
+        asyncio.run(main(sys.argv[1]))
+    finally:
+        shutdown_executors()
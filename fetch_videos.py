@@ -1,8 +1,14 @@
 import yt_dlp
+import argparse
 import logging
 import sys
 import asyncio
-from utils.azure_blob import upload_blob_async
+from utils.azure_blob import BlobSession, upload_blob_async, list_blobs_async, list_blob_prefixes_async
+from utils.executors import run_blocking, shutdown_executors
+from utils.manifest import manifests_container
+from utils.metrics import stage_timer
+from utils.work_queue import get_work_queue, video_task, audio_task
+from download_and_prepare import prepare_audio_stream
 import os
 
 def parse_input(input_arg):
@@ -25,7 +31,7 @@ def parse_input(input_arg):
         return [input_arg.split('v=')[-1]]
     return [input_arg]
 
-async def fetch_video_ids(playlist_url):
+def _extract_video_ids(playlist_url):
     ydl_opts = {
         'quiet': True,
         'extract_flat': True,
@@ -37,11 +43,14 @@ async def fetch_video_ids(playlist_url):
         info = ydl.extract_info(playlist_url, download=False)
         for entry in info.get('entries', []):
             video_ids.append(entry['id'])
+    return video_ids
+
+async def fetch_video_ids(playlist_url):
+    video_ids = await run_blocking(_extract_video_ids, playlist_url)
     logging.info(f"Fetched {len(video_ids)} video IDs from playlist.")
     return video_ids
 
-async def download_and_upload_video(video_id: str, videos_container: str = 'videos'):
-    logging.info(f"Downloading video {video_id}")
+def _download_video(video_id: str):
     ydl_opts = {
         'format': 'bestvideo+bestaudio/best',  # ensure both video and audio are downloaded
         'outtmpl': f'{video_id}.mp4',
@@ -51,28 +60,115 @@ async def download_and_upload_video(video_id: str, videos_container: str = 'vide
     }
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([f'https://www.youtube.com/watch?v={video_id}'])
-    await upload_blob_async(f'{video_id}.mp4', container=videos_container, blob_name=f'{video_id}.mp4')
-    logging.info(f"Uploaded {video_id}.mp4 to {videos_container}")
-    if os.path.exists(f'{video_id}.mp4'):
-        os.remove(f'{video_id}.mp4')
+
+async def download_and_upload_video(video_id: str, videos_container: str = 'videos'):
+    logging.info(f"Downloading video {video_id}")
+    try:
+        await run_blocking(_download_video, video_id)
+        await upload_blob_async(f'{video_id}.mp4', container=videos_container, blob_name=f'{video_id}.mp4')
+        logging.info(f"Uploaded {video_id}.mp4 to {videos_container}")
+    finally:
+        if os.path.exists(f'{video_id}.mp4'):
+            os.remove(f'{video_id}.mp4')
+
+def _resolve_audio_stream(video_id: str):
+    """Return (url, ffmpeg input options) of the best audio-only stream, without downloading it."""
+    ydl_opts = {'format': 'bestaudio/best', 'quiet': True, 'noplaylist': True}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
+    headers = ''.join(f"{key}: {value}\r\n" for key, value in (info.get('http_headers') or {}).items())
+    # Long recordings outlive single HTTP connections; let ffmpeg resume the stream
+    options = {'reconnect': 1, 'reconnect_streamed': 1, 'reconnect_delay_max': 5}
+    if headers:
+        options['headers'] = headers
+    return info['url'], options
+
+async def ingest_audio(video_id: str, audio_container: str = 'audio'):
+    """
+    Audio-only ingestion: ffmpeg reads the audio stream directly and decodes it into the 16 kHz mono full wav and
+    chunks, which are uploaded to the audio container. No mp4 is downloaded or stored in the videos container.
+    """
+    logging.info(f"Ingesting audio of {video_id}")
+    url, input_options = await run_blocking(_resolve_audio_stream, video_id)
+    await prepare_audio_stream(url, video_id, audio_container, input_options=input_options)
+    logging.info(f"Prepared audio of {video_id} in {audio_container}")
+
+async def existing_video_ids(videos_container: str = 'videos'):
+    """IDs already pending in the videos container or already prepared (they have a manifest)."""
+    video_blobs = await list_blobs_async(videos_container)
+    # Only the '<video_id>/' directories; listing every blob would also walk each video's chunk results
+    manifest_dirs = await list_blob_prefixes_async(manifests_container())
+    ids = {os.path.splitext(os.path.basename(blob))[0] for blob in video_blobs}
+    ids.update(prefix.rstrip('/') for prefix in manifest_dirs)
+    return ids
+
+async def ingest(ids, audio_only: bool = False, workers: int = 4, skip_existing: bool = True, enqueue: bool = False):
+    """
+    Fetch videos concurrently, at most `workers` at a time. With skip_existing, IDs already in storage are not fetched
+    again, so re-syncing a playlist only pulls new entries. Returns the IDs that failed.
+    """
+    videos_container = os.getenv('AZURE_BLOB_VIDEOS_CONTAINER', 'videos')
+    audio_container = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    if skip_existing:
+        existing = await existing_video_ids(videos_container)
+        skipped = [vid for vid in ids if vid in existing]
+        ids = [vid for vid in ids if vid not in existing]
+        logging.info(f"Skipping {len(skipped)} video(s) already in storage; fetching {len(ids)}")
+    queue = get_work_queue() if enqueue else None
+    slots = asyncio.Semaphore(max(1, workers))
+    failed = []
+
+    async def fetch(vid):
+        async with slots:
+            try:
+                with stage_timer('fetch', video_id=vid, mode='audio' if audio_only else 'video'):
+                    if audio_only:
+                        await ingest_audio(vid, audio_container)
+                    else:
+                        await download_and_upload_video(vid, videos_container)
+                if queue is not None:
+                    await queue.enqueue(audio_task(vid) if audio_only else video_task(f'{vid}.mp4'))
+            except Exception as e:
+                logging.error(f"Failed to fetch {vid}: {e}", exc_info=True)
+                failed.append(vid)
+
+    try:
+        await asyncio.gather(*(fetch(vid) for vid in ids))
+    finally:
+        if queue is not None:
+            await queue.close()
+    logging.info(f"Fetched {len(ids) - len(failed)} of {len(ids)} video(s)")
+    return failed
 
 async def main():
     logging.basicConfig(level=logging.INFO)
-    if len(sys.argv) == 2:
-        input_arg = sys.argv[1]
-        # If the input is a path to a .json file, read it
-        if input_arg.lower().endswith('.json') and os.path.exists(input_arg):
-            with open(input_arg, 'r', encoding='utf-8') as f:
-                input_arg = f.read()
-    else:
-        print("Usage: fetch_videos.py <playlist_url|video_id|[\"id1\",...]|file.json >")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Fetch playlist videos (or just their audio) into blob storage")
+    parser.add_argument("input", help='playlist URL, video id, comma-separated ids, JSON list ["id1",...] or a .json file')
+    parser.add_argument("--audio-only", action="store_true", default=os.getenv('FETCH_AUDIO_ONLY') == '1',
+                        help="stream only the audio straight into 16 kHz chunks in the audio container")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('FETCH_WORKERS', '4')),
+                        help="videos fetched at once")
+    parser.add_argument("--no-skip", action="store_true", help="fetch IDs even if they are already in storage")
+    parser.add_argument("--enqueue", action="store_true", help="enqueue a work queue task for each fetched video")
+    args = parser.parse_args()
+    input_arg = args.input
+    # If the input is a path to a .json file, read it
+    if input_arg.lower().endswith('.json') and os.path.exists(input_arg):
+        with open(input_arg, 'r', encoding='utf-8') as f:
+            input_arg = f.read()
     ids = parse_input(input_arg)
     if ids is None:
         # Playlist URL
         ids = await fetch_video_ids(input_arg)
-    for vid in ids:
-        await download_and_upload_video(vid)
+    async with BlobSession():
+        failed = await ingest(ids, audio_only=args.audio_only, workers=args.workers,
+                              skip_existing=not args.no_skip, enqueue=args.enqueue)
+    if failed:
+        logging.error(f"{len(failed)} video(s) failed: {failed}")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_executors()
@@ -1,18 +1,114 @@
 import asyncio
 import logging
-from utils.azure_blob import list_blobs_async
-from download_and_prepare import chunk_and_upload_audio
-from transcribe_with_whisper import transcribe_and_upload
+from utils.azure_blob import BlobSession, list_blobs_async
+from utils.scheduler import Stage, run_stages
+from download_and_prepare import download_video, prepare_audio
+from transcribe_with_whisper import transcribe_chunks, diarize_video, publish_transcript, publish_diarization, publish_speaker_script, publish_compact_transcript, compact_output_enabled, needs_publish
+from utils.manifest import load_manifest, save_manifest
+from utils.whisper_wrapper import model_version
+from utils.executors import shutdown_executors
+from utils.metrics import start_metrics_server
 import os
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Default number of videos each stage works on at once; override with PIPELINE_<STAGE>_CONCURRENCY.
+DEFAULT_STAGE_CONCURRENCY = {
+    'download': 2,
+    'prepare': 2,
+    'transcribe': 1,
+    'diarize': 1,
+    'publish': 4,
+}
+
+def _stage(name, func):
+    concurrency = int(os.getenv(f'PIPELINE_{name.upper()}_CONCURRENCY', DEFAULT_STAGE_CONCURRENCY[name]))
+    queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '2'))
+    return Stage(name, func, concurrency=concurrency, queue_size=queue_size)
+
+def build_stages(videos_container, audio_container, processed_container, enable_diarization):
+    """Build the download -> prepare -> transcribe -> diarize -> publish stages for one pipeline run."""
+    async def download(job):
+        job['manifest'] = await load_manifest(job['video_id'])
+        job['video_path'] = await download_video(job['video_blob'], videos_container)
+        return job
+
+    async def prepare(job):
+        await prepare_audio(
+            video_blob_name=job['video_blob'],
+            tmp_video_path=job.pop('video_path'),
+            videos_container=videos_container,
+            audio_container=audio_container,
+            processed_container=processed_container,
+            manifest=job['manifest']
+        )
+        return job
+
+    async def transcribe(job):
+        video_id = job['video_id']
+        if 'manifest' not in job:
+            job['manifest'] = await load_manifest(video_id)
+            # Audio-only reruns skip videos whose outputs are already current
+            if job['manifest'].is_up_to_date(model_version(), require_diarization=enable_diarization):
+                logging.info(f"{video_id} is already transcribed with {model_version()}; skipping")
+                return None
+        logging.info(f"Processing video ID: {video_id}")
+        job['segments'] = await transcribe_chunks(video_id, audio_container, job['manifest'])
+        # Nothing to diarize or publish without chunks, or when no chunk changed since the last publish
+        if job['segments'] is None:
+            return None
+        if not needs_publish(job['manifest'], enable_diarization):
+            logging.info(f"Outputs for {video_id} are up to date; skipping diarization and publish")
+            return None
+        return job
+
+    async def diarize(job):
+        job['speakers'] = None
+        if enable_diarization:
+            try:
+                job['speakers'] = await diarize_video(job['video_id'], audio_container)
+                job['manifest'].mark_stage('diarize', 'done')
+            except Exception as e:
+                logging.error(f"Speaker diarization failed for {job['video_id']}: {e}", exc_info=True)
+                logging.info(f"Continuing with basic transcript only for {job['video_id']}")
+                job['manifest'].mark_stage('diarize', 'failed', error=str(e))
+        return job
+
+    async def publish(job):
+        video_id = job['video_id']
+        manifest = job['manifest']
+        manifest.record_output(f'{video_id}_transcript.json', await publish_transcript(video_id, job['segments']))
+        if job['speakers'] is not None:
+            manifest.record_output(f'{video_id}_diarization.json', await publish_diarization(video_id, job['speakers']))
+        manifest.record_output(f'{video_id}_speaker_script.txt', await publish_speaker_script(video_id, job['segments'], job['speakers']))
+        if compact_output_enabled():
+            manifest.record_output(f'{video_id}_transcript.trx', await publish_compact_transcript(video_id, job['segments']))
+        manifest.mark_stage('publish', 'done', model_version=model_version(), diarized=job['speakers'] is not None)
+        await save_manifest(manifest)
+        logging.info(f"Pipeline complete for {video_id}")
+        return job
+
+    return {
+        'download': _stage('download', download),
+        'prepare': _stage('prepare', prepare),
+        'transcribe': _stage('transcribe', transcribe),
+        'diarize': _stage('diarize', diarize),
+        'publish': _stage('publish', publish),
+    }
+
+async def main():
+    start_metrics_server()
+    # One pooled blob client for the whole run
+    async with BlobSession():
+        await run_pipeline()
+
 async def run_pipeline():
     """
     For each video in the 'videos' container, extract audio, upload to 'audio',
     move processed video to 'videos-processed', and (optionally) transcribe.
+    Videos move through the stages concurrently, bounded per stage.
     """
     videos_container = os.getenv('AZURE_BLOB_VIDEOS_CONTAINER', 'videos')
     processed_container = os.getenv('AZURE_BLOB_PROCESSED_VIDEOS_CONTAINER')
@@ -26,24 +122,32 @@ async def run_pipeline():
     if not video_blobs:
         logging.info("No videos found in the container. Proceeding with audio transcription.")
         audio_blobs = await list_blobs_async(audio_container)
-        video_ids = set(blob.split('_chunk_')[0] for blob in audio_blobs)
-        for video_id in video_ids:
-            logging.info(f"Processing transcription for video ID: {video_id}")
-            await transcribe_and_upload(video_id, enable_diarization=True)  # Disable diarization for stability
-        return
-
-    for video_blob in video_blobs:
-        await chunk_and_upload_audio(
-            video_blob_name=video_blob,
-            videos_container=videos_container,
-            audio_container=audio_container,
-            processed_container=processed_container
+        video_ids = sorted(set(blob.split('_chunk_')[0] for blob in audio_blobs if '_chunk_' in blob))
+        stages = build_stages(videos_container, audio_container, processed_container, enable_diarization=True)
+        jobs = [{'video_id': video_id} for video_id in video_ids]
+        _, failures = await run_stages(
+            jobs,
+            [stages['transcribe'], stages['diarize'], stages['publish']],
+            describe=lambda job: job['video_id'],
+            collect=False
         )
-        video_id = os.path.splitext(os.path.basename(video_blob))[0]
-        logging.info(f"Processing video ID: {video_id}")
-        await transcribe_and_upload(video_id, enable_diarization=False)  # Disable diarization for stability
-        logging.info(f"Pipeline complete for {video_id}")
+    else:
+        # Disable diarization for stability
+        stages = build_stages(videos_container, audio_container, processed_container, enable_diarization=False)
+        jobs = [
+            {'video_blob': video_blob, 'video_id': os.path.splitext(os.path.basename(video_blob))[0]}
+            for video_blob in video_blobs
+        ]
+        _, failures = await run_stages(jobs, list(stages.values()), describe=lambda job: job['video_id'], collect=False)
+
+    for stage_name, job, error in failures:
+        logging.error(f"{job['video_id']} failed at stage {stage_name}: {error}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} video(s) failed; see log for details")
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(run_pipeline())
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_executors()
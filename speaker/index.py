@@ -0,0 +1,159 @@
+"""
+speaker/index.py
+
+On-disk speaker embedding index. An index directory holds:
+- embeddings.f32: a compact row-major float32 matrix, one L2-normalized embedding per speaker
+- ids.json: the embedding dimension plus the speaker id and enrollment count of each row
+
+The matrix is memory-mapped for lookup and grown by appending rows, so the index is built once
+and shared by every job instead of being reloaded and re-normalized per run.
+
+Usage:
+    python index.py enroll <index_dir> <speaker_id> <audio.wav> [--start S --end E]
+    python index.py import-pt <index_dir> <embeddings.pt>
+    python index.py list <index_dir>
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.f32"
+IDS_FILE = "ids.json"
+
+class SpeakerIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.dim = None
+        self.ids = []
+        self.counts = []
+        self._matrix = None
+        ids_path = os.path.join(directory, IDS_FILE)
+        if os.path.exists(ids_path):
+            with open(ids_path) as f:
+                table = json.load(f)
+            self.dim = table["dim"]
+            self.ids = table["ids"]
+            self.counts = table["counts"]
+        self._rows = {speaker_id: row for row, speaker_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def _embeddings_path(self):
+        return os.path.join(self.directory, EMBEDDINGS_FILE)
+
+    @property
+    def matrix(self):
+        """Memory-mapped (speakers, dim) matrix of normalized embeddings."""
+        if self._matrix is None and self.ids:
+            # Only rows listed in ids.json are valid; a partially written row is ignored and overwritten by the next enroll
+            self._matrix = np.memmap(self._embeddings_path, dtype=np.float32, mode='r', shape=(len(self.ids), self.dim))
+        return self._matrix
+
+    def _save_table(self):
+        tmp_path = os.path.join(self.directory, IDS_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"dim": self.dim, "ids": self.ids, "counts": self.counts}, f)
+        os.replace(tmp_path, os.path.join(self.directory, IDS_FILE))
+
+    def enroll(self, speaker_id, embedding):
+        """Add a speaker, or fold another embedding into an enrolled speaker's running mean."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        vector = vector / (np.linalg.norm(vector) + 1e-9)
+        os.makedirs(self.directory, exist_ok=True)
+        if self.dim is None:
+            self.dim = int(vector.shape[0])
+        elif vector.shape[0] != self.dim:
+            raise ValueError(f"Embedding has dimension {vector.shape[0]}, index expects {self.dim}")
+        self._matrix = None
+        row = self._rows.get(speaker_id)
+        if row is None:
+            # Write at the end of the valid rows, not the end of the file: a partial write left by an
+            # interrupted enroll would otherwise shift every later row
+            mode = 'r+b' if os.path.exists(self._embeddings_path) else 'wb'
+            with open(self._embeddings_path, mode) as f:
+                f.seek(len(self.ids) * self.dim * 4)
+                f.write(vector.tobytes())
+                f.truncate()
+            self._rows[speaker_id] = len(self.ids)
+            self.ids.append(speaker_id)
+            self.counts.append(1)
+        else:
+            matrix = np.memmap(self._embeddings_path, dtype=np.float32, mode='r+', shape=(len(self.ids), self.dim))
+            count = self.counts[row]
+            updated = matrix[row] * count + vector
+            matrix[row] = updated / (np.linalg.norm(updated) + 1e-9)
+            matrix.flush()
+            del matrix
+            self.counts[row] = count + 1
+        self._save_table()
+
+    def search(self, queries, k=1, block_size=4096):
+        """
+        Nearest enrolled speakers by cosine similarity. Returns (ids, scores), each (len(queries), k),
+        best first. Queries are scored in blocks so memory stays bounded for large rosters.
+        """
+        if not self.ids:
+            raise ValueError(f"Speaker index {self.directory} is empty")
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-9)
+        k = min(k, len(self.ids))
+        matrix = self.matrix
+        top_rows = np.empty((len(queries), k), dtype=np.int64)
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), block_size):
+            scores = queries[start:start + block_size] @ matrix.T
+            # argpartition picks the k best without sorting the whole roster
+            rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            row_scores = np.take_along_axis(scores, rows, axis=1)
+            order = np.argsort(-row_scores, axis=1)
+            top_rows[start:start + block_size] = np.take_along_axis(rows, order, axis=1)
+            top_scores[start:start + block_size] = np.take_along_axis(row_scores, order, axis=1)
+        ids = [[self.ids[row] for row in rows] for rows in top_rows]
+        return ids, top_scores
+
+def _enroll_from_audio(args, index):
+    import torch
+    from pyannote.audio.pipelines.speaker_verification import PretrainedSpeakerEmbedding
+    from main import EMBEDDING_MODEL, load_audio, embed_segments
+    model = PretrainedSpeakerEmbedding(EMBEDDING_MODEL, device=torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+    audio, sr = load_audio(args.audio)
+    end = args.end if args.end is not None else len(audio) / sr
+    embedding = embed_segments(model, audio, sr, [{"start": args.start, "end": end}], max_duration=end - args.start)[0]
+    index.enroll(args.speaker_id, embedding)
+    print(f"Enrolled {args.speaker_id} ({index.counts[index.ids.index(args.speaker_id)]} sample(s)); index has {len(index)} speakers")
+
+def _import_pt(args, index):
+    import torch
+    known = torch.load(args.embeddings)
+    for speaker_id, embedding in known.items():
+        index.enroll(speaker_id, np.asarray(embedding))
+    print(f"Imported {len(known)} speakers; index has {len(index)} speakers")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the on-disk speaker embedding index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enroll = commands.add_parser("enroll", help="Add or update a speaker from an audio sample")
+    enroll.add_argument("index_dir")
+    enroll.add_argument("speaker_id")
+    enroll.add_argument("audio")
+    enroll.add_argument("--start", type=float, default=0.0)
+    enroll.add_argument("--end", type=float, default=None)
+    import_pt = commands.add_parser("import-pt", help="Enroll every speaker of a .pt embeddings dict")
+    import_pt.add_argument("index_dir")
+    import_pt.add_argument("embeddings")
+    list_cmd = commands.add_parser("list", help="Show enrolled speakers")
+    list_cmd.add_argument("index_dir")
+    args = parser.parse_args()
+
+    index = SpeakerIndex(args.index_dir)
+    if args.command == "enroll":
+        _enroll_from_audio(args, index)
+    elif args.command == "import-pt":
+        _import_pt(args, index)
+    else:
+        for speaker_id, count in zip(index.ids, index.counts):
+            print(f"{speaker_id}\t{count}")
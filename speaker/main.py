@@ -1,68 +1,185 @@
 """
 speaker/main.py
 
-Speaker identification app for modular pipeline. This script loads diarization results and audio, computes speaker embeddings using pyannote.audio, compares to known embeddings (.pt file), and outputs labeled diarization results. Requires Python 3.8, pyannote.audio==2.1.1, and torch.
+Speaker identification app for modular pipeline. This script loads diarization results and audio, computes speaker embeddings using pyannote.audio, compares to known embeddings (a speaker index directory built with index.py, or a .pt file), and outputs labeled diarization results. Requires Python 3.8, pyannote.audio==2.1.1, and torch.
+
+The audio is opened once (memory-mapped when it is a PCM WAV), segments are embedded in padded
+batches straight from memory, and every segment is scored against all known speakers with a
+single cosine-similarity matrix product.
 """
 
 import os
-import torch
+import sys
 import json
+import time
+import resource
+import argparse
+from contextlib import contextmanager
 import numpy as np
 import soundfile as sf
-from pyannote.audio import Inference
+import torch
 from pyannote.audio.pipelines.speaker_verification import PretrainedSpeakerEmbedding
 
+EMBEDDING_MODEL = "speechbrain/spkrec-ecapa-voxceleb"
+
+@contextmanager
+def timed(stage, **fields):
+    """
+    Emit a JSON line with the wall time and peak RSS of a stage, in the same shape as the pipeline's
+    utils/metrics records (this app runs in its own Python 3.8 environment and cannot import them).
+    """
+    record = dict(fields)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield record
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record.update(ts=round(time.time(), 3), event="stage", pid=os.getpid(), stage=stage, status=status,
+                      wall_sec=round(time.perf_counter() - started, 3),
+                      peak_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        line = json.dumps(record)
+        path = os.getenv("METRICS_JSONL")
+        if path:
+            with open(path, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+
 def load_known_embeddings(embeddings_path):
-    return torch.load(embeddings_path)
+    """Return (names, matrix) for a .pt dict of {speaker name: embedding vector}."""
+    known = torch.load(embeddings_path)
+    if not known:
+        raise ValueError(f"No speaker embeddings in {embeddings_path}")
+    names = list(known.keys())
+    matrix = np.stack([np.asarray(known[name], dtype=np.float32).reshape(-1) for name in names])
+    return names, matrix
 
-def cosine_similarity(a, b):
-    a = a / np.linalg.norm(a)
-    b = b / np.linalg.norm(b)
-    return np.dot(a, b)
+def normalize_rows(matrix):
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-9)
 
-def extract_audio_segment(audio_path, start, end):
-    data, sr = sf.read(audio_path)
-    start_sample = int(start * sr)
-    end_sample = int(end * sr)
-    return data[start_sample:end_sample], sr
+def cosine_similarity_matrix(a, b):
+    """Cosine similarity of every row of a against every row of b, shape (len(a), len(b))."""
+    return normalize_rows(a) @ normalize_rows(b).T
 
-def identify_speakers(audio_path, diarization_path, embeddings_path, output_path, threshold=0.75):
+def match_speakers(embeddings_path, segment_matrix, top_k):
+    """
+    Top-k known speakers per segment embedding as (ids, scores). embeddings_path is either a speaker
+    index directory (see index.py) or a legacy .pt dict of {speaker name: embedding vector}.
+    """
+    if os.path.isdir(embeddings_path):
+        from index import SpeakerIndex
+        return SpeakerIndex(embeddings_path).search(segment_matrix, k=top_k)
+    names, known_matrix = load_known_embeddings(embeddings_path)
+    scores = cosine_similarity_matrix(segment_matrix, known_matrix)
+    top = np.argsort(-scores, axis=1)[:, :min(top_k, len(names))]
+    return [[names[j] for j in row] for row in top], np.take_along_axis(scores, top, axis=1)
+
+def _wav_data_offset(path):
+    """Byte offset of the PCM data chunk of a WAV file."""
+    with open(path, 'rb') as f:
+        f.seek(12)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            size = int.from_bytes(header[4:], 'little')
+            if header[:4] == b'data':
+                return f.tell()
+            f.seek(size + (size & 1), 1)
+
+def load_audio(audio_path):
+    """
+    Open the audio once. 16-bit PCM WAVs are memory-mapped as int16 (frames, channels) so only the
+    segments actually used are paged in; other formats are decoded into memory once.
+    """
+    info = sf.info(audio_path)
+    if info.format == 'WAV' and info.subtype == 'PCM_16':
+        data = np.memmap(audio_path, dtype=np.int16, mode='r', offset=_wav_data_offset(audio_path),
+                         shape=(info.frames, info.channels))
+    else:
+        data = sf.read(audio_path, dtype='float32', always_2d=True)[0]
+    return data, info.samplerate
+
+def segment_waveform(audio, sr, start, end, target_sr):
+    """Mono float32 samples for [start, end) seconds, resampled to target_sr."""
+    samples = audio[int(start * sr):int(end * sr)]
+    samples = samples.astype(np.float32)
+    if audio.dtype == np.int16:
+        samples /= 32768.0
+    samples = samples.mean(axis=1)
+    if sr != target_sr:
+        import torchaudio
+        samples = torchaudio.functional.resample(torch.from_numpy(samples), sr, target_sr).numpy()
+    return samples
+
+def embed_segments(model, audio, sr, segments, batch_size=32, max_duration=30.0):
+    """Embed segments in padded batches; returns an array (len(segments), dim)."""
+    target_sr = getattr(model, 'sample_rate', 16000)
+    # Sorting by duration keeps padding inside each batch small
+    order = sorted(range(len(segments)), key=lambda i: segments[i]["end"] - segments[i]["start"])
+    embeddings = [None] * len(segments)
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start:batch_start + batch_size]
+        waves = []
+        for i in batch:
+            start = segments[i]["start"]
+            end = min(segments[i]["end"], start + max_duration)
+            waves.append(segment_waveform(audio, sr, start, end, target_sr))
+        length = max(len(w) for w in waves)
+        waveforms = torch.zeros(len(batch), 1, length)
+        masks = torch.zeros(len(batch), length)
+        for row, wave in enumerate(waves):
+            waveforms[row, 0, :len(wave)] = torch.from_numpy(wave)
+            masks[row, :len(wave)] = 1.0
+        batch_embeddings = np.asarray(model(waveforms, masks=masks))
+        for row, i in enumerate(batch):
+            embeddings[i] = batch_embeddings[row]
+    return np.stack(embeddings)
+
+def identify_speakers(audio_path, diarization_path, embeddings_path, output_path, threshold=0.75, top_k=3,
+                      batch_size=32, min_duration=0.5):
     # Load diarization segments
     with open(diarization_path, 'r') as f:
         diarization = json.load(f)["segments"]
-    # Load known speaker embeddings
-    known_embeddings = load_known_embeddings(embeddings_path)
-    # Assume known_embeddings is a dict: {"Speaker X": embedding_vector}
-    target_emb = known_embeddings["Speaker X"]
-    # Initialize pyannote speaker embedding model
-    model = PretrainedSpeakerEmbedding(
-        "speechbrain/spkrec-ecapa-voxceleb",
-        device="cuda" if torch.cuda.is_available() else "cpu"
-    )
-    inference = Inference(model, window="whole")
-    # For each segment, compute embedding and compare to known
+    with timed("speaker_load_model", model=EMBEDDING_MODEL):
+        model = PretrainedSpeakerEmbedding(
+            EMBEDDING_MODEL,
+            device=torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        )
+    audio, sr = load_audio(audio_path)
+    # Segments too short for a stable embedding keep their diarization label
+    usable = [seg for seg in diarization if seg["end"] - seg["start"] >= min_duration]
     for seg in diarization:
-        start, end = seg["start"], seg["end"]
-        segment_audio, sr = extract_audio_segment(audio_path, start, end)
-        # Save segment to temp file for inference
-        with sf.SoundFile("_tmp.wav", 'w', sr, segment_audio.shape[1] if len(segment_audio.shape) > 1 else 1) as f:
-            f.write(segment_audio)
-        emb = inference("_tmp.wav")
-        sim = cosine_similarity(emb, target_emb)
-        # If match, label as 'Speaker X', else keep diarization speaker label
-        if sim >= threshold:
-            seg["speaker_label"] = "Speaker X"
-        else:
-            seg["speaker_label"] = seg["speaker"]  # Always keep diarization label for non-matches
-        os.remove("_tmp.wav")
+        seg["speaker_label"] = seg["speaker"]
+        seg["matches"] = []
+    if usable:
+        with timed("speaker_embed", segments=len(usable)) as record:
+            segment_matrix = embed_segments(model, audio, sr, usable, batch_size=batch_size)
+            record["audio_sec"] = round(sum(seg["end"] - seg["start"] for seg in usable), 3)
+        with timed("speaker_match", segments=len(usable)):
+            ids, scores = match_speakers(embeddings_path, segment_matrix, top_k)
+        for seg, seg_ids, seg_scores in zip(usable, ids, scores):
+            seg["matches"] = [{"speaker": speaker_id, "score": float(score)} for speaker_id, score in zip(seg_ids, seg_scores)]
+            # If the best match clears the threshold use it, else keep the diarization label
+            if seg_scores[0] >= threshold:
+                seg["speaker_label"] = seg_ids[0]
     # Save labeled diarization
     with open(output_path, 'w') as f:
         json.dump({"segments": diarization}, f, indent=2)
 
 if __name__ == "__main__":
     # Example usage: python main.py audio.wav diarization.json embeddings.pt output.json
-    import sys
-    if len(sys.argv) != 5:
-        print("Usage: python main.py <audio.wav> <diarization.json> <embeddings.pt> <output.json>")
-        exit(1)
-    identify_speakers(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    parser = argparse.ArgumentParser(description="Label diarization segments with known speakers")
+    parser.add_argument("audio")
+    parser.add_argument("diarization")
+    parser.add_argument("embeddings")
+    parser.add_argument("output")
+    parser.add_argument("--threshold", type=float, default=0.75)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("SPEAKER_BATCH_SIZE", "32")))
+    args = parser.parse_args()
+    identify_speakers(args.audio, args.diarization, args.embeddings, args.output,
+                      threshold=args.threshold, top_k=args.top_k, batch_size=args.batch_size)
@@ -4,26 +4,34 @@ from pathlib import Path
 # Ensure project root is in sys.path for imports
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
+import argparse
 import asyncio
 import logging
-from utils.azure_blob import list_blobs_async, delete_blob_async
+from utils.azure_blob import BlobSession
+from utils.blob_bulk import find_blobs, delete_blobs_bulk, parse_date
 from dotenv import load_dotenv
 import os
 
 # Load environment variables from .env file
 load_dotenv()
 
-async def clear_transcripts_container():
+async def clear_transcripts_container(prefix=None, modified_before=None, modified_after=None, dry_run=False):
     transcripts_container = os.getenv("AZURE_BLOB_TRANSCRIPTS_CONTAINER", "transcripts")
-
-    # List all blobs in the transcripts container
-    blobs_to_delete = await list_blobs_async(transcripts_container)
-
-    for blob_name in blobs_to_delete:
-        # Delete blob from the transcripts container
-        await delete_blob_async(transcripts_container, blob_name)
-        logging.info(f"Deleted {blob_name} from {transcripts_container}")
+    async with BlobSession():
+        # List the matching blobs, then delete them in batches
+        blobs = await find_blobs(transcripts_container, prefix, modified_before, modified_after)
+        result = await delete_blobs_bulk(transcripts_container, [blob['name'] for blob in blobs], dry_run=dry_run)
+    if result['failed']:
+        logging.error(f"{len(result['failed'])} blob(s) could not be deleted from {transcripts_container}")
+    return result
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(clear_transcripts_container())
+    parser = argparse.ArgumentParser(description="Delete blobs from the transcripts container")
+    parser.add_argument("--prefix", help="only blobs whose names start with this, e.g. a video id")
+    parser.add_argument("--before", type=parse_date, help="only blobs last modified before this date (UTC)")
+    parser.add_argument("--after", type=parse_date, help="only blobs last modified on or after this date (UTC)")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be deleted without deleting")
+    args = parser.parse_args()
+    result = asyncio.run(clear_transcripts_container(args.prefix, args.before, args.after, args.dry_run))
+    sys.exit(1 if result['failed'] else 0)
@@ -1,8 +1,16 @@
+import sys
+from pathlib import Path
+
+# Ensure project root is in sys.path for imports
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
 import asyncio
 import logging
 import os
 from dotenv import load_dotenv
-from utils.azure_blob import list_blobs_async, copy_blob_async, delete_blob_async
+from utils.azure_blob import BlobSession
+from utils.blob_bulk import find_blobs, copy_blobs_bulk, parse_date
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,23 +19,29 @@ load_dotenv()
 videos_processed_container = os.getenv("AZURE_BLOB_PROCESSED_VIDEOS_CONTAINER", "videos-processed")
 videos_container = os.getenv("AZURE_BLOB_VIDEOS_CONTAINER", "videos")
 
-async def copy_and_cleanup():
-    # List all blobs in the videos-processed container
-    blobs_to_copy = await list_blobs_async(videos_processed_container)
-
-    for blob_name in blobs_to_copy:
-        # Copy blob to the videos container
-        await copy_blob_async(
+async def copy_and_cleanup(prefix=None, modified_before=None, modified_after=None, keep_source=False, dry_run=False):
+    """Move processed videos back into the videos container; a source is only deleted once its copy has completed."""
+    async with BlobSession():
+        blobs = await find_blobs(videos_processed_container, prefix, modified_before, modified_after)
+        result = await copy_blobs_bulk(
             source_container=videos_processed_container,
             destination_container=videos_container,
-            blob_name=blob_name
+            blob_names=[blob['name'] for blob in blobs],
+            delete_source=not keep_source,
+            dry_run=dry_run
         )
-        logging.info(f"Copied {blob_name} from {videos_processed_container} to {videos_container}")
-
-        # Delete blob from the videos-processed container
-        await delete_blob_async(videos_processed_container, blob_name)
-        logging.info(f"Deleted {blob_name} from {videos_processed_container}")
+    if result['failed']:
+        logging.error(f"{len(result['failed'])} blob(s) could not be moved: {result['failed'][:10]}")
+    return result
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(copy_and_cleanup())
+    parser = argparse.ArgumentParser(description=f"Copy blobs from {videos_processed_container} back to {videos_container} and delete the originals")
+    parser.add_argument("--prefix", help="only blobs whose names start with this")
+    parser.add_argument("--before", type=parse_date, help="only blobs last modified before this date (UTC)")
+    parser.add_argument("--after", type=parse_date, help="only blobs last modified on or after this date (UTC)")
+    parser.add_argument("--keep-source", action="store_true", help=f"copy without deleting from {videos_processed_container}")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be copied without copying")
+    args = parser.parse_args()
+    result = asyncio.run(copy_and_cleanup(args.prefix, args.before, args.after, args.keep_source, args.dry_run))
+    sys.exit(1 if result['failed'] else 0)
@@ -17,39 +17,27 @@ Purpose:
 """
 
 import asyncio
+import contextlib
 import logging
 import os
 import tempfile
 import json
-from utils.azure_blob import download_blob_async, upload_blob_async, list_blobs_async
-from utils.whisper_wrapper import transcribe_audio
-from pyannote.audio import Pipeline
+import re
+from utils.azure_blob import BlobSession, download_blob_async, upload_blob_async, list_blobs_async
+from utils.whisper_wrapper import transcribe_audio, get_model_cache_stats, model_version
+from utils.executors import run_inference, run_blocking, shutdown_executors, inference_workers
+from utils.manifest import VideoManifest, load_manifest, save_manifest, load_chunk_result, save_chunk_result, file_sha256
+from utils.alignment import assign_speakers
+from utils.vad import restore_timestamps
+from utils.chunking import trim_to_owned
+from utils.transcript_stream import TranscriptStream, InOrderWriter, streaming_enabled
+from utils.compact_transcript import write_compact_transcript
+from utils.metrics import stage_timer
+from utils.pcm import SAMPLE_RATE, wav_duration
+from utils.pyannote_wrapper import diarize_audio_async
 
 # No chunking logic here; download_and_prepare.py handles chunking.
 
-def diarize_audio(audio_path):
-    hf_token = os.getenv("HUGGINGFACE_TOKEN")
-    logging.info(f"[Diarization] Checking Hugging Face token: {'FOUND' if hf_token else 'NOT FOUND'}")
-    if not hf_token:
-        raise RuntimeError("HUGGINGFACE_TOKEN environment variable not set. Please set it to your Hugging Face access token.")
-    try:
-        logging.info("[Diarization] Loading pyannote pipeline...")
-        pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization", use_auth_token=hf_token)
-        logging.info("[Diarization] Pipeline loaded. Running diarization...")
-        diarization = pipeline(audio_path)
-        segments = []
-        for segment, _, speaker in diarization.itertracks(yield_label=True):
-            segments.append({
-                "start": segment.start,
-                "end": segment.end,
-                "speaker": speaker
-            })
-        logging.info(f"[Diarization] Got {len(segments)} diarization segments. Example: {segments[:3]}")
-        return segments
-    except Exception as e:
-        logging.error(f"[Diarization] Exception during diarization: {e}", exc_info=True)
-        raise
-
 # Map pyannote speaker labels to Speaker 1, Speaker 2, ...
 def map_speaker_labels(diarization_segments):
     speaker_map = {}
@@ -66,135 +54,345 @@ def map_speaker_labels(diarization_segments):
         })
     return mapped_segments, speaker_map
 
-async def transcribe_and_upload(video_id: str, enable_diarization: bool = True):
-    import re
-    audio_container = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
-    
-    # Filter chunks for this specific video
-    all_blobs = await list_blobs_async(audio_container)
-    chunk_blobs = [blob for blob in all_blobs if blob.startswith(f"{video_id}_chunk_")]
-    
+def _remove_temp_files(paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+                logging.debug(f"Cleaned up temp file: {path}")
+        except Exception as e:
+            logging.warning(f"Failed to remove temp file {path}: {e}")
+
+def chunk_sort_key(blob_name):
+    match = re.search(r"chunk_(\d+)", blob_name)
+    return int(match.group(1)) if match else float('inf')
+
+def chunk_timeline(manifest: VideoManifest, chunk_blob: str):
+    """
+    Timeline of a chunk from the manifest. Fixed chunks prepared before timelines were recorded fall back to
+    starting (N-1) * chunk_length_sec into the recording.
+    """
+    timeline = manifest.chunk_timeline(chunk_blob)
+    if timeline is None and chunk_sort_key(chunk_blob) != float('inf'):
+        chunk_length_sec = float(manifest.stages.get('prepare', {}).get('chunk_length_sec', 1800))
+        timeline = [[0.0, (chunk_sort_key(chunk_blob) - 1) * chunk_length_sec, chunk_length_sec]]
+    return timeline
+
+def chunk_concurrency():
+    """(downloads in flight, chunks transcribing at once) for a video; transcription defaults to one chunk per inference worker."""
+    downloads = max(1, int(os.getenv('CHUNK_DOWNLOAD_CONCURRENCY', '4')))
+    transcriptions = max(1, int(os.getenv('TRANSCRIBE_CHUNK_CONCURRENCY', str(inference_workers()))))
+    return downloads, transcriptions
+
+async def _gather_or_cancel(coros):
+    """gather() that cancels the remaining tasks when one fails instead of leaving them running."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def transcribe_chunks(video_id: str, audio_container: str = None, manifest: VideoManifest = None):
+    """
+    Download and transcribe every audio chunk of a video. Returns the merged segments in chunk order, or None if there
+    are no chunks. Downloads are prefetched concurrently and chunks are transcribed in parallel across the inference
+    workers. Chunks the manifest already records as transcribed by the current model are reused instead of re-inferred,
+    and the manifest is saved after every chunk so a crashed run resumes with the chunks that did not finish.
+    With TRANSCRIPT_STREAMING on, segments are also appended to '<video_id>_transcript.ndjson' as chunks finish.
+    """
+    audio_container = audio_container or os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    manifest = manifest or await load_manifest(video_id)
+    version = model_version()
+
+    if manifest.stage_done('prepare'):
+        # The manifest lists exactly the chunks the last prepare produced, with their timelines
+        chunk_blobs = list(manifest.chunks)
+    else:
+        # Audio prepared before manifests existed: fall back to the chunks in the container
+        all_blobs = await list_blobs_async(audio_container, prefix=f"{video_id}_chunk_")
+        chunk_blobs = [blob for blob in all_blobs if blob.startswith(f"{video_id}_chunk_")]
+
     logging.info(f"Processing video: {video_id}")
     logging.info(f"Found {len(chunk_blobs)} audio chunks: {chunk_blobs}")
-    
+
     if not chunk_blobs:
         logging.info(f"No audio chunks found for video {video_id}. Skipping transcription.")
-        return
-    
+        return None
+
+    sorted_chunks = sorted(chunk_blobs, key=chunk_sort_key)
+    download_limit, transcribe_limit = chunk_concurrency()
+    downloads = asyncio.Semaphore(download_limit)
+    transcriptions = asyncio.Semaphore(transcribe_limit)
+    # Bounds how many chunk files sit on local disk: those transcribing plus those prefetched ahead of them
+    in_flight = asyncio.Semaphore(transcribe_limit + download_limit)
+    manifest_lock = asyncio.Lock()
     temp_files = []
-    all_segments = []
-    diarization_segments = []
-    speaker_script_path = None
-    
-    try:
-        # Sort chunks by number
-        def chunk_sort_key(x):
-            match = re.search(r"chunk_(\d+)", x)
-            return int(match.group(1)) if match else float('inf')
-        
-        sorted_chunks = sorted(chunk_blobs, key=chunk_sort_key)
-        logging.info(f"Processing chunks in order: {sorted_chunks}")
-        
-        # Process each chunk for transcription
-        for chunk_blob in sorted_chunks:
-            chunk_path = f"/tmp/{chunk_blob}"
+    transcribed = 0
+
+    async def process(index, chunk_blob, writer):
+        nonlocal transcribed
+        if manifest.chunk_transcribed(chunk_blob, version):
+            cached = await load_chunk_result(manifest, chunk_blob)
+            if cached is not None:
+                logging.info(f"Reusing transcript of {chunk_blob} from manifest")
+                await writer.put(index, cached.get('segments', []))
+                return cached.get('segments', [])
+
+        chunk_path = f"/tmp/{chunk_blob}"
+        async with in_flight:
             temp_files.append(chunk_path)
-            
-            logging.info(f"Downloading and transcribing {chunk_blob}")
-            await download_blob_async(audio_container, chunk_blob, chunk_path)
-            transcript = await transcribe_audio(chunk_path)
-            result = json.loads(transcript)
-            all_segments.extend(result.get('segments', []))
-            logging.info(f"  Got {len(result.get('segments', []))} segments")
-        
-        # Always upload basic transcript first
-        transcript_json_path = f"/tmp/{video_id}_transcript.json"
+            async with downloads:
+                logging.info(f"Downloading {chunk_blob}")
+                with stage_timer('download_chunk', video_id=video_id, chunk=chunk_blob) as record:
+                    await download_blob_async(audio_container, chunk_blob, chunk_path)
+                    record['bytes'] = os.path.getsize(chunk_path)
+            if chunk_blob not in manifest.chunks:
+                manifest.record_chunk(chunk_blob, await run_blocking(file_sha256, chunk_path))
+            async with transcriptions:
+                logging.info(f"Transcribing {chunk_blob}")
+                with stage_timer('transcribe_chunk', video_id=video_id, chunk=chunk_blob) as record:
+                    record['audio_sec'] = wav_duration(chunk_path)
+                    result = await transcribe_audio(chunk_path)
+            _remove_temp_files([chunk_path])
+        # Shift to recording time, then keep only the words this chunk owns so overlaps are not duplicated
+        segments = restore_timestamps(result.get('segments', []), chunk_timeline(manifest, chunk_blob))
+        segments = trim_to_owned(segments, manifest.chunk_owned(chunk_blob))
+        logging.info(f"  Got {len(segments)} segments for {chunk_blob}")
+        await writer.put(index, segments)
+        etag = await save_chunk_result(manifest, chunk_blob, segments)
+        manifest.mark_chunk_transcribed(chunk_blob, version, etag)
+        # Saves are serialized so an older manifest never overwrites a newer one
+        async with manifest_lock:
+            await save_manifest(manifest)
+        transcribed += 1
+        return segments
+
+    manifest.mark_stage('transcribe', 'running', model_version=version)
+    try:
+        logging.info(f"Processing chunks in order: {sorted_chunks} ({transcribe_limit} at a time)")
+        async with (TranscriptStream(video_id) if streaming_enabled() else contextlib.nullcontext()) as stream:
+            writer = InOrderWriter(stream)
+            results = await _gather_or_cancel(process(i, chunk_blob, writer) for i, chunk_blob in enumerate(sorted_chunks))
+        all_segments = [seg for segments in results for seg in segments]
+        if transcribed:
+            logging.info(f"Whisper model cache: {await run_inference(get_model_cache_stats)}")
+        manifest.mark_stage('transcribe', 'done', model_version=version, transcribed_chunks=transcribed, reused_chunks=len(sorted_chunks) - transcribed)
+        await save_manifest(manifest)
+    finally:
+        _remove_temp_files(temp_files)
+    return all_segments
+
+async def transcribe_pcm_chunks(chunks, video_id: str = None):
+    """
+    Transcribe chunks given as (timeline, samples, owned), samples being a WavSlice or an array, in parallel across the inference workers and
+    return merged, recording-relative segments in chunk order. With a video_id and TRANSCRIPT_STREAMING on, segments
+    are also streamed to '<video_id>_transcript.ndjson' as chunks finish.
+    """
+    _, transcribe_limit = chunk_concurrency()
+    transcriptions = asyncio.Semaphore(transcribe_limit)
+
+    async def process(index, timeline, samples, owned, writer):
+        async with transcriptions:
+            with stage_timer('transcribe_chunk', video_id=video_id, chunk=index) as record:
+                record['audio_sec'] = len(samples) / SAMPLE_RATE
+                result = await transcribe_audio(samples)
+        segments = trim_to_owned(restore_timestamps(result.get('segments', []), timeline), owned)
+        logging.info(f"  Got {len(segments)} segments for chunk starting at {timeline[0][1]:.0f}s")
+        await writer.put(index, segments)
+        return segments
+
+    streaming = video_id is not None and streaming_enabled()
+    async with (TranscriptStream(video_id) if streaming else contextlib.nullcontext()) as stream:
+        writer = InOrderWriter(stream)
+        results = await _gather_or_cancel(process(i, *chunk, writer) for i, chunk in enumerate(chunks))
+    return [seg for segments in results for seg in segments]
+
+async def diarize_video(video_id: str, audio_container: str = None):
+    """Diarize the full audio of a video and return segments with 'Speaker N' labels."""
+    audio_container = audio_container or os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    full_audio_blob = f"{video_id}_full.wav"
+    full_audio_path = f"/tmp/{video_id}_full.wav"
+    try:
+        logging.info(f"Downloading full audio for diarization: {full_audio_blob}")
+        await download_blob_async(audio_container, full_audio_blob, full_audio_path)
+        logging.info(f"Starting speaker diarization for {video_id} using full audio")
+        with stage_timer('diarize_audio', video_id=video_id) as record:
+            record['audio_sec'] = wav_duration(full_audio_path)
+            diarization_segments = await diarize_audio_async(full_audio_path)
+    finally:
+        _remove_temp_files([full_audio_path])
+    mapped_segments, _ = map_speaker_labels(diarization_segments)
+    return mapped_segments
+
+async def publish_transcript(video_id: str, all_segments):
+    transcript_json_path = f"/tmp/{video_id}_transcript.json"
+    try:
         with open(transcript_json_path, 'w') as f:
             json.dump({"segments": all_segments}, f, indent=2)
-        await upload_blob_async(transcript_json_path, container='transcripts', blob_name=f'{video_id}_transcript.json')
+        etag = await upload_blob_async(transcript_json_path, container='transcripts', blob_name=f'{video_id}_transcript.json')
         logging.info(f"Transcript JSON uploaded for {video_id}")
-        temp_files.append(transcript_json_path)
-        
-        # Try speaker diarization if enabled
-        if enable_diarization:
-            try:
-                # Download full audio for diarization
-                full_audio_blob = f"{video_id}_full.wav"
-                full_audio_path = f"/tmp/{video_id}_full.wav"
-                logging.info(f"Downloading full audio for diarization: {full_audio_blob}")
-                await download_blob_async(audio_container, full_audio_blob, full_audio_path)
-                temp_files.append(full_audio_path)
-                logging.info(f"Starting speaker diarization for {video_id} using full audio")
-                diarization_segments = diarize_audio(full_audio_path)
-                mapped_segments, speaker_map = map_speaker_labels(diarization_segments)
-
-                # Write diarization JSON with mapped speaker labels
-                diarization_json_path = f"/tmp/{video_id}_diarization.json"
-                with open(diarization_json_path, 'w') as f:
-                    json.dump({"segments": mapped_segments}, f, indent=2)
-                await upload_blob_async(diarization_json_path, container='transcripts', blob_name=f'{video_id}_diarization.json')
-                logging.info(f"Diarization JSON uploaded for {video_id}")
-                temp_files.append(diarization_json_path)
-
-                # Generate enhanced speaker script with diarization
-                speaker_script_path = f"/tmp/{video_id}_speaker_script.txt"
-                with open(speaker_script_path, 'w') as f:
-                    # Align transcript segments with speaker segments
-                    for seg in all_segments:
-                        # Find matching speaker for this time segment
-                        speaker = "Unknown"
-                        seg_start = seg.get('start', 0)
-                        for diar_seg in mapped_segments:
-                            if diar_seg['start'] <= seg_start <= diar_seg['end']:
-                                speaker = diar_seg['speaker']
-                                break
-                        f.write(f"{speaker} - {seg['start']:.2f} to {seg['end']:.2f}: {seg['text'].strip()}\n\n")
-                await upload_blob_async(speaker_script_path, container='transcripts', blob_name=f'{video_id}_speaker_script.txt')
-                logging.info(f"Speaker script with diarization uploaded for {video_id}")
+        return etag
+    finally:
+        _remove_temp_files([transcript_json_path])
 
-            except Exception as e:
-                logging.error(f"Speaker diarization failed for {video_id}: {e}", exc_info=True)
-                logging.info(f"Continuing with basic transcript only for {video_id}")
+async def publish_diarization(video_id: str, mapped_segments):
+    # Write diarization JSON with mapped speaker labels
+    diarization_json_path = f"/tmp/{video_id}_diarization.json"
+    try:
+        with open(diarization_json_path, 'w') as f:
+            json.dump({"segments": mapped_segments}, f, indent=2)
+        etag = await upload_blob_async(diarization_json_path, container='transcripts', blob_name=f'{video_id}_diarization.json')
+        logging.info(f"Diarization JSON uploaded for {video_id}")
+        return etag
+    finally:
+        _remove_temp_files([diarization_json_path])
 
-                # Generate basic speaker script with sequential speaker labels
-                speaker_script_path = f"/tmp/{video_id}_speaker_script.txt"
+async def publish_speaker_script(video_id: str, all_segments, mapped_segments=None):
+    """
+    Upload a readable speaker script. With diarization segments each transcript segment gets the matching speaker;
+    without them segments get sequential speaker labels.
+    """
+    speaker_script_path = f"/tmp/{video_id}_speaker_script.txt"
+    try:
+        with open(speaker_script_path, 'w') as f:
+            if mapped_segments is not None:
+                # Align transcript segments with speaker segments by word-level overlap
+                speakers = assign_speakers(all_segments, mapped_segments)
+                for seg, speaker in zip(all_segments, speakers):
+                    f.write(f"{speaker} - {seg['start']:.2f} to {seg['end']:.2f}: {seg['text'].strip()}\n\n")
+            else:
                 speaker_counter = 1
-                with open(speaker_script_path, 'w') as f:
-                    for seg in all_segments:
-                        speaker_label = f"Speaker {speaker_counter}"
-                        f.write(f"{speaker_label} - {seg['start']:.2f} to {seg['end']:.2f}: {seg['text'].strip()}\n\n")
-                        speaker_counter += 1
-                await upload_blob_async(speaker_script_path, container='transcripts', blob_name=f'{video_id}_speaker_script.txt')
-                logging.info(f"Basic speaker script with labels uploaded for {video_id}")
-        else:
-            # Generate basic speaker script with sequential speaker labels
-            speaker_script_path = f"/tmp/{video_id}_speaker_script.txt"
-            speaker_counter = 1
-            with open(speaker_script_path, 'w') as f:
                 for seg in all_segments:
                     speaker_label = f"Speaker {speaker_counter}"
                     f.write(f"{speaker_label} - {seg['start']:.2f} to {seg['end']:.2f}: {seg['text'].strip()}\n\n")
                     speaker_counter += 1
-            await upload_blob_async(speaker_script_path, container='transcripts', blob_name=f'{video_id}_speaker_script.txt')
+        etag = await upload_blob_async(speaker_script_path, container='transcripts', blob_name=f'{video_id}_speaker_script.txt')
+        if mapped_segments is not None:
+            logging.info(f"Speaker script with diarization uploaded for {video_id}")
+        else:
             logging.info(f"Basic speaker script with labels uploaded for {video_id}")
-            
+        return etag
+    finally:
+        _remove_temp_files([speaker_script_path])
+
+def compact_output_enabled() -> bool:
+    return os.getenv('TRANSCRIPT_COMPACT', '1') != '0'
+
+async def publish_compact_transcript(video_id: str, all_segments):
+    """
+    Upload the compact, time-indexed transcript (see utils/compact_transcript.py). Run after publish_speaker_script
+    so segments carry their aligned speakers.
+    """
+    compact_path = f"/tmp/{video_id}_transcript.trx"
+    try:
+        await run_blocking(write_compact_transcript, compact_path, all_segments)
+        etag = await upload_blob_async(compact_path, container='transcripts', blob_name=f'{video_id}_transcript.trx')
+        logging.info(f"Compact transcript uploaded for {video_id}")
+        return etag
+    finally:
+        _remove_temp_files([compact_path])
+
+def needs_publish(manifest: VideoManifest, enable_diarization: bool) -> bool:
+    """
+    False when the published outputs are newer than the last prepare and every chunk transcript. Decided from the
+    manifest's timestamps rather than what this run transcribed, so a publish that failed after its chunks were
+    transcribed is retried by the next run.
+    """
+    return not manifest.is_up_to_date(model_version(), require_diarization=enable_diarization)
+
+async def transcribe_and_upload(video_id: str, enable_diarization: bool = True):
+    audio_container = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    try:
+        manifest = await load_manifest(video_id)
+        if manifest.is_up_to_date(model_version(), require_diarization=enable_diarization):
+            logging.info(f"{video_id} is already transcribed with {model_version()}; nothing to do")
+            return
+        all_segments = await transcribe_chunks(video_id, audio_container, manifest)
+        if all_segments is None:
+            return
+        if not needs_publish(manifest, enable_diarization):
+            logging.info(f"Outputs for {video_id} are up to date; skipping diarization and publish")
+            return
+
+        # Always upload basic transcript first
+        manifest.record_output(f'{video_id}_transcript.json', await publish_transcript(video_id, all_segments))
+
+        mapped_segments = None
+        # Try speaker diarization if enabled
+        if enable_diarization:
+            try:
+                mapped_segments = await diarize_video(video_id, audio_container)
+                manifest.record_output(f'{video_id}_diarization.json', await publish_diarization(video_id, mapped_segments))
+                manifest.mark_stage('diarize', 'done')
+            except Exception as e:
+                logging.error(f"Speaker diarization failed for {video_id}: {e}", exc_info=True)
+                logging.info(f"Continuing with basic transcript only for {video_id}")
+                manifest.mark_stage('diarize', 'failed', error=str(e))
+                mapped_segments = None
+        manifest.record_output(f'{video_id}_speaker_script.txt', await publish_speaker_script(video_id, all_segments, mapped_segments))
+        if compact_output_enabled():
+            manifest.record_output(f'{video_id}_transcript.trx', await publish_compact_transcript(video_id, all_segments))
+        manifest.mark_stage('publish', 'done', model_version=model_version(), diarized=mapped_segments is not None)
+        await save_manifest(manifest)
+
     except Exception as e:
         logging.error(f"Failed to process transcription for {video_id}: {e}", exc_info=True)
         raise
-    finally:
-        # Clean up temp files
-        all_temp_files = temp_files + ([speaker_script_path] if speaker_script_path else [])
-        for path in all_temp_files:
+
+async def transcribe_local_video(video_path: str, video_id: str = None, enable_diarization: bool = True, chunk_length_sec: int = 1800):
+    """
+    Same-node mode: decode a local video once into a local WAV that Whisper and pyannote workers memory-map
+    directly, skipping the chunk files and the upload/download round-trip. Only the outputs are uploaded.
+    """
+    from download_and_prepare import prepare_local_audio
+    video_id = video_id or os.path.splitext(os.path.basename(video_path))[0]
+    wav_path, chunks = await prepare_local_audio(video_path, chunk_length_sec)
+    try:
+        all_segments = await transcribe_pcm_chunks(chunks, video_id)
+        await publish_transcript(video_id, all_segments)
+        mapped_segments = None
+        # A recording without speech publishes an empty transcript; there is nobody to diarize
+        if enable_diarization and chunks:
             try:
-                if path and os.path.exists(path):
-                    os.remove(path)
-                    logging.debug(f"Cleaned up temp file: {path}")
+                with stage_timer('diarize_audio', video_id=video_id) as record:
+                    record['audio_sec'] = wav_duration(wav_path)
+                    diarization_segments = await diarize_audio_async(wav_path)
+                mapped_segments, _ = map_speaker_labels(diarization_segments)
+                await publish_diarization(video_id, mapped_segments)
             except Exception as e:
-                logging.warning(f"Failed to remove temp file {path}: {e}")
+                logging.error(f"Speaker diarization failed for {video_id}: {e}", exc_info=True)
+                mapped_segments = None
+        await publish_speaker_script(video_id, all_segments, mapped_segments)
+        if compact_output_enabled():
+            await publish_compact_transcript(video_id, all_segments)
+    finally:
+        _remove_temp_files({wav_path} | {samples.path for _, samples, _ in chunks})
+
+async def main(video_id: str, enable_diarization: bool = True):
+    async with BlobSession():
+        await transcribe_and_upload(video_id, enable_diarization)
+
+async def main_local(video_path: str, enable_diarization: bool = True):
+    async with BlobSession():
+        await transcribe_local_video(video_path, enable_diarization=enable_diarization)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     import sys
-    video_id = sys.argv[1] if len(sys.argv) > 1 else "test"
-    enable_diarization = len(sys.argv) < 3 or sys.argv[2].lower() != "false"
-    asyncio.run(transcribe_and_upload(video_id, enable_diarization))
+    args = sys.argv[1:]
+    # --local <video.mp4>: decode and transcribe a local file in memory
+    local = bool(args) and args[0] == "--local"
+    if local:
+        args = args[1:]
+    video_id = args[0] if args else "test"
+    enable_diarization = len(args) < 2 or args[1].lower() != "false"
+    try:
+        if local:
+            asyncio.run(main_local(video_id, enable_diarization))
+        else:
+            asyncio.run(main(video_id, enable_diarization))
+    finally:
+        shutdown_executors()
@@ -0,0 +1,79 @@
+"""
+Speaker alignment between Whisper output and diarization turns.
+
+Words (or whole segments when Whisper returned no word timestamps) and diarization turns are
+both swept in start-time order. A word is given the speaker of the turn it overlaps the most,
+and a segment the speaker that covers most of its word time, so cost is O((N + M) log(N + M))
+instead of the O(N * M) scan of checking every turn for every segment.
+"""
+
+from collections import defaultdict
+
+
+def _sweep(intervals, turns, max_gap: float):
+    """
+    For each (start, end) in intervals return the index of the turn with maximal overlap, or of the
+    nearest turn within max_gap seconds when nothing overlaps, or None.
+    """
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+    turn_order = sorted(range(len(turns)), key=lambda t: turns[t]['start'])
+    result = [None] * len(intervals)
+    active = []  # turns that started before the current interval ended and have not ended yet
+    next_turn = 0
+    for i in order:
+        start, end = intervals[i]
+        # Admit every turn starting before this interval ends (allowing for the gap fallback)
+        while next_turn < len(turn_order) and turns[turn_order[next_turn]]['start'] < end + max_gap:
+            active.append(turn_order[next_turn])
+            next_turn += 1
+        # Intervals are visited by start time, so a turn that ended before this start (less the gap) is done for good
+        active = [t for t in active if turns[t]['end'] > start - max_gap]
+
+        best, best_overlap, best_distance = None, 0.0, None
+        for t in active:
+            turn = turns[t]
+            overlap = min(end, turn['end']) - max(start, turn['start'])
+            if overlap > best_overlap:
+                best, best_overlap = t, overlap
+            elif best_overlap <= 0:
+                distance = max(turn['start'] - end, start - turn['end'], 0.0)
+                if distance <= max_gap and (best_distance is None or distance < best_distance):
+                    best, best_distance = t, distance
+        result[i] = best
+    return result
+
+
+def assign_speakers(segments, turns, max_gap: float = 0.5, unknown: str = "Unknown"):
+    """
+    Label each Whisper segment (and each of its words) with a diarization speaker, in place.
+    turns are dicts with 'start', 'end' and 'speaker'. Returns the list of segment speakers.
+    """
+    words = []
+    owners = []
+    for seg_index, seg in enumerate(segments):
+        for word in seg.get('words') or []:
+            words.append(word)
+            owners.append(seg_index)
+
+    votes = [defaultdict(float) for _ in segments]
+    word_turns = _sweep([(w['start'], w['end']) for w in words], turns, max_gap)
+    for word, seg_index, t in zip(words, owners, word_turns):
+        speaker = turns[t]['speaker'] if t is not None else unknown
+        word['speaker'] = speaker
+        if t is not None:
+            # Weight by duration so a long word outvotes a clipped one; zero-length words still count
+            votes[seg_index][speaker] += max(word['end'] - word['start'], 1e-3)
+
+    # Segments without usable words fall back to segment-level overlap
+    fallback = [i for i, seg_votes in enumerate(votes) if not seg_votes]
+    seg_turns = _sweep([(segments[i]['start'], segments[i]['end']) for i in fallback], turns, max_gap)
+    for i, t in zip(fallback, seg_turns):
+        if t is not None:
+            votes[i][turns[t]['speaker']] += 1.0
+
+    speakers = []
+    for seg, seg_votes in zip(segments, votes):
+        speaker = max(seg_votes.items(), key=lambda item: item[1])[0] if seg_votes else unknown
+        seg['speaker'] = speaker
+        speakers.append(speaker)
+    return speakers
@@ -1,71 +1,287 @@
+import asyncio
 import os
-from azure.storage.blob.aio import BlobServiceClient
+from contextlib import asynccontextmanager
 import logging
+import time
+from utils.metrics import inc, observe
+from utils.storage import get_storage, storage_backend
 
-async def upload_blob_async(file_path, container, blob_name):
+# While a BlobSession is open every helper below reuses its client (and its pooled
+# connections); outside of one each call falls back to a short-lived client.
+_active_session = None
+_client_stats = {
+    "clients_created": 0,
+    "operations": 0,
+    "shared_client_operations": 0,
+    "connections_created": 0,
+    "connections_reused": 0,
+}
+
+def _account_url():
     AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    async with BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    ) as blob_service_client:
-        container_client = blob_service_client.get_container_client(container)
-        async with container_client:
+    return f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
+
+def _block_size():
+    return int(os.getenv('AZURE_BLOB_BLOCK_SIZE', str(8 * 1024 * 1024)))
+
+def _max_concurrency(max_concurrency=None):
+    return max_concurrency or int(os.getenv('AZURE_BLOB_MAX_CONCURRENCY', '4'))
+
+def _new_service_client(**kwargs):
+    from azure.storage.blob.aio import BlobServiceClient
+    _client_stats["clients_created"] += 1
+    block_size = _block_size()
+    # Transfers larger than one block are split into blocks/ranges, so peak memory per
+    # transfer is about max_concurrency * block_size no matter how large the blob is.
+    return BlobServiceClient(
+        _account_url(),
+        credential=os.getenv('AZURE_STORAGE_ACCOUNT_KEY'),
+        max_block_size=block_size,
+        max_single_put_size=block_size,
+        max_chunk_get_size=block_size,
+        max_single_get_size=block_size,
+        **kwargs
+    )
+
+class BlobSession:
+    """
+    Long-lived, connection-pooled BlobServiceClient shared by all helpers in this module.
+
+        async with BlobSession():
+            await upload_blob_async(...)
+
+    With STORAGE_BACKEND=local no client is opened; with 'tiered' leaving the session waits for
+    background replication to finish.
+    """
+
+    def __init__(self, max_connections: int = None):
+        self.max_connections = max_connections or int(os.getenv('AZURE_BLOB_MAX_CONNECTIONS', '64'))
+        self.client = None
+        self._http_session = None
+        self._previous = None
+
+    async def __aenter__(self):
+        if storage_backend() == 'local':
+            return self
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        async def on_connection_create_end(session, context, params):
+            _client_stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            _client_stats["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            trace_configs=[trace_config],
+        )
+        transport = AioHttpTransport(session=self._http_session, session_owner=False)
+        self.client = _new_service_client(transport=transport)
+        await self.client.__aenter__()
+        global _active_session
+        self._previous = _active_session
+        _active_session = self
+        logging.info(f"Opened shared blob session (max {self.max_connections} connections)")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.client is None:
+            return
+        global _active_session
+        try:
+            await get_storage().flush()
+        finally:
+            _active_session = self._previous
+            await self.client.__aexit__(exc_type, exc, tb)
+            await self._http_session.close()
+        logging.info(f"Closed shared blob session: {get_blob_client_stats()}")
+
+def _record_transfer(direction: str, size: int, started: float):
+    inc('blob_bytes_total', size, direction=direction)
+    observe('blob_transfer_seconds', time.perf_counter() - started, direction=direction)
+
+def get_blob_client_stats() -> dict:
+    """Return client/connection reuse counters for this process."""
+    return dict(_client_stats)
+
+@asynccontextmanager
+async def _service_client():
+    _client_stats["operations"] += 1
+    if _active_session is not None:
+        _client_stats["shared_client_operations"] += 1
+        yield _active_session.client
+        return
+    async with _new_service_client() as blob_service_client:
+        yield blob_service_client
+
+async def wait_for_copy(blob_client, copy: dict, poll_sec: float = None, timeout: float = None):
+    """
+    Poll a server-side copy started with start_copy_from_url until it leaves 'pending'. Copies can
+    complete asynchronously, so the source must not be deleted before this returns. Raises if the
+    copy failed, was aborted, or is still pending after timeout seconds (AZURE_BLOB_COPY_TIMEOUT_SEC).
+    """
+    poll_sec = poll_sec or float(os.getenv('AZURE_BLOB_COPY_POLL_SEC', '2'))
+    timeout = timeout or float(os.getenv('AZURE_BLOB_COPY_TIMEOUT_SEC', '3600'))
+    status, description = copy.get('copy_status'), None
+    deadline = time.monotonic() + timeout
+    while status == 'pending':
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Copy to {blob_client.blob_name} still pending after {timeout:.0f}s")
+        await asyncio.sleep(poll_sec)
+        properties = await blob_client.get_blob_properties()
+        status, description = properties.copy.status, properties.copy.status_description
+    if status != 'success':
+        raise RuntimeError(f"Copy to {blob_client.blob_name} ended with status {status}: {description}")
+
+class AzureBlobStorage:
+    """The Azure Blob Storage backend (see utils/storage.py); uses the active BlobSession's client when one is open."""
+
+    async def upload_blob_async(self, file_path, container, blob_name, max_concurrency: int = None):
+        """Upload a local file, streaming it from disk in parallel blocks. Returns the new blob's ETag."""
+        started = time.perf_counter()
+        size = os.path.getsize(file_path)
+        async with _service_client() as blob_service_client:
+            blob_client = blob_service_client.get_blob_client(container, blob_name)
             with open(file_path, 'rb') as data:
-                await container_client.upload_blob(blob_name, data, overwrite=True)
-    logging.info(f"Uploaded {blob_name} to {container}")
+                result = await blob_client.upload_blob(
+                    data, overwrite=True,
+                    length=size,
+                    max_concurrency=_max_concurrency(max_concurrency)
+                )
+        _record_transfer('upload', size, started)
+        logging.info(f"Uploaded {blob_name} to {container}")
+        return result.get('etag')
 
-async def download_blob_async(container, blob_name, file_path):
-    AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    async with BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    ) as blob_service_client:
-        container_client = blob_service_client.get_container_client(container)
-        async with container_client:
-            stream = await container_client.download_blob(blob_name)
+    async def upload_bytes_async(self, data: bytes, container, blob_name):
+        """Upload a small in-memory payload. Returns the new blob's ETag."""
+        started = time.perf_counter()
+        async with _service_client() as blob_service_client:
+            blob_client = blob_service_client.get_blob_client(container, blob_name)
+            result = await blob_client.upload_blob(data, overwrite=True)
+        _record_transfer('upload', len(data), started)
+        logging.debug(f"Uploaded {blob_name} to {container}")
+        return result.get('etag')
+
+    async def create_append_blob_async(self, container, blob_name):
+        """Create (or truncate) an append blob that later calls extend with append_block_async."""
+        async with _service_client() as blob_service_client:
+            blob_client = blob_service_client.get_blob_client(container, blob_name)
+            result = await blob_client.create_append_blob()
+        logging.debug(f"Created append blob {blob_name} in {container}")
+        return result.get('etag')
+
+    async def append_block_async(self, container, blob_name, data: bytes):
+        """Append one block (at most 4 MiB) to an append blob; readers see it as soon as this returns."""
+        async with _service_client() as blob_service_client:
+            blob_client = blob_service_client.get_blob_client(container, blob_name)
+            result = await blob_client.append_block(data, length=len(data))
+        return result.get('etag')
+
+    async def download_bytes_async(self, container, blob_name):
+        """Download a small blob into memory; returns None if it does not exist."""
+        from azure.core.exceptions import ResourceNotFoundError
+        async with _service_client() as blob_service_client:
+            blob_client = blob_service_client.get_blob_client(container, blob_name)
+            started = time.perf_counter()
+            try:
+                stream = await blob_client.download_blob()
+            except ResourceNotFoundError:
+                return None
+            data = await stream.readall()
+        _record_transfer('download', len(data), started)
+        return data
+
+    async def download_blob_async(self, container, blob_name, file_path, max_concurrency: int = None):
+        """Download a blob straight to disk in parallel ranges, without buffering it in memory."""
+        started = time.perf_counter()
+        async with _service_client() as blob_service_client:
+            container_client = blob_service_client.get_container_client(container)
+            stream = await container_client.download_blob(blob_name, max_concurrency=_max_concurrency(max_concurrency))
             with open(file_path, 'wb') as f:
-                f.write(await stream.readall())
-    logging.info(f"Downloaded {blob_name} from {container}")
+                size = await stream.readinto(f)
+        _record_transfer('download', size, started)
+        logging.info(f"Downloaded {blob_name} from {container}")
 
-async def list_blobs_async(container: str, prefix: str = None):
-    """List blobs in a container, optionally filtered by prefix."""
-    AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    async with BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    ) as blob_service_client:
-        container_client = blob_service_client.get_container_client(container)
-        async with container_client:
+    async def list_blobs_async(self, container: str, prefix: str = None):
+        """List blobs in a container, optionally filtered by prefix."""
+        async with _service_client() as blob_service_client:
+            container_client = blob_service_client.get_container_client(container)
             blobs = []
             async for blob in container_client.list_blobs(name_starts_with=prefix):
                 blobs.append(blob.name)
-    return blobs
+        return blobs
+
+    async def list_blob_prefixes_async(self, container: str):
+        """List the top-level virtual directories ('<name>/') of a container without listing the blobs under them."""
+        async with _service_client() as blob_service_client:
+            container_client = blob_service_client.get_container_client(container)
+            prefixes = []
+            async for item in container_client.walk_blobs(delimiter='/'):
+                if item.name.endswith('/'):
+                    prefixes.append(item.name)
+        return prefixes
+
+    async def copy_blob_async(self, source_container, destination_container, blob_name):
+        """Copy a blob from one container to another, returning once the server-side copy has completed."""
+        async with _service_client() as blob_service_client:
+            source_blob_url = blob_service_client.get_blob_client(source_container, blob_name).url
+            destination_blob_client = blob_service_client.get_blob_client(destination_container, blob_name)
+            copy = await destination_blob_client.start_copy_from_url(source_blob_url)
+            await wait_for_copy(destination_blob_client, copy)
+        logging.info(f"Copied {blob_name} from {source_container} to {destination_container}")
+
+    async def delete_blob_async(self, container, blob_name):
+        """Delete a blob from a container."""
+        async with _service_client() as blob_service_client:
+            container_client = blob_service_client.get_container_client(container)
+            await container_client.delete_blob(blob_name)
+        logging.info(f"Deleted {blob_name} from {container}")
+
+    async def flush(self):
+        pass
+
+# Module-level helpers used throughout the pipeline; they dispatch to the STORAGE_BACKEND backend
+
+async def upload_blob_async(file_path, container, blob_name, max_concurrency: int = None):
+    """Upload a local file. Returns the new blob's ETag."""
+    return await get_storage().upload_blob_async(file_path, container, blob_name, max_concurrency)
+
+async def upload_bytes_async(data: bytes, container, blob_name):
+    """Upload a small in-memory payload. Returns the new blob's ETag."""
+    return await get_storage().upload_bytes_async(data, container, blob_name)
+
+async def create_append_blob_async(container, blob_name):
+    """Create (or truncate) an append blob that later calls extend with append_block_async."""
+    return await get_storage().create_append_blob_async(container, blob_name)
+
+async def append_block_async(container, blob_name, data: bytes):
+    """Append one block (at most 4 MiB) to an append blob."""
+    return await get_storage().append_block_async(container, blob_name, data)
+
+async def download_bytes_async(container, blob_name):
+    """Download a small blob into memory; returns None if it does not exist."""
+    return await get_storage().download_bytes_async(container, blob_name)
+
+async def download_blob_async(container, blob_name, file_path, max_concurrency: int = None):
+    """Download a blob to a local file."""
+    await get_storage().download_blob_async(container, blob_name, file_path, max_concurrency)
+
+async def list_blobs_async(container: str, prefix: str = None):
+    """List blobs in a container, optionally filtered by prefix."""
+    return await get_storage().list_blobs_async(container, prefix)
+
+async def list_blob_prefixes_async(container: str):
+    """List the top-level virtual directories ('<name>/') of a container."""
+    return await get_storage().list_blob_prefixes_async(container)
 
 async def copy_blob_async(source_container, destination_container, blob_name):
     """Copy a blob from one container to another."""
-    AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    async with BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    ) as blob_service_client:
-        source_blob_url = f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net/{source_container}/{blob_name}"
-        destination_blob_client = blob_service_client.get_blob_client(destination_container, blob_name)
-        await destination_blob_client.start_copy_from_url(source_blob_url)
-    logging.info(f"Copied {blob_name} from {source_container} to {destination_container}")
+    await get_storage().copy_blob_async(source_container, destination_container, blob_name)
 
 async def delete_blob_async(container, blob_name):
     """Delete a blob from a container."""
-    AZURE_STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
-    AZURE_STORAGE_ACCOUNT_KEY = os.getenv('AZURE_STORAGE_ACCOUNT_KEY')
-    async with BlobServiceClient(
-        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=AZURE_STORAGE_ACCOUNT_KEY
-    ) as blob_service_client:
-        container_client = blob_service_client.get_container_client(container)
-        async with container_client:
-            await container_client.delete_blob(blob_name)
-    logging.info(f"Deleted {blob_name} from {container}")
+    await get_storage().delete_blob_async(container, blob_name)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from utils.azure_blob import _service_client, wait_for_copy
+
+# Bulk operations on Azure Blob containers for the maintenance scripts in tools/. Listing returns
+# names with their properties so callers can filter by prefix and modification date; deletes go
+# through the Blob Batch API (up to 256 blobs per request) and copies run in parallel, each one
+# polled until the server-side copy completes before its source may be deleted. Every operation
+# is bounded by BLOB_BULK_CONCURRENCY requests in flight and supports a dry run.
+#
+# These talk to Azure directly, whatever STORAGE_BACKEND is; run them inside a BlobSession to
+# reuse pooled connections.
+MAX_BATCH_SIZE = 256
+
+
+def bulk_concurrency() -> int:
+    return max(1, int(os.getenv('BLOB_BULK_CONCURRENCY', '32')))
+
+
+def parse_date(value: str) -> datetime:
+    """Parse an ISO date or datetime ('2024-05-01', '2024-05-01T12:00'); naive values are taken as UTC."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def find_blobs(container: str, prefix: str = None, modified_before: datetime = None, modified_after: datetime = None):
+    """Return [{'name', 'size', 'last_modified'}, ...] for blobs matching prefix and the modification-date bounds."""
+    blobs = []
+    async with _service_client() as blob_service_client:
+        container_client = blob_service_client.get_container_client(container)
+        async for blob in container_client.list_blobs(name_starts_with=prefix):
+            if modified_before and blob.last_modified >= modified_before:
+                continue
+            if modified_after and blob.last_modified < modified_after:
+                continue
+            blobs.append({'name': blob.name, 'size': blob.size, 'last_modified': blob.last_modified})
+    logging.info(f"Found {len(blobs)} blob(s) in {container}"
+                 f"{f' with prefix {prefix!r}' if prefix else ''}"
+                 f"{f' modified before {modified_before:%Y-%m-%d %H:%M}' if modified_before else ''}"
+                 f"{f' modified after {modified_after:%Y-%m-%d %H:%M}' if modified_after else ''}")
+    return blobs
+
+
+def _batches(items, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def delete_blobs_bulk(container: str, blob_names, batch_size: int = MAX_BATCH_SIZE, dry_run: bool = False):
+    """
+    Delete blobs (and their snapshots) in batch requests of up to 256, several batches at a time.
+    Blobs that are already gone count as deleted; a failed batch request fails only its own blobs.
+    Returns {'deleted': n, 'failed': [names]}.
+    """
+    blob_names = list(blob_names)
+    if dry_run:
+        for name in blob_names:
+            logging.info(f"[dry run] Would delete {name} from {container}")
+        return {'deleted': 0, 'failed': []}
+    batch_size = min(max(1, batch_size), MAX_BATCH_SIZE)
+    slots = asyncio.Semaphore(bulk_concurrency())
+    deleted, failed = 0, []
+
+    async def delete_batch(batch):
+        nonlocal deleted
+        async with slots, _service_client() as blob_service_client:
+            container_client = blob_service_client.get_container_client(container)
+            index = 0
+            try:
+                responses = await container_client.delete_blobs(*batch, delete_snapshots='include', raise_on_any_failure=False)
+                async for response in responses:
+                    if response.status_code in (200, 202, 404):
+                        deleted += 1
+                    else:
+                        logging.error(f"Failed to delete {batch[index]} from {container}: HTTP {response.status_code}")
+                        failed.append(batch[index])
+                    index += 1
+            except Exception as e:
+                # The batch request itself failed; report the blobs it had not yet answered for and carry on
+                logging.error(f"Batch delete of {len(batch) - index} blob(s) from {container} failed: {e}")
+                failed.extend(batch[index:])
+                return
+        logging.info(f"Deleted {deleted} of {len(blob_names)} blob(s) from {container}")
+
+    await asyncio.gather(*(delete_batch(batch) for batch in _batches(blob_names, batch_size)))
+    return {'deleted': deleted, 'failed': failed}
+
+
+async def copy_blobs_bulk(source_container: str, destination_container: str, blob_names, delete_source: bool = False,
+                          dry_run: bool = False):
+    """
+    Server-side copy blobs to destination_container in parallel, waiting for each copy to complete.
+    With delete_source, only the sources whose copies succeeded are then batch-deleted.
+    Returns {'copied': n, 'deleted': n, 'failed': [names]}.
+    """
+    blob_names = list(blob_names)
+    if dry_run:
+        action = 'move' if delete_source else 'copy'
+        for name in blob_names:
+            logging.info(f"[dry run] Would {action} {name} from {source_container} to {destination_container}")
+        return {'copied': 0, 'deleted': 0, 'failed': []}
+    slots = asyncio.Semaphore(bulk_concurrency())
+    copied, failed = [], []
+
+    async def copy_one(name):
+        async with slots, _service_client() as blob_service_client:
+            source_url = blob_service_client.get_blob_client(source_container, name).url
+            destination = blob_service_client.get_blob_client(destination_container, name)
+            try:
+                copy = await destination.start_copy_from_url(source_url)
+                await wait_for_copy(destination, copy)
+            except Exception as e:
+                logging.error(f"Failed to copy {name} from {source_container} to {destination_container}: {e}")
+                failed.append(name)
+                return
+        copied.append(name)
+        if len(copied) % 100 == 0:
+            logging.info(f"Copied {len(copied)} of {len(blob_names)} blob(s) to {destination_container}")
+
+    await asyncio.gather(*(copy_one(name) for name in blob_names))
+    logging.info(f"Copied {len(copied)} of {len(blob_names)} blob(s) from {source_container} to {destination_container}")
+    deleted = 0
+    if delete_source and copied:
+        result = await delete_blobs_bulk(source_container, copied)
+        deleted = result['deleted']
+        failed.extend(result['failed'])
+    return {'copied': len(copied), 'deleted': deleted, 'failed': failed}
@@ -0,0 +1,74 @@
+import logging
+import numpy as np
+from utils.pcm import SAMPLE_RATE
+from utils.vad import _frame_energy_db
+
+# Boundary-aware chunking: cut near the target length at the quietest point, overlap
+# neighbouring chunks slightly so no word is lost at a cut, and let each chunk "own" the
+# time between the midpoints of its overlaps so words heard twice are kept exactly once.
+
+
+def silence_cut_points(samples, chunk_length_sec: float, search_sec: float = 30.0, frame_ms: int = 30):
+    """Return cut times (seconds) near every multiple of chunk_length_sec, each moved to the quietest frame within search_sec."""
+    total_sec = len(samples) / SAMPLE_RATE
+    frame = int(SAMPLE_RATE * frame_ms / 1000)
+    cuts = []
+    target = chunk_length_sec
+    while target < total_sec - 1.0:
+        lo = max(int((target - search_sec) * SAMPLE_RATE), 0)
+        hi = min(int((target + search_sec) * SAMPLE_RATE), len(samples))
+        energy = _frame_energy_db(samples[lo:hi], frame)
+        cut = (lo + int(np.argmin(energy)) * frame + frame // 2) / SAMPLE_RATE if len(energy) else target
+        # Keep chunks from collapsing when the quietest point is far before the target
+        cut = max(cut, (cuts[-1] if cuts else 0.0) + 1.0)
+        cuts.append(round(cut, 3))
+        target = cut + chunk_length_sec
+    return cuts
+
+
+def overlapping_chunks(cuts, total_sec: float, overlap_sec: float):
+    """
+    Build chunks around cut points. Each is {'timeline': [[0, start, duration]], 'owned': [own_start, own_end]},
+    where the chunk extends overlap_sec past each cut and owns the time up to the cut itself.
+    """
+    bounds = [0.0] + list(cuts) + [total_sec]
+    chunks = []
+    for own_start, own_end in zip(bounds[:-1], bounds[1:]):
+        start = max(0.0, own_start - overlap_sec)
+        end = min(total_sec, own_end + overlap_sec)
+        chunks.append({
+            'timeline': [[0.0, round(start, 3), round(end - start, 3)]],
+            'owned': [round(own_start, 3), round(own_end, 3)],
+        })
+    logging.info(f"Planned {len(chunks)} chunks cut at silence with {overlap_sec:.1f}s overlap")
+    return chunks
+
+
+def trim_to_owned(segments, owned):
+    """
+    Drop words (and segments) that fall outside the time this chunk owns, so overlapping chunks do not
+    duplicate them. Words are kept by their midpoint; segments without word timestamps by theirs.
+    """
+    if not owned:
+        return segments
+    own_start, own_end = owned
+
+    def owns(start, end):
+        middle = (start + end) / 2
+        return own_start <= middle < own_end
+
+    kept = []
+    for seg in segments:
+        words = seg.get('words')
+        if not words:
+            if owns(seg['start'], seg['end']):
+                kept.append(seg)
+            continue
+        owned_words = [word for word in words if owns(word['start'], word['end'])]
+        if not owned_words:
+            continue
+        if len(owned_words) != len(words):
+            seg = {**seg, 'words': owned_words, 'start': owned_words[0]['start'], 'end': owned_words[-1]['end'],
+                   'text': ''.join(word['word'] for word in owned_words)}
+        kept.append(seg)
+    return kept
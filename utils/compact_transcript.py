@@ -0,0 +1,177 @@
+import json
+import logging
+import numpy as np
+
+# Compact transcript format ('.trx'): column arrays instead of nested JSON, so a consumer can
+# memory-map the file and seek to a minute or a speaker without parsing the whole transcript.
+#
+#   b'TRX1' | uint32 header length | JSON header | 8-byte aligned raw little-endian arrays
+#
+# The header lists every array's offset, dtype and shape, the speaker names and the index bucket.
+# Times are int32 milliseconds. Words and segment texts are interned into one UTF-8 string table.
+# Arrays:
+#   seg_start, seg_end, seg_text, seg_speaker (-1 when unknown), seg_words (CSR offsets into words)
+#   word_start, word_end, word_text
+#   str_offsets, str_bytes                  interned string table
+#   time_index                              first segment still running at each index_sec bucket
+#   speaker_offsets, speaker_segments       segment ids of each speaker (CSR)
+MAGIC = b'TRX1'
+VERSION = 1
+_ALIGN = 8
+
+
+def _intern(strings, table, value):
+    string_id = table.get(value)
+    if string_id is None:
+        string_id = table[value] = len(strings)
+        strings.append(value)
+    return string_id
+
+
+def _ms(seconds):
+    return int(round(seconds * 1000))
+
+
+def encode_compact_transcript(segments, index_sec: int = 60) -> bytes:
+    """Encode Whisper-style segments (with optional 'words' and 'speaker') into the compact format."""
+    strings, table, speakers, speaker_ids = [], {}, [], {}
+    seg_start, seg_end, seg_text, seg_speaker, seg_words = [], [], [], [], [0]
+    word_start, word_end, word_text = [], [], []
+    for seg in segments:
+        seg_start.append(_ms(seg['start']))
+        seg_end.append(_ms(seg['end']))
+        seg_text.append(_intern(strings, table, seg.get('text', '')))
+        speaker = seg.get('speaker')
+        seg_speaker.append(-1 if speaker is None else _intern(speakers, speaker_ids, speaker))
+        for word in seg.get('words', []):
+            word_start.append(_ms(word['start']))
+            word_end.append(_ms(word['end']))
+            word_text.append(_intern(strings, table, word['word']))
+        seg_words.append(len(word_start))
+
+    encoded = [s.encode() for s in strings]
+    str_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    str_offsets[1:] = np.cumsum([len(b) for b in encoded]) if encoded else []
+    seg_end_arr = np.asarray(seg_end, dtype=np.int32)
+    seg_speaker_arr = np.asarray(seg_speaker, dtype=np.int16)
+
+    # Segments are in start order, but one may run past later ones; the running max of ends is monotonic
+    bucket_ms = index_sec * 1000
+    running_end = np.maximum.accumulate(seg_end_arr) if len(seg_end_arr) else seg_end_arr
+    num_buckets = int(running_end[-1]) // bucket_ms + 1 if len(running_end) else 0
+    time_index = np.searchsorted(running_end, np.arange(num_buckets) * bucket_ms, side='right').astype(np.int32)
+
+    order = np.argsort(seg_speaker_arr, kind='stable')
+    known = order[seg_speaker_arr[order] >= 0]
+    counts = np.bincount(seg_speaker_arr[known], minlength=len(speakers)) if len(speakers) else np.zeros(0, np.int64)
+    speaker_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+
+    arrays = {
+        'seg_start': np.asarray(seg_start, dtype=np.int32),
+        'seg_end': seg_end_arr,
+        'seg_text': np.asarray(seg_text, dtype=np.int32),
+        'seg_speaker': seg_speaker_arr,
+        'seg_words': np.asarray(seg_words, dtype=np.int32),
+        'word_start': np.asarray(word_start, dtype=np.int32),
+        'word_end': np.asarray(word_end, dtype=np.int32),
+        'word_text': np.asarray(word_text, dtype=np.int32),
+        'str_offsets': str_offsets,
+        'str_bytes': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'time_index': time_index,
+        'speaker_offsets': speaker_offsets,
+        'speaker_segments': known.astype(np.int32),
+    }
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {'offset': offset, 'dtype': array.dtype.newbyteorder('<').str, 'shape': list(array.shape)}
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({'version': VERSION, 'index_sec': index_sec, 'speakers': speakers, 'arrays': layout}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % _ALIGN)
+    body = bytearray(offset)
+    for name, array in arrays.items():
+        start = layout[name]['offset']
+        data = array.astype(layout[name]['dtype'], copy=False).tobytes()
+        body[start:start + len(data)] = data
+    return MAGIC + len(header).to_bytes(4, 'little') + header + bytes(body)
+
+
+def write_compact_transcript(path: str, segments, index_sec: int = 60) -> str:
+    data = encode_compact_transcript(segments, index_sec)
+    with open(path, 'wb') as f:
+        f.write(data)
+    logging.info(f"Wrote compact transcript {path}: {len(segments)} segments in {len(data)} bytes")
+    return path
+
+
+class CompactTranscript:
+    """Memory-mapped reader for the compact format; only the arrays and rows actually touched are paged in."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            prefix = f.read(8)
+            if prefix[:4] != MAGIC:
+                raise ValueError(f"{path} is not a compact transcript")
+            header_len = int.from_bytes(prefix[4:], 'little')
+            header = json.loads(f.read(header_len))
+        if header['version'] != VERSION:
+            raise ValueError(f"{path} has unsupported version {header['version']}")
+        self.path = path
+        self.index_sec = header['index_sec']
+        self.speakers = header['speakers']
+        base = 8 + header_len
+        self._arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if np.prod(shape) == 0:
+                self._arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                self._arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=base + spec['offset'], shape=shape)
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get('_arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.seg_start)
+
+    def text(self, string_id: int) -> str:
+        start, end = self.str_offsets[string_id], self.str_offsets[string_id + 1]
+        return bytes(self.str_bytes[start:end]).decode()
+
+    def segment(self, i: int) -> dict:
+        """Segment i as a dict in the same shape as the JSON transcript."""
+        speaker = int(self.seg_speaker[i])
+        first, last = self.seg_words[i], self.seg_words[i + 1]
+        return {
+            'start': self.seg_start[i] / 1000,
+            'end': self.seg_end[i] / 1000,
+            'text': self.text(self.seg_text[i]),
+            'speaker': self.speakers[speaker] if speaker >= 0 else None,
+            'words': [
+                {'word': self.text(self.word_text[w]), 'start': self.word_start[w] / 1000, 'end': self.word_end[w] / 1000}
+                for w in range(first, last)
+            ],
+        }
+
+    def segments_between(self, start_sec: float, end_sec: float):
+        """Yield segments overlapping [start_sec, end_sec), starting from the time index instead of the first segment."""
+        bucket = int(start_sec // self.index_sec)
+        if bucket >= len(self.time_index):
+            return
+        start_ms, end_ms = start_sec * 1000, end_sec * 1000
+        for i in range(int(self.time_index[max(bucket, 0)]), len(self)):
+            if self.seg_start[i] >= end_ms:
+                break
+            if self.seg_end[i] > start_ms:
+                yield self.segment(i)
+
+    def segments_for_speaker(self, speaker: str):
+        """Yield every segment attributed to speaker, in time order."""
+        if speaker not in self.speakers:
+            return
+        row = self.speakers.index(speaker)
+        for i in self.speaker_segments[self.speaker_offsets[row]:self.speaker_offsets[row + 1]]:
+            yield self.segment(int(i))
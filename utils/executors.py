@@ -0,0 +1,96 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils import metrics
+
+# Shared execution layer so CPU-bound work (model inference, ffmpeg) never runs on the event loop.
+# Inference goes to a process pool whose workers keep their models warm between calls;
+# ffmpeg subprocesses and other blocking calls go to a thread pool.
+_inference_pool = None
+_io_pool = None
+
+
+def inference_workers() -> int:
+    return max(1, int(os.getenv("INFERENCE_WORKERS", "1")))
+
+
+def threads_per_worker() -> int:
+    """Intra-op threads per inference worker; by default the CPUs are split evenly so workers do not oversubscribe them."""
+    configured = os.getenv("INFERENCE_THREADS_PER_WORKER")
+    if configured:
+        return max(1, int(configured))
+    return max(1, (os.cpu_count() or 1) // inference_workers())
+
+
+def _init_inference_worker(num_threads: int):
+    logging.basicConfig(level=logging.INFO)
+    # A forked worker starts with a copy of the parent's aggregates; only its own go back
+    metrics.drain()
+    # Read by OpenMP/MKL when they initialize; torch is told directly in case it is already loaded
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    logging.info(f"Inference worker {os.getpid()} started with {num_threads} thread(s)")
+
+
+def get_inference_pool() -> ProcessPoolExecutor:
+    """Return the process pool used for Whisper and pyannote inference, creating it on first use."""
+    global _inference_pool
+    if _inference_pool is None:
+        workers = inference_workers()
+        # torch and CUDA do not survive fork reliably, so workers are spawned fresh.
+        start_method = os.getenv("INFERENCE_START_METHOD", "spawn")
+        _inference_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_inference_worker,
+            initargs=(threads_per_worker(),),
+        )
+        logging.info(f"Started inference pool with {workers} worker process(es)")
+    return _inference_pool
+
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """Return the thread pool used for ffmpeg subprocesses and other blocking calls."""
+    global _io_pool
+    if _io_pool is None:
+        workers = max(1, int(os.getenv("FFMPEG_WORKERS", "4")))
+        _io_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ffmpeg")
+    return _io_pool
+
+
+def _call_in_worker(func, args, kwargs):
+    """Runs in an inference worker: return func's result with the metrics the worker gathered since its last call."""
+    return func(*args, **kwargs), os.getpid(), metrics.drain()
+
+
+async def run_inference(func, *args, **kwargs):
+    """Run a picklable, module-level callable in the inference process pool."""
+    loop = asyncio.get_running_loop()
+    result, pid, snapshot = await loop.run_in_executor(get_inference_pool(), functools.partial(_call_in_worker, func, args, kwargs))
+    metrics.merge(snapshot, pid=pid)
+    return result
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable in the ffmpeg/IO thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors(wait: bool = True):
+    """Shut down both pools; safe to call more than once."""
+    global _inference_pool, _io_pool
+    if _inference_pool is not None:
+        _inference_pool.shutdown(wait=wait)
+        _inference_pool = None
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=wait)
+        _io_pool = None
@@ -1,15 +1,65 @@
 import ffmpeg
 import asyncio
 import logging
+import os
+from utils.executors import run_blocking
 
-async def extract_audio_to_wav(video_path: str, wav_path: str) -> str:
-    """Extract mono WAV audio from video using ffmpeg."""
+async def extract_audio_to_wav(video_path: str, wav_path: str, input_options: dict = None) -> str:
+    """Extract mono WAV audio from video (a path or URL; input_options are ffmpeg input flags) using ffmpeg."""
     logging.info(f"Extracting audio from {video_path} to {wav_path}")
-    (
+    stream = (
         ffmpeg
-        .input(video_path)
+        .input(video_path, **(input_options or {}))
         .output(wav_path, ac=1, ar='16k', format='wav')
         .overwrite_output()
-        .run(quiet=True)
     )
+    await run_blocking(stream.run, quiet=True)
     return wav_path
+
+async def segment_audio_to_wavs(video_path: str, full_wav_path: str, chunk_pattern: str, chunk_length_sec: int,
+                                input_options: dict = None):
+    """
+    Decode the audio of a video once, writing the full 16 kHz mono WAV and fixed-length chunk WAVs
+    (named from chunk_pattern, e.g. 'id_chunk_%d.wav', numbered from 1) in the same ffmpeg pass.
+    video_path may also be a stream URL, with input_options as extra ffmpeg input flags.
+    Async generator yielding each chunk path as soon as ffmpeg has finalized it.
+    """
+    logging.info(f"Extracting audio from {video_path} to {full_wav_path} and {chunk_length_sec}s chunks")
+    chunk_dir = os.path.dirname(chunk_pattern)
+    segment_list_path = os.path.join(chunk_dir, os.path.basename(full_wav_path) + '.segments')
+    audio = ffmpeg.input(video_path, **(input_options or {})).audio
+    full_output = audio.output(full_wav_path, acodec='pcm_s16le', ac=1, ar='16k', format='wav')
+    chunk_output = audio.output(
+        chunk_pattern, acodec='pcm_s16le', ac=1, ar='16k', f='segment',
+        segment_time=chunk_length_sec, segment_start_number=1, segment_format='wav',
+        segment_list=segment_list_path, segment_list_type='flat', reset_timestamps=1
+    )
+    args = ffmpeg.merge_outputs(full_output, chunk_output).global_args('-loglevel', 'error').overwrite_output().compile()
+    process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    stderr_task = asyncio.create_task(process.stderr.read())
+    # The segment muxer appends a line to the list once a chunk file is complete
+    seen = 0
+    try:
+        while True:
+            finished = process.returncode is not None
+            if os.path.exists(segment_list_path):
+                with open(segment_list_path) as f:
+                    entries = [line.strip() for line in f if line.strip()]
+                for entry in entries[seen:]:
+                    yield os.path.join(chunk_dir, entry)
+                seen = len(entries)
+            if finished:
+                break
+            try:
+                await asyncio.wait_for(process.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+        stderr = await stderr_task
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed for {video_path}: {stderr.decode(errors='replace').strip()}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        if os.path.exists(segment_list_path):
+            os.remove(segment_list_path)
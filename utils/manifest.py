@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from utils.azure_blob import upload_bytes_async, download_bytes_async
+
+# Per-video record of what the pipeline has already done, so reruns only do the delta:
+# stage status, chunk content hashes, the model that produced each chunk transcript,
+# and the ETags of published outputs.
+STAGES = ('prepare', 'transcribe', 'diarize', 'publish')
+
+
+def manifests_container() -> str:
+    return os.getenv('AZURE_BLOB_MANIFESTS_CONTAINER', 'manifests')
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VideoManifest:
+    """Pipeline state for one video, stored as '<video_id>/manifest.json' in the manifests container."""
+
+    def __init__(self, video_id: str, data: dict = None):
+        self.video_id = video_id
+        data = data or {}
+        self.stages = data.get('stages', {})
+        self.chunks = data.get('chunks', {})
+        self.outputs = data.get('outputs', {})
+
+    @property
+    def blob_name(self) -> str:
+        return f"{self.video_id}/manifest.json"
+
+    def chunk_result_blob(self, chunk_blob: str) -> str:
+        """Where the transcript of a single chunk is kept so a crashed run can resume after it."""
+        return f"{self.video_id}/{os.path.splitext(chunk_blob)[0]}.json"
+
+    def stage_done(self, stage: str, model_version: str = None) -> bool:
+        entry = self.stages.get(stage, {})
+        if entry.get('status') != 'done':
+            return False
+        return model_version is None or entry.get('model_version') == model_version
+
+    def mark_stage(self, stage: str, status: str, **info):
+        self.stages[stage] = {'status': status, 'updated': _now(), **info}
+
+    def record_chunk(self, chunk_blob: str, sha256: str, timeline=None, owned=None):
+        """
+        Record a (re)prepared chunk; its transcript is invalidated if the content changed. timeline maps chunk
+        time to recording time as [chunk_start_sec, original_start_sec, duration_sec] pieces; owned is the
+        [start_sec, end_sec] of recording time whose words this chunk contributes when chunks overlap.
+        """
+        entry = self.chunks.get(chunk_blob)
+        if (entry is None or entry.get('sha256') != sha256 or entry.get('timeline') != timeline
+                or entry.get('owned') != owned):
+            self.chunks[chunk_blob] = {'sha256': sha256, 'status': 'pending'}
+            if timeline is not None:
+                self.chunks[chunk_blob]['timeline'] = timeline
+            if owned is not None:
+                self.chunks[chunk_blob]['owned'] = owned
+
+    def chunk_timeline(self, chunk_blob: str):
+        return self.chunks.get(chunk_blob, {}).get('timeline')
+
+    def chunk_owned(self, chunk_blob: str):
+        return self.chunks.get(chunk_blob, {}).get('owned')
+
+    def retain_chunks(self, chunk_blobs):
+        """Forget chunks that a re-prepare no longer produced."""
+        self.chunks = {name: entry for name, entry in self.chunks.items() if name in chunk_blobs}
+
+    def chunk_transcribed(self, chunk_blob: str, model_version: str) -> bool:
+        entry = self.chunks.get(chunk_blob, {})
+        return entry.get('status') == 'transcribed' and entry.get('model_version') == model_version
+
+    def mark_chunk_transcribed(self, chunk_blob: str, model_version: str, result_etag: str = None):
+        entry = self.chunks.setdefault(chunk_blob, {})
+        entry.update({'status': 'transcribed', 'model_version': model_version, 'result_etag': result_etag, 'updated': _now()})
+
+    def is_up_to_date(self, model_version: str, require_diarization: bool = False) -> bool:
+        """True when outputs were published by model_version after the audio and every chunk transcript last changed."""
+        if not self.stage_done('publish', model_version):
+            return False
+        if require_diarization and not self.stages['publish'].get('diarized'):
+            return False
+        return self.stages['publish']['updated'] >= self.last_changed()
+
+    def last_changed(self) -> str:
+        """When the audio was last prepared or a chunk last transcribed, whichever is later."""
+        return max([self.stages.get('prepare', {}).get('updated', '')]
+                   + [entry.get('updated', '') for entry in self.chunks.values()])
+
+    def record_output(self, blob_name: str, etag: str):
+        self.outputs[blob_name] = etag
+
+    def to_dict(self) -> dict:
+        return {'video_id': self.video_id, 'stages': self.stages, 'chunks': self.chunks, 'outputs': self.outputs}
+
+
+async def load_manifest(video_id: str) -> VideoManifest:
+    data = await download_bytes_async(manifests_container(), f"{video_id}/manifest.json")
+    return VideoManifest(video_id, json.loads(data) if data else None)
+
+
+async def save_manifest(manifest: VideoManifest):
+    await upload_bytes_async(json.dumps(manifest.to_dict(), indent=2).encode(), manifests_container(), manifest.blob_name)
+    logging.debug(f"Saved manifest for {manifest.video_id}")
+
+
+async def load_chunk_result(manifest: VideoManifest, chunk_blob: str):
+    data = await download_bytes_async(manifests_container(), manifest.chunk_result_blob(chunk_blob))
+    return json.loads(data) if data else None
+
+
+async def save_chunk_result(manifest: VideoManifest, chunk_blob: str, segments) -> str:
+    return await upload_bytes_async(json.dumps({'segments': segments}).encode(), manifests_container(), manifest.chunk_result_blob(chunk_blob))
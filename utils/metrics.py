@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Run metrics. Every timed stage or event becomes one structured record (a JSON line in METRICS_JSONL,
+# or on the 'metrics' logger), and is also folded into per-process aggregates that render_prometheus()
+# exposes in Prometheus text format, optionally over HTTP on METRICS_PORT. Inference runs in worker
+# processes: their records (model load time, per-call timings) land in the same JSON lines file
+# tagged with their pid, and their aggregates travel back with each run_inference result and are
+# merged into the parent's (see drain/merge), so /metrics covers the workers too.
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+_gauges = {}
+_worker_peak_rss = 0
+_server = None
+_metrics_logger = logging.getLogger('metrics')
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add to a counter, e.g. inc('blob_bytes_total', n, direction='upload')."""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Record one observation of a summary (count, sum and max are kept)."""
+    with _lock:
+        key = _key(name, labels)
+        count, total, largest = _summaries.get(key, (0, 0.0, value))
+        _summaries[key] = (count + 1, total + value, max(largest, value))
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def emit(event: str, **fields):
+    """Write one structured record."""
+    record = {'ts': round(time.time(), 3), 'event': event, 'pid': os.getpid(), **fields}
+    line = json.dumps(record, default=str)
+    path = os.getenv('METRICS_JSONL')
+    if path:
+        # One write per line on an O_APPEND file, so records from several processes do not interleave
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+    else:
+        _metrics_logger.info(line)
+    return record
+
+
+@contextmanager
+def stage_timer(stage: str, **labels):
+    """
+    Time a stage and emit a 'stage' record with wall time and peak RSS. The yielded dict can be filled in:
+    'audio_sec' adds a real-time factor, 'bytes' and any other keys are passed through.
+
+        with stage_timer('transcribe_chunk', video_id=video_id, chunk=name) as record:
+            record['audio_sec'] = duration
+    """
+    record = {}
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        wall = time.perf_counter() - started
+        record.update(stage=stage, status=status, wall_sec=round(wall, 3), peak_rss_bytes=peak_rss_bytes())
+        if record.get('audio_sec'):
+            record['rtf'] = round(wall / record['audio_sec'], 4)
+            observe('pipeline_stage_audio_seconds', record['audio_sec'], stage=stage)
+        observe('pipeline_stage_seconds', wall, stage=stage, status=status)
+        if record.get('bytes'):
+            inc('pipeline_stage_bytes_total', record['bytes'], stage=stage)
+        if _worker_peak_rss:
+            # Inference runs in the worker processes, so their memory is what the model costs
+            record['worker_peak_rss_bytes'] = _worker_peak_rss
+        set_gauge('process_peak_rss_bytes', record['peak_rss_bytes'])
+        emit('stage', **labels, **record)
+
+
+def record_model_load(model: str, seconds: float):
+    observe('model_load_seconds', seconds, model=model)
+    emit('model_load', model=model, seconds=round(seconds, 3), peak_rss_bytes=peak_rss_bytes())
+
+
+def drain() -> dict:
+    """Take this process's counters and summaries (resetting them) plus its peak RSS, to ship to another process."""
+    with _lock:
+        snapshot = {'counters': dict(_counters), 'summaries': dict(_summaries), 'peak_rss_bytes': peak_rss_bytes()}
+        _counters.clear()
+        _summaries.clear()
+    return snapshot
+
+
+def merge(snapshot: dict, **labels):
+    """Fold a drain() snapshot from a worker process into this process's aggregates."""
+    global _worker_peak_rss
+    with _lock:
+        for key, value in snapshot['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, (count, total, largest) in snapshot['summaries'].items():
+            ours = _summaries.get(key)
+            if ours is not None:
+                count, total, largest = ours[0] + count, ours[1] + total, max(ours[2], largest)
+            _summaries[key] = (count, total, largest)
+        _worker_peak_rss = max(_worker_peak_rss, snapshot['peak_rss_bytes'])
+    set_gauge('inference_worker_peak_rss_bytes', snapshot['peak_rss_bytes'], **labels)
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def render_prometheus() -> str:
+    """This process's aggregates in Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters, summaries, gauges = dict(_counters), dict(_summaries), dict(_gauges)
+    for kind, metrics in (('counter', counters), ('gauge', gauges)):
+        for name in sorted({name for name, _ in metrics}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(metrics.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels_text(labels)} {value}")
+    for name in sorted({name for name, _ in summaries}):
+        lines.append(f"# TYPE {name} summary")
+        for (metric, labels), (count, total, largest) in sorted(summaries.items()):
+            if metric == name:
+                lines.append(f"{name}_count{_labels_text(labels)} {count}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {total}")
+                lines.append(f"{name}_max{_labels_text(labels)} {largest}")
+    return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(port: int = None):
+    """Serve render_prometheus() on http://0.0.0.0:<port>/metrics from a daemon thread when METRICS_PORT (or port) is set."""
+    global _server
+    port = port or int(os.getenv('METRICS_PORT', '0'))
+    if not port or _server is not None:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on :{port}/metrics")
+    return _server
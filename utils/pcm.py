@@ -0,0 +1,99 @@
+import logging
+import wave
+import numpy as np
+import ffmpeg
+
+# 16 kHz mono is what Whisper and pyannote consume, so audio is decoded to it exactly once.
+SAMPLE_RATE = 16000
+
+
+def decode_audio_pcm(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode any audio/video file to a mono float32 array in [-1, 1] with a single ffmpeg call."""
+    logging.info(f"Decoding {path} to {sample_rate} Hz PCM")
+    out, _ = (
+        ffmpeg
+        .input(path)
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+def _wav_data_offset(path: str):
+    """Return (byte offset, byte length) of the PCM data chunk of a 16-bit mono WAV file."""
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = chunk_header[:4], int.from_bytes(chunk_header[4:], 'little')
+            if chunk_id == b'fmt ':
+                fmt = f.read(size + (size & 1))
+                channels = int.from_bytes(fmt[2:4], 'little')
+                bits = int.from_bytes(fmt[14:16], 'little')
+                if channels != 1 or bits != 16:
+                    raise ValueError(f"{path} must be 16-bit mono PCM, got {channels} channel(s) at {bits} bits")
+            elif chunk_id == b'data':
+                return f.tell(), size
+            else:
+                f.seek(size + (size & 1), 1)
+
+
+def wav_duration(path: str) -> float:
+    """Seconds of 16 kHz mono PCM in a WAV file, read from its header."""
+    return _wav_data_offset(path)[1] / 2 / SAMPLE_RATE
+
+
+def memmap_wav(path: str) -> np.ndarray:
+    """Memory-map the int16 samples of a 16-bit mono WAV without reading it into RAM."""
+    offset, length = _wav_data_offset(path)
+    return np.memmap(path, dtype=np.int16, mode='r', offset=offset, shape=(length // 2,))
+
+
+def write_wav(path: str, samples, sample_rate: int = SAMPLE_RATE) -> str:
+    """Write mono samples (int16, or float in [-1, 1]) as a 16-bit PCM WAV."""
+    samples = np.asarray(samples)
+    if samples.dtype != np.int16:
+        samples = np.clip(np.round(samples * 32768.0), -32768, 32767).astype(np.int16)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+class WavSlice:
+    """A picklable [start, end) sample range of a WAV file; workers map it themselves instead of receiving a copy."""
+
+    def __init__(self, path: str, start: int, end: int):
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def load(self) -> np.ndarray:
+        return memmap_wav(self.path)[self.start:self.end].astype(np.float32) / 32768.0
+
+    def __repr__(self):
+        return f"WavSlice({self.path!r}, {self.start}, {self.end})"
+
+
+def as_float32(audio) -> np.ndarray:
+    """Return float32 samples for an ndarray (int16 or float) or a WavSlice."""
+    if isinstance(audio, WavSlice):
+        return audio.load()
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32768.0
+    return np.asarray(audio, dtype=np.float32)
+
+
+def chunk_bounds(num_samples: int, chunk_length_sec: int, sample_rate: int = SAMPLE_RATE):
+    """Return [(start_sample, end_sample), ...] covering num_samples in chunk_length_sec pieces."""
+    step = chunk_length_sec * sample_rate
+    return [(start, min(start + step, num_samples)) for start in range(0, num_samples, step)]
@@ -0,0 +1,253 @@
+import asyncio
+import inspect
+import logging
+import os
+import threading
+import time
+import numpy as np
+from utils.executors import run_inference
+from utils.pcm import SAMPLE_RATE, WavSlice, as_float32, memmap_wav
+from utils.result_cache import cached_inference
+from utils.metrics import record_model_load
+
+DIARIZATION_MODEL = "pyannote/speaker-diarization"
+# Used for window embeddings when the pipeline does not name its own embedding model
+EMBEDDING_MODEL = "speechbrain/spkrec-ecapa-voxceleb"
+
+# One pyannote pipeline per process (i.e. per inference worker), loaded on first use.
+_pipeline = None
+_pipeline_lock = threading.Lock()
+_pipeline_stats = {"loads": 0, "load_seconds": 0.0, "calls": 0}
+_returns_embeddings = None
+_embedding_model = None
+
+
+def get_pipeline():
+    """Return this process's pyannote pipeline, loading it once."""
+    global _pipeline
+    with _pipeline_lock:
+        _pipeline_stats["calls"] += 1
+        if _pipeline is not None:
+            return _pipeline
+        hf_token = os.getenv("HUGGINGFACE_TOKEN")
+        logging.info(f"[Diarization] Checking Hugging Face token: {'FOUND' if hf_token else 'NOT FOUND'}")
+        if not hf_token:
+            raise RuntimeError("HUGGINGFACE_TOKEN environment variable not set. Please set it to your Hugging Face access token.")
+        from pyannote.audio import Pipeline
+        logging.info("[Diarization] Loading pyannote pipeline...")
+        started = time.perf_counter()
+        _pipeline = Pipeline.from_pretrained(DIARIZATION_MODEL, use_auth_token=hf_token)
+        _pipeline_stats["loads"] += 1
+        _pipeline_stats["load_seconds"] += time.perf_counter() - started
+        record_model_load(DIARIZATION_MODEL, time.perf_counter() - started)
+        logging.info(f"[Diarization] Pipeline loaded in {_pipeline_stats['load_seconds']:.2f}s")
+        return _pipeline
+
+
+def get_pipeline_stats() -> dict:
+    return dict(_pipeline_stats)
+
+
+def _pipeline_input(audio):
+    if isinstance(audio, str):
+        return audio
+    import torch
+    return {"waveform": torch.from_numpy(as_float32(audio)).unsqueeze(0), "sample_rate": SAMPLE_RATE}
+
+
+def _segments(diarization, offset_sec: float = 0.0):
+    return [
+        {"start": segment.start + offset_sec, "end": segment.end + offset_sec, "speaker": speaker}
+        for segment, _, speaker in diarization.itertracks(yield_label=True)
+    ]
+
+
+def diarize_audio(audio):
+    """Diarize a WAV path, or in-memory 16 kHz samples (ndarray or WavSlice) without touching disk."""
+    try:
+        pipeline = get_pipeline()
+        logging.info("[Diarization] Running diarization...")
+        segments = _segments(pipeline(_pipeline_input(audio)))
+        logging.info(f"[Diarization] Got {len(segments)} diarization segments. Example: {segments[:3]}")
+        return segments
+    except Exception as e:
+        logging.error(f"[Diarization] Exception during diarization: {e}", exc_info=True)
+        raise
+
+
+def _pipeline_returns_embeddings(pipeline) -> bool:
+    """Whether the pipeline can return speaker embeddings itself (pyannote >= 3.1); checked once per process."""
+    global _returns_embeddings
+    if _returns_embeddings is None:
+        try:
+            _returns_embeddings = "return_embeddings" in inspect.signature(pipeline.apply).parameters
+        except (AttributeError, TypeError, ValueError):
+            _returns_embeddings = False
+    return _returns_embeddings
+
+
+def get_embedding_model(pipeline):
+    """Return this process's speaker embedding model (the pipeline's own, where it names one), loading it once."""
+    global _embedding_model
+    with _pipeline_lock:
+        if _embedding_model is not None:
+            return _embedding_model
+        from pyannote.audio.pipelines.speaker_verification import PretrainedSpeakerEmbedding
+        name = getattr(pipeline, "embedding", None)
+        name = name if isinstance(name, str) else EMBEDDING_MODEL
+        logging.info(f"[Diarization] Loading embedding model {name}...")
+        started = time.perf_counter()
+        _embedding_model = PretrainedSpeakerEmbedding(name, use_auth_token=os.getenv("HUGGINGFACE_TOKEN"))
+        record_model_load(name, time.perf_counter() - started)
+        return _embedding_model
+
+
+def _centroid_embeddings(pipeline, audio_input, diarization, turns_per_speaker: int = 5, max_turn_sec: float = 10.0):
+    """Per-speaker mean embedding from a speaker's longest turns, for pipelines that cannot return embeddings."""
+    waveform = audio_input["waveform"] if isinstance(audio_input, dict) else None
+    if waveform is None:
+        import torch
+        waveform = torch.from_numpy(memmap_wav(audio_input).astype(np.float32) / 32768.0).unsqueeze(0)
+    embedding_model = get_embedding_model(pipeline)
+    embeddings = {}
+    for label in diarization.labels():
+        turns = sorted(diarization.label_timeline(label), key=lambda s: s.duration, reverse=True)[:turns_per_speaker]
+        vectors = []
+        for turn in turns:
+            start = int(turn.start * SAMPLE_RATE)
+            end = min(int((turn.start + min(turn.duration, max_turn_sec)) * SAMPLE_RATE), waveform.shape[-1])
+            if end - start < SAMPLE_RATE // 2:
+                continue
+            # (batch, channel, samples) in, (batch, dimension) out
+            vector = np.asarray(embedding_model(waveform[None, :, start:end]))[0]
+            vectors.append(vector / (np.linalg.norm(vector) + 1e-9))
+        if vectors:
+            embeddings[label] = np.mean(vectors, axis=0)
+    return embeddings
+
+
+def diarize_window(audio, offset_sec: float):
+    """
+    Diarize one window (runs in an inference worker). Returns recording-relative segments plus one
+    embedding per window-local speaker, used to match speakers across windows.
+    """
+    pipeline = get_pipeline()
+    audio_input = _pipeline_input(audio)
+    if _pipeline_returns_embeddings(pipeline):
+        diarization, embeddings = pipeline(audio_input, return_embeddings=True)
+        speaker_embeddings = {label: embeddings[i] for i, label in enumerate(diarization.labels())}
+    else:
+        diarization = pipeline(audio_input)
+        speaker_embeddings = _centroid_embeddings(pipeline, audio_input, diarization)
+    return {
+        "segments": _segments(diarization, offset_sec),
+        "embeddings": {label: np.asarray(vector, dtype=np.float32).tolist() for label, vector in speaker_embeddings.items()},
+    }
+
+
+def window_bounds(num_samples: int, window_sec: float, overlap_sec: float):
+    """Return [(start_sample, end_sample), ...] of overlapping windows covering num_samples."""
+    window = int(window_sec * SAMPLE_RATE)
+    step = max(1, window - int(overlap_sec * SAMPLE_RATE))
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + window, num_samples)
+        bounds.append((start, end))
+        if end >= num_samples:
+            return bounds
+        start += step
+
+
+def stitch_windows(windows, bounds, threshold: float = 0.6):
+    """
+    Merge per-window diarization into recording-wide speakers. Window-local speakers are clustered
+    greedily by cosine similarity of their embeddings (two speakers of one window never merge), and
+    each window keeps only the turns in its half of the overlap with its neighbours.
+    """
+    centroids = []  # running sums of normalized embeddings per global speaker
+    segments = []
+    for index, (window, (start, end)) in enumerate(zip(windows, bounds)):
+        mapping = {}
+        taken = set()
+        local = sorted(window["embeddings"].items())
+        for label, vector in local:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) + 1e-9
+            best, best_similarity = None, threshold
+            for global_id, centroid in enumerate(centroids):
+                if global_id in taken:
+                    continue
+                similarity = float(np.dot(centroid / (np.linalg.norm(centroid) + 1e-9), vector))
+                if similarity >= best_similarity:
+                    best, best_similarity = global_id, similarity
+            if best is None:
+                best = len(centroids)
+                centroids.append(np.zeros_like(vector))
+            centroids[best] += vector
+            taken.add(best)
+            mapping[label] = best
+        # Each window owns the time up to the middle of its overlaps
+        own_start = 0.0 if index == 0 else (start + bounds[index - 1][1]) / 2 / SAMPLE_RATE
+        own_end = float('inf') if index == len(bounds) - 1 else (end + bounds[index + 1][0]) / 2 / SAMPLE_RATE
+        for seg in window["segments"]:
+            seg_start, seg_end = max(seg["start"], own_start), min(seg["end"], own_end)
+            if seg_end <= seg_start:
+                continue
+            global_id = mapping.get(seg["speaker"])
+            # A speaker without an embedding cannot be matched, so keep it distinct per window
+            speaker = f"SPEAKER_{global_id:02d}" if global_id is not None else f"WINDOW_{index}_{seg['speaker']}"
+            segments.append({"start": seg_start, "end": seg_end, "speaker": speaker})
+    segments.sort(key=lambda seg: seg["start"])
+    # Rejoin turns that were split only by a window boundary
+    merged = []
+    for seg in segments:
+        if merged and merged[-1]["speaker"] == seg["speaker"] and seg["start"] - merged[-1]["end"] < 1e-3:
+            merged[-1]["end"] = max(merged[-1]["end"], seg["end"])
+        else:
+            merged.append(seg)
+    return merged
+
+
+async def diarize_windowed(audio, window_sec: float = None, overlap_sec: float = None):
+    """Diarize overlapping windows in parallel across the inference pool and stitch speakers together."""
+    window_sec = window_sec or float(os.getenv("DIARIZATION_WINDOW_SEC", "600"))
+    overlap_sec = overlap_sec or float(os.getenv("DIARIZATION_WINDOW_OVERLAP_SEC", "30"))
+    samples = memmap_wav(audio) if isinstance(audio, str) else audio
+    bounds = window_bounds(len(samples), window_sec, overlap_sec)
+    logging.info(f"[Diarization] Windowed mode: {len(bounds)} windows of {window_sec:.0f}s with {overlap_sec:.0f}s overlap")
+
+    def window_audio(start, end):
+        # Workers memory-map WAV windows themselves; in-memory audio is sent as a slice
+        return WavSlice(audio, start, end) if isinstance(audio, str) else np.asarray(samples[start:end])
+
+    windows = await asyncio.gather(*(
+        run_inference(diarize_window, window_audio(start, end), start / SAMPLE_RATE) for start, end in bounds
+    ))
+    threshold = float(os.getenv("DIARIZATION_STITCH_THRESHOLD", "0.6"))
+    segments = stitch_windows(windows, bounds, threshold)
+    logging.info(f"[Diarization] Stitched {len(segments)} segments from {len(bounds)} windows")
+    return segments
+
+
+def _diarization_mode() -> str:
+    return os.getenv("DIARIZATION_MODE", "whole")
+
+
+async def diarize_audio_async(audio):
+    """
+    Diarize in the inference pool, reusing a cached result for identical audio. With DIARIZATION_MODE=windowed,
+    recordings longer than one window are split across the pool and stitched.
+    """
+    mode = _diarization_mode()
+    config = {'pipeline': DIARIZATION_MODEL, 'mode': mode}
+    if mode == "windowed":
+        config.update({
+            'window_sec': float(os.getenv("DIARIZATION_WINDOW_SEC", "600")),
+            'overlap_sec': float(os.getenv("DIARIZATION_WINDOW_OVERLAP_SEC", "30")),
+            'threshold': float(os.getenv("DIARIZATION_STITCH_THRESHOLD", "0.6")),
+        })
+        compute = lambda: diarize_windowed(audio)
+    else:
+        compute = lambda: run_inference(diarize_audio, audio)
+    return await cached_inference(audio, 'diarization', config, compute)
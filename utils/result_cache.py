@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import numpy as np
+from utils.executors import run_blocking
+from utils.pcm import WavSlice, memmap_wav
+
+# Content-addressed cache for inference results. Keys are a hash of the 16-bit PCM samples
+# plus the model configuration, so the same audio is never re-inferred no matter which
+# file, chunk name or video it arrives under. Results live in a size-bounded local directory
+# and, optionally, in a blob container shared between nodes.
+
+
+def _enabled() -> bool:
+    return os.getenv('TRANSCRIPTION_CACHE', '1').lower() not in ('0', 'false', 'no')
+
+
+def pcm_sha256(audio) -> str:
+    """Hash the int16 PCM content of a WAV path, a WavSlice or a float/int16 sample array."""
+    if isinstance(audio, str):
+        try:
+            samples = memmap_wav(audio)
+        except ValueError:
+            # Not a 16-bit mono WAV; fall back to hashing the file bytes
+            digest = hashlib.sha256()
+            with open(audio, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            return digest.hexdigest()
+    elif isinstance(audio, WavSlice):
+        samples = memmap_wav(audio.path)[audio.start:audio.end]
+    elif audio.dtype == np.int16:
+        samples = audio
+    else:
+        samples = np.clip(np.round(np.asarray(audio) * 32768.0), -32768, 32767).astype(np.int16)
+    return hashlib.sha256(np.ascontiguousarray(samples).data).hexdigest()
+
+
+def cache_key(audio_hash: str, kind: str, config: dict) -> str:
+    payload = json.dumps({'audio': audio_hash, 'kind': kind, 'config': config}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """Local-disk JSON store with LRU eviction by total size, optionally backed by a blob container."""
+
+    def __init__(self, directory: str = None, max_bytes: int = None, container: str = None):
+        self.directory = directory or os.getenv('TRANSCRIPTION_CACHE_DIR', os.path.expanduser('~/.cache/transcription-pipeline'))
+        self.max_bytes = max_bytes or int(os.getenv('TRANSCRIPTION_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+        self.container = container or os.getenv('TRANSCRIPTION_CACHE_CONTAINER')
+        os.makedirs(self.directory, exist_ok=True)
+        # Running size of the local directory, counted on the first write and kept up to date after that
+        self._total = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_local(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # Touch so eviction is least-recently-used rather than least-recently-written
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def _write_local(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()[1]
+            else:
+                self._total += len(data) - replaced
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        # Other workers share the directory, so re-read it rather than trusting the running total,
+        # and evict down to 90% of the budget so the next few writes don't walk it again
+        entries, total = self._scan()
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Evicted concurrently by another thread or worker
+                pass
+            total -= size
+        with self._lock:
+            self._total = total
+        logging.info(f"Evicted result cache entries down to {total} bytes")
+
+    async def get(self, key: str):
+        data = await run_blocking(self._read_local, key)
+        if data is None and self.container:
+            from utils.azure_blob import download_bytes_async
+            try:
+                data = await download_bytes_async(self.container, f"{key}.json")
+            except Exception as e:
+                logging.warning(f"Result cache lookup of {key[:12]} in {self.container} failed: {e}")
+                return None
+            if data is not None:
+                try:
+                    await run_blocking(self._write_local, key, data)
+                except OSError as e:
+                    logging.warning(f"Failed to keep result cache entry {key[:12]} locally: {e}")
+        return json.loads(data) if data is not None else None
+
+    async def put(self, key: str, value):
+        """Store value under key; best-effort, so a failure is logged and never loses the caller's result."""
+        try:
+            data = json.dumps(value).encode()
+            await run_blocking(self._write_local, key, data)
+        except Exception as e:
+            logging.warning(f"Failed to write result cache entry {key[:12]}: {e}")
+            return
+        if self.container:
+            from utils.azure_blob import upload_bytes_async
+            try:
+                await upload_bytes_async(data, self.container, f"{key}.json")
+            except Exception as e:
+                logging.warning(f"Failed to upload result cache entry {key[:12]} to {self.container}: {e}")
+
+
+_cache = None
+
+
+def get_result_cache():
+    """Return the process-wide cache, or None if caching is disabled."""
+    global _cache
+    if not _enabled():
+        return None
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
+
+
+async def cached_inference(audio, kind: str, config: dict, compute):
+    """Return the cached result for (audio content, kind, config), or await compute() and store it."""
+    cache = get_result_cache()
+    if cache is None:
+        return await compute()
+    key = cache_key(await run_blocking(pcm_sha256, audio), kind, config)
+    result = await cache.get(key)
+    if result is not None:
+        logging.info(f"Result cache hit for {kind} ({key[:12]})")
+        return result
+    result = await compute()
+    await cache.put(key, result)
+    return result
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+from utils.metrics import stage_timer
+
+# Staged producer/consumer scheduler: each stage has its own worker count and a bounded
+# input queue, so a slow stage applies backpressure to the ones before it while several
+# items are in flight across stages at once.
+
+_DONE = object()
+
+
+class Stage:
+    """A named pipeline step: an async callable taking an item and returning the item for the next stage."""
+
+    def __init__(self, name: str, func, concurrency: int = 1, queue_size: int = 2):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+
+
+async def _stage_worker(stage, in_queue, out_queue, failures, describe):
+    while True:
+        item = await in_queue.get()
+        if item is _DONE:
+            return
+        started = time.perf_counter()
+        try:
+            with stage_timer(stage.name, item=describe(item)):
+                result = await stage.func(item)
+        except Exception as e:
+            logging.error(f"[{stage.name}] failed for {describe(item)}: {e}", exc_info=True)
+            failures.append((stage.name, item, e))
+            continue
+        logging.info(f"[{stage.name}] finished {describe(item)} in {time.perf_counter() - started:.1f}s")
+        # A stage may return None to drop an item that needs no further processing, and the
+        # last stage's results are dropped too when the caller does not collect them
+        if result is not None and out_queue is not None:
+            await out_queue.put(result)
+
+
+async def run_stages(items, stages, describe=str, collect: bool = True):
+    """
+    Push items through stages concurrently. Returns (completed_items, failures) where failures
+    is a list of (stage_name, item, exception); a failed item is dropped without stopping the others.
+    With collect=False the last stage's results are released as soon as it finishes each item and
+    completed_items is empty, so a long run does not hold every finished job until the end.
+    """
+    queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+    # Final results are collected, not consumed, so the last queue is unbounded
+    queues.append(asyncio.Queue() if collect else None)
+    failures = []
+
+    async def produce():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stages[0].concurrency):
+            await queues[0].put(_DONE)
+
+    async def run_stage(index, stage):
+        workers = [
+            asyncio.create_task(_stage_worker(stage, queues[index], queues[index + 1], failures, describe))
+            for _ in range(stage.concurrency)
+        ]
+        await asyncio.gather(*workers)
+        next_workers = stages[index + 1].concurrency if index + 1 < len(stages) else 0
+        for _ in range(next_workers):
+            await queues[index + 1].put(_DONE)
+
+    await asyncio.gather(produce(), *(run_stage(i, stage) for i, stage in enumerate(stages)))
+
+    completed = []
+    while collect and not queues[-1].empty():
+        completed.append(queues[-1].get_nowait())
+    return completed, failures
@@ -0,0 +1,467 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils.executors import run_blocking
+from utils.metrics import inc
+
+# Storage backends behind the helpers in utils/azure_blob.py. Every backend has the same async
+# methods as those helpers (upload_blob_async, download_bytes_async, ...), addressed by container
+# and blob name. STORAGE_BACKEND selects one per process:
+# - 'azure': Azure Blob Storage (default)
+# - 'local': a directory tree, <STORAGE_LOCAL_ROOT>/<container>/<blob_name>, for single-node runs
+#   and benchmarks; nothing touches the network
+# - 'tiered': write-through for STORAGE_LOCAL_CONTAINERS (the audio container by default); writes
+#   land on local disk and return, and are replicated to Azure in the background. Reads are served
+#   from local disk when the blob is there, so chunk and full wavs written and read on the same node
+#   never round-trip through the network, while other nodes still find everything in Azure. The
+#   local tier is bounded by STORAGE_LOCAL_MAX_BYTES; manifests are never kept locally
+
+
+def storage_backend() -> str:
+    return os.getenv('STORAGE_BACKEND', 'azure')
+
+
+def local_root() -> str:
+    return os.getenv('STORAGE_LOCAL_ROOT', os.path.join(tempfile.gettempdir(), 'pipeline-storage'))
+
+
+def _etag(path: str) -> str:
+    stat = os.stat(path)
+    return '"' + hashlib.md5(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+
+
+class LocalStorage:
+    """Blobs as files under root. Writes go to a temp file and are renamed into place, so readers never see partial blobs."""
+
+    def __init__(self, root: str = None):
+        self.root = root or local_root()
+        self.stats = {'operations': 0, 'uploaded_bytes': 0, 'downloaded_bytes': 0}
+
+    def path(self, container, blob_name) -> str:
+        return os.path.join(self.root, container, *blob_name.split('/'))
+
+    def exists(self, container, blob_name) -> bool:
+        return os.path.isfile(self.path(container, blob_name))
+
+    def _write(self, container, blob_name, write):
+        """Call write(tmp_path) and atomically move the result into place; returns the new ETag."""
+        path = self.path(container, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{id(write)}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.stats['operations'] += 1
+        self.stats['uploaded_bytes'] += os.path.getsize(path)
+        return _etag(path)
+
+    def _write_bytes(self, data: bytes):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        return write
+
+    def _append(self, container, blob_name, data: bytes):
+        path = self.path(container, blob_name)
+        with open(path, 'ab') as f:
+            f.write(data)
+        self.stats['operations'] += 1
+        self.stats['uploaded_bytes'] += len(data)
+        return _etag(path)
+
+    def _read(self, container, blob_name):
+        path = self.path(container, blob_name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.stats['operations'] += 1
+        self.stats['downloaded_bytes'] += len(data)
+        return data
+
+    def _download(self, container, blob_name, file_path):
+        path = self.path(container, blob_name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{blob_name} not found in {container}")
+        shutil.copyfile(path, file_path)
+        self.stats['operations'] += 1
+        self.stats['downloaded_bytes'] += os.path.getsize(path)
+
+    def _list(self, container, prefix):
+        base = os.path.join(self.root, container)
+        names = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                blob_name = os.path.relpath(os.path.join(directory, name), base).replace(os.sep, '/')
+                if not prefix or blob_name.startswith(prefix):
+                    names.append(blob_name)
+        self.stats['operations'] += 1
+        return sorted(names)
+
+    def _list_prefixes(self, container):
+        base = os.path.join(self.root, container)
+        self.stats['operations'] += 1
+        if not os.path.isdir(base):
+            return []
+        return sorted(f"{name}/" for name in os.listdir(base) if os.path.isdir(os.path.join(base, name)))
+
+    def _delete(self, container, blob_name):
+        os.remove(self.path(container, blob_name))
+        self.stats['operations'] += 1
+
+    async def upload_blob_async(self, file_path, container, blob_name, max_concurrency: int = None):
+        return await run_blocking(self._write, container, blob_name, lambda tmp_path: shutil.copyfile(file_path, tmp_path))
+
+    async def upload_bytes_async(self, data: bytes, container, blob_name):
+        return await run_blocking(self._write, container, blob_name, self._write_bytes(data))
+
+    async def create_append_blob_async(self, container, blob_name):
+        return await run_blocking(self._write, container, blob_name, self._write_bytes(b''))
+
+    async def append_block_async(self, container, blob_name, data: bytes):
+        return await run_blocking(self._append, container, blob_name, data)
+
+    async def download_bytes_async(self, container, blob_name):
+        return await run_blocking(self._read, container, blob_name)
+
+    async def download_blob_async(self, container, blob_name, file_path, max_concurrency: int = None):
+        await run_blocking(self._download, container, blob_name, file_path)
+
+    async def list_blobs_async(self, container: str, prefix: str = None):
+        return await run_blocking(self._list, container, prefix)
+
+    async def list_blob_prefixes_async(self, container: str):
+        return await run_blocking(self._list_prefixes, container)
+
+    async def copy_blob_async(self, source_container, destination_container, blob_name):
+        source = self.path(source_container, blob_name)
+        await run_blocking(self._write, destination_container, blob_name, lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    async def delete_blob_async(self, container, blob_name):
+        await run_blocking(self._delete, container, blob_name)
+
+    async def flush(self):
+        pass
+
+
+class ReplicationScope:
+    """The replications started by one unit of work (e.g. one worker task), so it can wait for and fail on only its own."""
+
+    def __init__(self):
+        self.tasks = set()
+        self.failures = []
+
+
+_current_scope = contextvars.ContextVar('replication_scope', default=None)
+
+
+@contextmanager
+def replication_scope():
+    """
+    Attribute every replication started inside the block (including by tasks it spawns) to a new scope:
+
+        with replication_scope():
+            await process_task(...)
+            await get_storage().flush()   # waits for, and raises on, this task's replications only
+    """
+    scope = ReplicationScope()
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def _failure_error(failures):
+    names = ', '.join(f"{container}/{blob_name}" for container, blob_name, _ in failures[:5])
+    return RuntimeError(f"{len(failures)} blob(s) failed to replicate to remote storage: {names}")
+
+
+class TieredStorage:
+    """
+    Local disk in front of a remote backend for the containers in local_containers; every other
+    container goes straight to the remote. Writes complete once they are on local disk and are
+    replicated to the remote in the background, in order per blob; flush() waits for replication.
+    Reads prefer the local copy and fall back to the remote. Once replicated, local copies are
+    evicted least recently used first whenever the local tier grows past max_bytes.
+    """
+
+    def __init__(self, local: LocalStorage, remote, local_containers, max_bytes: int = None, concurrency: int = None):
+        self.local = local
+        self.remote = remote
+        self.local_containers = set(local_containers)
+        self.max_bytes = max_bytes or int(os.getenv('STORAGE_LOCAL_MAX_BYTES', str(20 * 1024 ** 3)))
+        self._slots = asyncio.Semaphore(concurrency or int(os.getenv('STORAGE_REPLICATION_CONCURRENCY', '4')))
+        self._pending = {}
+        self._failures = []
+        # Blobs whose latest replication failed: the local copy is the only one
+        self._unreplicated = set()
+        # Size of every local blob, least recently used first; blobs left by an earlier process count too
+        self._sizes = OrderedDict()
+        self._local_bytes = 0
+        # Blobs left by an earlier process, which may have died before replicating them; they are not
+        # evicted until _reconcile() has found them on the remote or replicated them again
+        self._leftovers = set()
+        self._reconciled = None
+        for container in sorted(self.local_containers):
+            entries = []
+            for blob_name in self.local._list(container, None):
+                stat = os.stat(self.local.path(container, blob_name))
+                entries.append((stat.st_mtime, (container, blob_name), stat.st_size))
+            for _, key, size in sorted(entries):
+                self._sizes[key] = size
+                self._local_bytes += size
+                self._leftovers.add(key)
+
+    def _tiered(self, container) -> bool:
+        return container in self.local_containers
+
+    def _local_copy(self, container, blob_name) -> bool:
+        """True (and the blob counts as recently used) when reads can be served from the local tier."""
+        key = (container, blob_name)
+        if not self._tiered(container) or key not in self._sizes:
+            return False
+        if not self.local.exists(container, blob_name):
+            self._forget(key)
+            return False
+        self._sizes.move_to_end(key)
+        return True
+
+    def _track(self, container, blob_name, size: int, append: bool = False):
+        key = (container, blob_name)
+        # Rewritten (or appended to) here, so replicated by this process from now on
+        self._leftovers.discard(key)
+        previous = self._sizes.pop(key, 0)
+        size = previous + size if append else size
+        self._sizes[key] = size
+        self._local_bytes += size - previous
+
+    def _forget(self, key):
+        self._leftovers.discard(key)
+        self._local_bytes -= self._sizes.pop(key, 0)
+
+    async def _reconcile(self):
+        """Check blobs left by an earlier process against the remote, and replicate the ones it never received."""
+        # Runs in its own task: recovered uploads belong to no caller's replication scope
+        _current_scope.set(None)
+        try:
+            for container in sorted({container for container, _ in self._leftovers}):
+                remote = set(await self.remote.list_blobs_async(container))
+                for key in sorted(key for key in self._leftovers if key[0] == container):
+                    if key not in self._leftovers:
+                        continue
+                    if key[1] not in remote and key in self._sizes:
+                        logging.warning(f"Replicating {key[1]}, left unreplicated in local {container} by an earlier run")
+                        local_path = self.local.path(*key)
+                        self._replicate(*key, lambda path=local_path, key=key: self.remote.upload_blob_async(path, *key), 'recovered upload')
+                    self._leftovers.discard(key)
+        except Exception as e:
+            # Leftovers stay protected; the next eviction tries again
+            logging.error(f"Checking leftover local blobs against remote storage failed: {e}", exc_info=True)
+            self._reconciled = None
+
+    async def _evict(self):
+        """Drop replicated local copies, least recently used first, until the local tier fits max_bytes."""
+        if self._local_bytes <= self.max_bytes:
+            return
+        if self._leftovers:
+            if self._reconciled is None:
+                self._reconciled = asyncio.ensure_future(self._reconcile())
+            await self._reconciled
+        victims = []
+        for key in list(self._sizes):
+            if self._local_bytes <= self.max_bytes:
+                break
+            # Blobs still waiting to replicate, that failed to, or not yet checked against the
+            # remote may be the only copy; they stay
+            if key in self._pending or key in self._unreplicated or key in self._leftovers:
+                continue
+            self._forget(key)
+            victims.append(self.local.path(*key))
+        if victims:
+            await run_blocking(_remove_files, victims)
+            inc('storage_local_evictions_total', len(victims))
+            logging.info(f"Evicted {len(victims)} replicated blob(s) from local storage ({self._local_bytes} bytes kept)")
+
+    def _replicate(self, container, blob_name, operation, description: str):
+        """Run operation() against the remote after any earlier replication of the same blob has finished."""
+        key = (container, blob_name)
+        previous = self._pending.get(key)
+        scope = _current_scope.get()
+
+        async def run():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            async with self._slots:
+                try:
+                    await operation()
+                    self._unreplicated.discard(key)
+                    inc('storage_replications_total', container=container)
+                except Exception as e:
+                    logging.error(f"Replicating {description} of {blob_name} to remote {container} failed: {e}", exc_info=True)
+                    inc('storage_replication_failures_total', container=container)
+                    self._unreplicated.add(key)
+                    # The failure belongs to whoever wrote the blob: their scope, or the session if unscoped
+                    (scope.failures if scope is not None else self._failures).append((container, blob_name, e))
+                    raise
+                finally:
+                    if self._pending.get(key) is task:
+                        del self._pending[key]
+                    if scope is not None:
+                        scope.tasks.discard(task)
+            await self._evict()
+
+        task = asyncio.ensure_future(run())
+        self._pending[key] = task
+        if scope is not None:
+            scope.tasks.add(task)
+        return task
+
+    async def _after_replication(self, container, blob_name):
+        pending = self._pending.get((container, blob_name))
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+
+    async def upload_blob_async(self, file_path, container, blob_name, max_concurrency: int = None):
+        if not self._tiered(container):
+            return await self.remote.upload_blob_async(file_path, container, blob_name, max_concurrency)
+        etag = await self.local.upload_blob_async(file_path, container, blob_name)
+        local_path = self.local.path(container, blob_name)
+        self._track(container, blob_name, os.path.getsize(local_path))
+        # Replicate from the local copy: the caller is free to delete file_path as soon as this returns
+        self._replicate(container, blob_name, lambda: self.remote.upload_blob_async(local_path, container, blob_name, max_concurrency), 'upload')
+        return etag
+
+    async def upload_bytes_async(self, data: bytes, container, blob_name):
+        if not self._tiered(container):
+            return await self.remote.upload_bytes_async(data, container, blob_name)
+        etag = await self.local.upload_bytes_async(data, container, blob_name)
+        self._track(container, blob_name, len(data))
+        self._replicate(container, blob_name, lambda: self.remote.upload_bytes_async(data, container, blob_name), 'upload')
+        return etag
+
+    async def create_append_blob_async(self, container, blob_name):
+        if not self._tiered(container):
+            return await self.remote.create_append_blob_async(container, blob_name)
+        etag = await self.local.create_append_blob_async(container, blob_name)
+        self._track(container, blob_name, 0)
+        self._replicate(container, blob_name, lambda: self.remote.create_append_blob_async(container, blob_name), 'create')
+        return etag
+
+    async def append_block_async(self, container, blob_name, data: bytes):
+        if not self._tiered(container) or not self._local_copy(container, blob_name):
+            return await self.remote.append_block_async(container, blob_name, data)
+        etag = await self.local.append_block_async(container, blob_name, data)
+        self._track(container, blob_name, len(data), append=True)
+        self._replicate(container, blob_name, lambda: self.remote.append_block_async(container, blob_name, data), 'append')
+        return etag
+
+    async def download_bytes_async(self, container, blob_name):
+        if self._local_copy(container, blob_name):
+            return await self.local.download_bytes_async(container, blob_name)
+        return await self.remote.download_bytes_async(container, blob_name)
+
+    async def download_blob_async(self, container, blob_name, file_path, max_concurrency: int = None):
+        if self._local_copy(container, blob_name):
+            return await self.local.download_blob_async(container, blob_name, file_path)
+        return await self.remote.download_blob_async(container, blob_name, file_path, max_concurrency)
+
+    async def list_blobs_async(self, container: str, prefix: str = None):
+        names = set(await self.remote.list_blobs_async(container, prefix))
+        if self._tiered(container):
+            names.update(await self.local.list_blobs_async(container, prefix))
+        return sorted(names)
+
+    async def list_blob_prefixes_async(self, container: str):
+        prefixes = set(await self.remote.list_blob_prefixes_async(container))
+        if self._tiered(container):
+            prefixes.update(await self.local.list_blob_prefixes_async(container))
+        return sorted(prefixes)
+
+    async def copy_blob_async(self, source_container, destination_container, blob_name):
+        if not self._local_copy(source_container, blob_name):
+            await self._after_replication(source_container, blob_name)
+            return await self.remote.copy_blob_async(source_container, destination_container, blob_name)
+        if self._tiered(destination_container):
+            await self.local.copy_blob_async(source_container, destination_container, blob_name)
+            local_path = self.local.path(destination_container, blob_name)
+            self._track(destination_container, blob_name, os.path.getsize(local_path))
+            self._replicate(destination_container, blob_name,
+                            lambda: self.remote.upload_blob_async(local_path, destination_container, blob_name), 'copy')
+        else:
+            await self.remote.upload_blob_async(self.local.path(source_container, blob_name), destination_container, blob_name)
+
+    async def delete_blob_async(self, container, blob_name):
+        # A pending replication still reads the local copy; let it land, then delete both copies
+        await self._after_replication(container, blob_name)
+        if self._local_copy(container, blob_name):
+            self._forget((container, blob_name))
+            self._unreplicated.discard((container, blob_name))
+            await self.local.delete_blob_async(container, blob_name)
+        await self.remote.delete_blob_async(container, blob_name)
+
+    async def flush(self):
+        """
+        Wait for replication and raise if any of it failed. Inside a replication_scope only that
+        scope's replications count; outside one, everything pending is awaited and the failures of
+        writes made outside any scope are raised.
+        """
+        scope = _current_scope.get()
+        if scope is not None:
+            while scope.tasks:
+                await asyncio.gather(*list(scope.tasks), return_exceptions=True)
+            failures, scope.failures = scope.failures, []
+        else:
+            while self._pending:
+                await asyncio.gather(*list(self._pending.values()), return_exceptions=True)
+            failures, self._failures = self._failures, []
+        if failures:
+            raise _failure_error(failures)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_storage = None
+
+
+def get_storage():
+    """Return the process-wide backend selected by STORAGE_BACKEND, creating it on first use."""
+    global _storage
+    if _storage is None:
+        backend = storage_backend()
+        if backend == 'azure':
+            from utils.azure_blob import AzureBlobStorage
+            _storage = AzureBlobStorage()
+        elif backend == 'local':
+            _storage = LocalStorage()
+        elif backend == 'tiered':
+            from utils.azure_blob import AzureBlobStorage
+            from utils.manifest import manifests_container
+            default = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+            containers = {name.strip() for name in os.getenv('STORAGE_LOCAL_CONTAINERS', default).split(',') if name.strip()}
+            # Manifests are shared, mutable state; another node may have updated one since it was written here
+            if manifests_container() in containers:
+                logging.warning(f"Not keeping {manifests_container()} on local disk; manifests are always read from Azure")
+                containers.discard(manifests_container())
+            _storage = TieredStorage(LocalStorage(), AzureBlobStorage(), containers)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'azure', 'local' or 'tiered'")
+        logging.info(f"Using {backend} storage backend")
+    return _storage
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import logging
+import os
+from utils.azure_blob import create_append_blob_async, append_block_async
+
+# Streaming transcript output: segments are appended to '<video_id>_transcript.ndjson', one JSON
+# object per line, as soon as the chunk they belong to (and every chunk before it) is transcribed.
+# The blob is an append blob, so a partial transcript is readable while the rest is still decoding.
+MAX_APPEND_BLOCK = 4 * 1024 * 1024
+
+
+def streaming_enabled() -> bool:
+    return os.getenv('TRANSCRIPT_STREAMING', '1') != '0'
+
+
+def ndjson_blocks(segments, max_block: int = MAX_APPEND_BLOCK):
+    """Encode segments as NDJSON and group whole lines into blocks of at most max_block bytes."""
+    block = bytearray()
+    for seg in segments:
+        line = (json.dumps(seg, ensure_ascii=False) + '\n').encode()
+        if block and len(block) + len(line) > max_block:
+            yield bytes(block)
+            block = bytearray()
+        block += line
+    if block:
+        yield bytes(block)
+
+
+class TranscriptStream:
+    """An NDJSON transcript in an append blob. Use as an async context manager; write() segments in order."""
+
+    def __init__(self, video_id: str, container: str = 'transcripts'):
+        self.container = container
+        self.blob_name = f"{video_id}_transcript.ndjson"
+        self.segments_written = 0
+        self.etag = None
+
+    async def __aenter__(self):
+        self.etag = await create_append_blob_async(self.container, self.blob_name)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        state = 'partial' if exc_type else 'complete'
+        logging.info(f"Streamed {self.segments_written} segments to {self.blob_name} ({state})")
+
+    async def write(self, segments):
+        for block in ndjson_blocks(segments):
+            self.etag = await append_block_async(self.container, self.blob_name, block)
+        self.segments_written += len(segments)
+
+
+class InOrderWriter:
+    """
+    Accepts per-chunk results in any completion order and writes them to a TranscriptStream in chunk order,
+    as soon as every earlier chunk has arrived. Chunks waiting on an earlier one are the only ones held.
+    """
+
+    def __init__(self, stream: TranscriptStream = None):
+        self.stream = stream
+        self._pending = {}
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def put(self, index: int, segments):
+        if self.stream is None:
+            return
+        self._pending[index] = segments
+        async with self._lock:
+            while self._next in self._pending:
+                await self.stream.write(self._pending.pop(self._next))
+                self._next += 1
@@ -0,0 +1,119 @@
+import bisect
+import logging
+import os
+import numpy as np
+from utils.pcm import SAMPLE_RATE
+
+# Energy-based voice activity detection. Frames are compared to the recording's own noise
+# floor, so pre-roll, recesses and other long quiet stretches are dropped before Whisper sees
+# them. Chunks are then packed from speech only, each with a timeline mapping chunk time back
+# to recording time: a list of [chunk_start_sec, original_start_sec, duration_sec] pieces.
+
+
+def _frame_energy_db(samples, frame: int, block_frames: int = 8192):
+    """Per-frame energy in dBFS, computed in blocks so memory-mapped int16 audio is never fully converted."""
+    num_frames = len(samples) // frame
+    energy = np.empty(num_frames, dtype=np.float32)
+    scale = 32768.0 if samples.dtype == np.int16 else 1.0
+    for start in range(0, num_frames, block_frames):
+        end = min(start + block_frames, num_frames)
+        block = np.asarray(samples[start * frame:end * frame], dtype=np.float32).reshape(end - start, frame) / scale
+        energy[start:end] = 10.0 * np.log10(np.mean(block * block, axis=1) + 1e-10)
+    return energy
+
+
+def detect_speech(samples, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30, margin_db: float = None,
+                  min_speech_sec: float = 0.25, min_silence_sec: float = None, pad_sec: float = 0.2):
+    """Return [(start_sec, end_sec), ...] of voiced regions in 16 kHz mono samples (int16 or float)."""
+    margin_db = margin_db if margin_db is not None else float(os.getenv('VAD_MARGIN_DB', '12'))
+    min_silence_sec = min_silence_sec if min_silence_sec is not None else float(os.getenv('VAD_MIN_SILENCE_SEC', '1.0'))
+    frame = int(sample_rate * frame_ms / 1000)
+    energy = _frame_energy_db(samples, frame)
+    if not len(energy):
+        return []
+    noise_floor = float(np.percentile(energy, 10))
+    # Never call near-digital-silence speech, even in recordings that are almost all quiet
+    threshold = max(noise_floor + margin_db, -60.0)
+    voiced = energy > threshold
+
+    frame_sec = frame / sample_rate
+    regions = []
+    changes = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    edges = np.concatenate(([0], changes + 1, [len(voiced)]))
+    for start, end in zip(edges[:-1], edges[1:]):
+        if voiced[start]:
+            regions.append([start * frame_sec, end * frame_sec])
+
+    # Bridge short pauses, then drop blips and pad what is left
+    merged = []
+    for start, end in regions:
+        if merged and start - merged[-1][1] < min_silence_sec:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    total_sec = len(samples) / sample_rate
+    speech = []
+    for start, end in merged:
+        if end - start < min_speech_sec:
+            continue
+        start, end = max(0.0, start - pad_sec), min(total_sec, end + pad_sec)
+        start, end = round(float(start), 3), round(float(end), 3)
+        if speech and start <= speech[-1][1]:
+            speech[-1] = (speech[-1][0], end)
+        else:
+            speech.append((start, end))
+    voiced_sec = sum(end - start for start, end in speech)
+    logging.info(f"VAD kept {voiced_sec:.0f}s of {total_sec:.0f}s in {len(speech)} regions (threshold {threshold:.1f} dBFS)")
+    return speech
+
+
+def pack_chunks(regions, chunk_length_sec: float):
+    """
+    Pack speech regions into chunks of at most chunk_length_sec of voiced audio. Returns a timeline per chunk;
+    regions longer than a chunk are split.
+    """
+    chunks = []
+    timeline = []
+    filled = 0.0
+    for start, end in regions:
+        while end - start > 1e-6:
+            take = round(min(end - start, chunk_length_sec - filled), 3)
+            timeline.append([round(filled, 3), round(start, 3), take])
+            filled += take
+            start += take
+            if filled >= chunk_length_sec - 1e-6:
+                chunks.append(timeline)
+                timeline, filled = [], 0.0
+    if timeline:
+        chunks.append(timeline)
+    return chunks
+
+
+def timeline_samples(samples, timeline, sample_rate: int = SAMPLE_RATE):
+    """Concatenate the original samples a chunk timeline refers to."""
+    return np.concatenate([
+        np.asarray(samples[int(orig * sample_rate):int((orig + duration) * sample_rate)])
+        for _, orig, duration in timeline
+    ])
+
+
+def restore_timestamps(segments, timeline):
+    """Map segment and word timestamps from chunk time back to recording time, in place."""
+    if not timeline:
+        return segments
+    chunk_starts = [piece[0] for piece in timeline]
+
+    def to_original(t, is_end=False):
+        # A time exactly on a piece boundary is the end of the earlier piece or the start of the later one
+        i = (bisect.bisect_left(chunk_starts, t) if is_end else bisect.bisect_right(chunk_starts, t)) - 1
+        i = max(0, i)
+        chunk_start, orig, duration = timeline[i]
+        return orig + min(max(t - chunk_start, 0.0), duration)
+
+    for seg in segments:
+        seg['start'] = to_original(seg['start'])
+        seg['end'] = to_original(seg['end'], is_end=True)
+        for word in seg.get('words', []):
+            word['start'] = to_original(word['start'])
+            word['end'] = to_original(word['end'], is_end=True)
+    return segments
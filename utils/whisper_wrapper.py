@@ -1,9 +1,184 @@
-import whisper
-import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.executors import run_inference, threads_per_worker
+from utils.pcm import WavSlice, as_float32
+from utils.result_cache import cached_inference
+from utils.metrics import record_model_load
 
-async def transcribe_audio(audio_path: str) -> str:
-    logging.info(f"Transcribing {audio_path} with Whisper")
-    model = whisper.load_model("base")
-    result = model.transcribe(audio_path, word_timestamps=True)
-    return json.dumps(result, indent=2)
+# Process-wide registry of loaded Whisper models, keyed on (backend, model name, device, dtype).
+# Kept in LRU order so that configuring several model sizes does not pin all of them in memory.
+#
+# Two ASR backends produce the same segment/word JSON schema:
+# - 'openai-whisper': the reference PyTorch implementation
+# - 'faster-whisper': CTranslate2 inference with int8 weights on CPU, much faster on CPU-only nodes
+_MODEL_CACHE = OrderedDict()
+_MODEL_CACHE_LOCK = threading.Lock()
+_MODEL_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "load_seconds": 0.0}
+
+
+def asr_backend(backend: str = None) -> str:
+    backend = backend or os.getenv("ASR_BACKEND", "openai-whisper")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ASR_BACKEND {backend!r}; expected one of {sorted(BACKENDS)}")
+    return backend
+
+
+def _default_device(backend: str):
+    if backend == "faster-whisper":
+        import ctranslate2
+        return "cuda" if ctranslate2.get_cuda_device_count() else "cpu"
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def _cache_size():
+    return max(1, int(os.getenv("WHISPER_MODEL_CACHE_SIZE", "1")))
+
+
+def resolve_model_config(model_name: str = None, device: str = None, dtype: str = None, backend: str = None):
+    """Fill in backend, model name, device and compute dtype from the environment."""
+    backend = asr_backend(backend)
+    model_name = model_name or os.getenv("WHISPER_MODEL", "base")
+    device = device or os.getenv("WHISPER_DEVICE") or _default_device(backend)
+    if backend == "faster-whisper":
+        # Quantized int8 weights on CPU; fp16 on GPU
+        dtype = dtype or os.getenv("WHISPER_DTYPE") or ("fp16" if device.startswith("cuda") else "int8")
+    else:
+        # Whisper decodes in fp16 on GPU and fp32 on CPU unless told otherwise.
+        dtype = dtype or os.getenv("WHISPER_DTYPE") or ("fp16" if device.startswith("cuda") else "fp32")
+    return backend, model_name, device, dtype
+
+
+def model_version(model_name: str = None, backend: str = None) -> str:
+    """Identifier of the model that produced a transcript, recorded in manifests and cache keys."""
+    backend = asr_backend(backend)
+    model_name = model_name or os.getenv('WHISPER_MODEL', 'base')
+    if backend == "openai-whisper":
+        return f"openai-whisper:{model_name}"
+    # Quantization changes the output, so it is part of the version
+    _, _, _, dtype = resolve_model_config(model_name, backend=backend)
+    return f"{backend}:{model_name}:{dtype}"
+
+
+def _load_openai_whisper(model_name: str, device: str, dtype: str):
+    import whisper
+    return whisper.load_model(model_name, device=device)
+
+
+def _transcribe_openai_whisper(model, audio, dtype: str) -> dict:
+    return model.transcribe(audio, word_timestamps=True, fp16=(dtype == "fp16"))
+
+
+_CT2_COMPUTE_TYPES = {"fp16": "float16", "fp32": "float32"}
+
+
+def _load_faster_whisper(model_name: str, device: str, dtype: str):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_name, device=device, compute_type=_CT2_COMPUTE_TYPES.get(dtype, dtype),
+                        cpu_threads=threads_per_worker())
+
+
+def _transcribe_faster_whisper(model, audio, dtype: str) -> dict:
+    """Run faster-whisper and reshape its output into openai-whisper's result schema."""
+    # Greedy decoding, like openai-whisper's transcribe() defaults
+    segments, info = model.transcribe(audio, beam_size=1, word_timestamps=True)
+    result_segments = []
+    for seg in segments:
+        result_segments.append({
+            'id': seg.id,
+            'seek': seg.seek,
+            'start': seg.start,
+            'end': seg.end,
+            'text': seg.text,
+            'tokens': list(seg.tokens),
+            'temperature': seg.temperature,
+            'avg_logprob': seg.avg_logprob,
+            'compression_ratio': seg.compression_ratio,
+            'no_speech_prob': seg.no_speech_prob,
+            'words': [
+                {'word': word.word, 'start': word.start, 'end': word.end, 'probability': word.probability}
+                for word in (seg.words or [])
+            ],
+        })
+    return {
+        'text': ''.join(seg['text'] for seg in result_segments),
+        'segments': result_segments,
+        'language': info.language,
+    }
+
+
+# backend name -> (load(model_name, device, dtype), transcribe(model, audio, dtype) -> result dict)
+BACKENDS = {
+    "openai-whisper": (_load_openai_whisper, _transcribe_openai_whisper),
+    "faster-whisper": (_load_faster_whisper, _transcribe_faster_whisper),
+}
+
+
+def get_model(model_name: str = None, device: str = None, dtype: str = None, backend: str = None):
+    """Return a warm Whisper model, loading it at most once per process for each (backend, name, device, dtype)."""
+    key = resolve_model_config(model_name, device, dtype, backend)
+    backend, model_name, device, dtype = key
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is not None:
+            _MODEL_CACHE.move_to_end(key)
+            _MODEL_CACHE_STATS["hits"] += 1
+            return model
+        _MODEL_CACHE_STATS["misses"] += 1
+        logging.info(f"Loading Whisper model {model_name} with {backend} on {device} ({dtype})")
+        started = time.perf_counter()
+        model = BACKENDS[backend][0](model_name, device, dtype)
+        elapsed = time.perf_counter() - started
+        _MODEL_CACHE_STATS["load_seconds"] += elapsed
+        record_model_load(f"{backend}:{model_name}", elapsed)
+        logging.info(f"Loaded Whisper model {model_name} in {elapsed:.2f}s")
+        _MODEL_CACHE[key] = model
+        while len(_MODEL_CACHE) > _cache_size():
+            evicted_key, _ = _MODEL_CACHE.popitem(last=False)
+            _MODEL_CACHE_STATS["evictions"] += 1
+            logging.info(f"Evicted Whisper model {evicted_key} from cache")
+        return model
+
+
+def get_model_cache_stats() -> dict:
+    """Return load-time and hit-rate counters for the model registry."""
+    with _MODEL_CACHE_LOCK:
+        stats = dict(_MODEL_CACHE_STATS)
+        stats["cached_models"] = [list(key) for key in _MODEL_CACHE]
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def clear_model_cache():
+    """Drop all cached models (e.g. to free GPU memory between runs)."""
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE.clear()
+
+
+def transcribe_audio_sync(audio, model_name: str = None, backend: str = None) -> dict:
+    """
+    Blocking transcription; runs inside an inference worker so the model stays warm there.
+    audio is a file path, a 16 kHz mono sample array, or a WavSlice of a memory-mapped WAV.
+    """
+    backend, model_name, device, dtype = resolve_model_config(model_name, backend=backend)
+    model = get_model(model_name, device, dtype, backend)
+    if not isinstance(audio, str):
+        # Whisper skips its own ffmpeg decode when handed samples directly
+        audio = as_float32(audio)
+    return BACKENDS[backend][1](model, audio, dtype)
+
+
+async def transcribe_audio(audio, model_name: str = None) -> dict:
+    """Transcribe a file path, 16 kHz float32 array or WavSlice and return Whisper's result dict."""
+    description = audio if isinstance(audio, str) else repr(audio) if isinstance(audio, WavSlice) else f"{len(audio)} samples"
+    backend = asr_backend()
+    logging.info(f"Transcribing {description} with {backend}")
+    result = await cached_inference(
+        audio, 'transcription', {'model': model_version(model_name, backend), 'word_timestamps': True},
+        lambda: run_inference(transcribe_audio_sync, audio, model_name, backend)
+    )
+    return result
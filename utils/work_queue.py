@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from utils.executors import run_blocking
+
+# Work queue feeding long-running workers (see worker.py). A receive() leases one task: the task is
+# invisible to other workers until the lease's visibility timeout passes, so a worker that dies
+# mid-task simply lets it reappear. Workers extend the lease while they work, complete() it on
+# success, and release() it for a retry or dead_letter() it once it has used up its attempts.
+#
+# Backends (WORK_QUEUE_BACKEND):
+# - 'sqlite': a local file-backed queue for development and tests (WORK_QUEUE_PATH)
+# - 'azure': an Azure Storage queue, with '<name>-poison' as the dead-letter queue
+
+
+def queue_name() -> str:
+    return os.getenv('WORK_QUEUE_NAME', 'transcription-tasks')
+
+
+def visibility_timeout() -> int:
+    return int(os.getenv('WORK_QUEUE_VISIBILITY_SEC', '600'))
+
+
+def max_attempts() -> int:
+    return max(1, int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', '3')))
+
+
+def video_task(video_blob: str) -> dict:
+    return {'kind': 'video', 'video_blob': video_blob}
+
+
+def audio_task(video_id: str) -> dict:
+    return {'kind': 'audio', 'video_id': video_id}
+
+
+class Lease:
+    """A received task: its body, how many times it has been received, and the backend's handle on it."""
+
+    def __init__(self, task_id, body: dict, attempts: int, receipt):
+        self.task_id = task_id
+        self.body = body
+        self.attempts = attempts
+        self.receipt = receipt
+
+    def __repr__(self):
+        return f"Lease({self.task_id!r}, {self.body!r}, attempts={self.attempts})"
+
+
+class LeaseLost(Exception):
+    """The lease expired and the task was handed to another worker (or already completed)."""
+
+    def __init__(self, lease: Lease):
+        super().__init__(f"Lease on task {lease.task_id} was lost")
+        self.lease = lease
+
+
+class SQLiteQueue:
+    """A durable local queue in one SQLite file; every operation is a short transaction so several processes can share it."""
+
+    def __init__(self, path: str = None, name: str = None):
+        self.path = path or os.getenv('WORK_QUEUE_PATH', 'work_queue.db')
+        self.name = name or queue_name()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, body TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, visible_at REAL NOT NULL, receipt TEXT,"
+                " dead INTEGER NOT NULL DEFAULT 0, last_error TEXT, enqueued_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (queue, dead, visible_at)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+        finally:
+            db.close()
+
+    def _enqueue(self, body: dict, delay: float):
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT INTO tasks (queue, body, visible_at, enqueued_at) VALUES (?, ?, ?, ?)",
+                (self.name, json.dumps(body), now + delay, now),
+            )
+            return cursor.lastrowid
+
+    def _receive(self, timeout: int):
+        now = time.time()
+        with self._connect() as db:
+            # IMMEDIATE takes the write lock up front, so two workers can never lease the same row
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id, body, attempts FROM tasks WHERE queue = ? AND dead = 0 AND visible_at <= ? ORDER BY id LIMIT 1",
+                (self.name, now),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            receipt = uuid.uuid4().hex
+            db.execute(
+                "UPDATE tasks SET attempts = attempts + 1, visible_at = ?, receipt = ? WHERE id = ?",
+                (now + timeout, receipt, row[0]),
+            )
+            db.execute("COMMIT")
+        return Lease(row[0], json.loads(row[1]), row[2] + 1, receipt)
+
+    def _update(self, lease: Lease, sql: str, params=()):
+        with self._connect() as db:
+            cursor = db.execute(sql + " WHERE id = ? AND receipt = ?", (*params, lease.task_id, lease.receipt))
+            if cursor.rowcount == 0:
+                raise LeaseLost(lease)
+
+    async def enqueue(self, body: dict, delay: float = 0):
+        return await run_blocking(self._enqueue, body, delay)
+
+    async def receive(self, timeout: int = None):
+        return await run_blocking(self._receive, timeout or visibility_timeout())
+
+    async def extend(self, lease: Lease, timeout: int = None):
+        await run_blocking(self._update, lease, "UPDATE tasks SET visible_at = ?", (time.time() + (timeout or visibility_timeout()),))
+
+    async def complete(self, lease: Lease):
+        await run_blocking(self._update, lease, "DELETE FROM tasks")
+
+    async def release(self, lease: Lease, delay: float = 0, error: str = None):
+        await run_blocking(self._update, lease, "UPDATE tasks SET visible_at = ?, receipt = NULL, last_error = ?", (time.time() + delay, error))
+
+    async def dead_letter(self, lease: Lease, error: str = None):
+        await run_blocking(self._update, lease, "UPDATE tasks SET dead = 1, receipt = NULL, last_error = ?", (error,))
+
+    def _counts(self):
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT dead, visible_at <= ?, COUNT(*) FROM tasks WHERE queue = ? GROUP BY 1, 2", (time.time(), self.name)
+            ).fetchall()
+        counts = {'ready': 0, 'leased_or_delayed': 0, 'dead': 0}
+        for dead, visible, count in rows:
+            counts['dead' if dead else 'ready' if visible else 'leased_or_delayed'] += count
+        return counts
+
+    async def stats(self) -> dict:
+        return await run_blocking(self._counts)
+
+    async def close(self):
+        pass
+
+
+class AzureStorageQueue:
+    """An Azure Storage queue. attempts is the service's dequeue count; dead-lettered tasks go to '<name>-poison'."""
+
+    def __init__(self, name: str = None):
+        self.name = name or queue_name()
+        self._client = None
+        self._poison = None
+
+    def _queue_client(self, name: str):
+        from azure.storage.queue.aio import QueueClient
+        account_url = f"https://{os.getenv('AZURE_STORAGE_ACCOUNT_NAME')}.queue.core.windows.net"
+        return QueueClient(account_url, name, credential=os.getenv('AZURE_STORAGE_ACCOUNT_KEY'))
+
+    async def _clients(self):
+        from azure.core.exceptions import ResourceExistsError
+        if self._client is None:
+            self._client = self._queue_client(self.name)
+            self._poison = self._queue_client(f"{self.name}-poison")
+            for client in (self._client, self._poison):
+                try:
+                    await client.create_queue()
+                except ResourceExistsError:
+                    pass
+        return self._client, self._poison
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            await self._poison.close()
+            self._client = self._poison = None
+
+    async def enqueue(self, body: dict, delay: float = 0):
+        client, _ = await self._clients()
+        message = await client.send_message(json.dumps(body), visibility_timeout=int(delay) or None)
+        return message.id
+
+    async def receive(self, timeout: int = None):
+        client, _ = await self._clients()
+        message = await client.receive_message(visibility_timeout=timeout or visibility_timeout())
+        if message is None:
+            return None
+        return Lease(message.id, json.loads(message.content), message.dequeue_count, message.pop_receipt)
+
+    @staticmethod
+    def _lease_lost(error) -> bool:
+        """The message is gone (404), or another worker dequeued it after our lease lapsed (400 PopReceiptMismatch)."""
+        from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+        if isinstance(error, ResourceNotFoundError):
+            return True
+        return isinstance(error, HttpResponseError) and getattr(error, 'error_code', None) == 'PopReceiptMismatch'
+
+    async def _update(self, lease: Lease, timeout: int):
+        client, _ = await self._clients()
+        try:
+            message = await client.update_message(lease.task_id, lease.receipt, visibility_timeout=timeout)
+        except Exception as e:
+            if self._lease_lost(e):
+                raise LeaseLost(lease)
+            raise
+        # Every update issues a new pop receipt; the old one no longer works
+        lease.receipt = message.pop_receipt
+
+    async def extend(self, lease: Lease, timeout: int = None):
+        await self._update(lease, timeout or visibility_timeout())
+
+    async def complete(self, lease: Lease):
+        client, _ = await self._clients()
+        try:
+            await client.delete_message(lease.task_id, lease.receipt)
+        except Exception as e:
+            if self._lease_lost(e):
+                raise LeaseLost(lease)
+            raise
+
+    async def release(self, lease: Lease, delay: float = 0, error: str = None):
+        await self._update(lease, int(delay))
+
+    async def dead_letter(self, lease: Lease, error: str = None):
+        _, poison = await self._clients()
+        await poison.send_message(json.dumps({**lease.body, 'error': error, 'attempts': lease.attempts}))
+        await self.complete(lease)
+
+    async def stats(self) -> dict:
+        client, poison = await self._clients()
+        ready = (await client.get_queue_properties()).approximate_message_count
+        dead = (await poison.get_queue_properties()).approximate_message_count
+        return {'approximate_messages': ready, 'dead': dead}
+
+
+def get_work_queue():
+    backend = os.getenv('WORK_QUEUE_BACKEND', 'sqlite')
+    if backend == 'sqlite':
+        return SQLiteQueue()
+    if backend == 'azure':
+        return AzureStorageQueue()
+    raise ValueError(f"Unknown WORK_QUEUE_BACKEND {backend!r}; expected 'sqlite' or 'azure'")
+
+
+async def hold_lease(queue, lease: Lease, timeout: int = None):
+    """Extend a lease every half visibility timeout until cancelled, so long tasks are not handed out twice."""
+    timeout = timeout or visibility_timeout()
+    while True:
+        await asyncio.sleep(timeout / 2)
+        try:
+            await queue.extend(lease, timeout)
+        except LeaseLost:
+            logging.warning(f"Lost lease on {lease}; another worker may pick it up")
+            return
+        except Exception as e:
+            # A transient failure must not end the heartbeat; the next renewal may still land in time
+            logging.warning(f"Failed to extend lease on {lease}: {e}")
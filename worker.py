@@ -0,0 +1,218 @@
+"""
+worker.py
+
+Long-running pipeline worker. Instead of listing the 'videos' and 'audio' containers on a schedule,
+workers pull tasks from the work queue (utils/work_queue.py) and keep their Whisper/pyannote models
+warm between tasks. A task is one video:
+- {"kind": "video", "video_blob": "<name>.mp4"}: download, prepare, transcribe, diarize, publish
+- {"kind": "audio", "video_id": "<id>"}: transcribe, diarize and publish already-prepared chunks
+
+Failed tasks are retried with exponential backoff and dead-lettered after WORK_QUEUE_MAX_ATTEMPTS.
+
+Usage:
+    python worker.py [run]
+    python worker.py enqueue video <blob_name> [...]
+    python worker.py enqueue audio <video_id> [...]
+    python worker.py backfill      # enqueue everything currently in the videos/audio containers
+    python worker.py stats
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from dotenv import load_dotenv
+from utils.azure_blob import BlobSession, list_blobs_async
+from utils.executors import shutdown_executors
+from utils.manifest import load_manifest
+from utils.storage import get_storage, replication_scope
+from utils.metrics import start_metrics_server, stage_timer
+from utils.work_queue import get_work_queue, hold_lease, max_attempts, video_task, audio_task, LeaseLost
+from run_pipeline import build_stages
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+def build_task_stages():
+    """Stage sequence per task kind, with the same containers and diarization settings as run_pipeline."""
+    videos_container = os.getenv('AZURE_BLOB_VIDEOS_CONTAINER', 'videos')
+    processed_container = os.getenv('AZURE_BLOB_PROCESSED_VIDEOS_CONTAINER')
+    if not processed_container:
+        raise ValueError("AZURE_BLOB_PROCESSED_VIDEOS_CONTAINER environment variable must be set (e.g., 'videos-processed')")
+    audio_container = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    # Disable diarization for stability on freshly ingested videos, as run_pipeline does
+    video_stages = build_stages(videos_container, audio_container, processed_container, enable_diarization=False)
+    audio_stages = build_stages(videos_container, audio_container, processed_container, enable_diarization=True)
+    return {
+        'video': list(video_stages.values()),
+        'audio': [audio_stages['transcribe'], audio_stages['diarize'], audio_stages['publish']],
+    }
+
+
+def _job_for(body: dict) -> dict:
+    if body.get('kind') == 'video':
+        video_blob = body['video_blob']
+        return {'video_blob': video_blob, 'video_id': os.path.splitext(os.path.basename(video_blob))[0]}
+    if body.get('kind') == 'audio':
+        return {'video_id': body['video_id']}
+    raise ValueError(f"Unknown task kind in {body}")
+
+
+async def _already_prepared(job: dict) -> bool:
+    """A retried video task whose video was already prepared and moved away resumes after the prepare stage."""
+    videos_container = os.getenv('AZURE_BLOB_VIDEOS_CONTAINER', 'videos')
+    if job['video_blob'] in await list_blobs_async(videos_container, prefix=job['video_blob']):
+        return False
+    return (await load_manifest(job['video_id'])).stage_done('prepare')
+
+
+async def process_task(body: dict, task_stages):
+    """Run one task through its stages in order; a stage returning None means there is nothing left to do."""
+    job = _job_for(body)
+    stages = task_stages[body['kind']]
+    if body['kind'] == 'video' and await _already_prepared(job):
+        logging.info(f"{job['video_id']} was already prepared; resuming at transcription")
+        stages = [stage for stage in stages if stage.name not in ('download', 'prepare')]
+    for stage in stages:
+        logging.info(f"[{stage.name}] {job['video_id']}")
+        with stage_timer(stage.name, item=job['video_id']):
+            job = await stage.func(job)
+        if job is None:
+            break
+
+
+def _retry_delay(attempts: int) -> float:
+    return float(os.getenv('WORK_QUEUE_RETRY_DELAY_SEC', '60')) * 2 ** (attempts - 1)
+
+
+async def _stop_heartbeat(heartbeat):
+    """Cancel the lease heartbeat and wait for it, so no extend() races the receipt used to settle the lease."""
+    heartbeat.cancel()
+    try:
+        await heartbeat
+    except asyncio.CancelledError:
+        pass
+
+
+async def handle_lease(queue, lease, task_stages):
+    heartbeat = asyncio.create_task(hold_lease(queue, lease))
+    try:
+        # With tiered storage, the task is only done once its outputs have reached shared storage;
+        # the scope keeps other tasks' uploads (and their failures) out of this task's flush
+        with replication_scope():
+            await process_task(lease.body, task_stages)
+            await get_storage().flush()
+    except Exception as e:
+        logging.error(f"Task {lease} failed: {e}", exc_info=True)
+        await _stop_heartbeat(heartbeat)
+        try:
+            if lease.attempts >= max_attempts():
+                logging.error(f"Dead-lettering {lease} after {lease.attempts} attempt(s)")
+                await queue.dead_letter(lease, error=str(e))
+            else:
+                delay = _retry_delay(lease.attempts)
+                logging.info(f"Retrying {lease} in {delay:.0f}s")
+                await queue.release(lease, delay=delay, error=str(e))
+        except LeaseLost:
+            logging.warning(f"Lease on {lease} expired before its failure was recorded")
+        return
+    finally:
+        heartbeat.cancel()
+    await _stop_heartbeat(heartbeat)
+    try:
+        await queue.complete(lease)
+        logging.info(f"Completed {lease}")
+    except LeaseLost:
+        logging.warning(f"Finished {lease} after its lease expired; it may be processed again")
+
+
+async def worker_loop(queue, task_stages, stop: asyncio.Event, poll_sec: float):
+    while not stop.is_set():
+        lease = await queue.receive()
+        if lease is None:
+            # Idle: wait for the next poll or for shutdown, whichever comes first
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=poll_sec)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await handle_lease(queue, lease, task_stages)
+
+
+async def run_worker():
+    concurrency = max(1, int(os.getenv('WORKER_CONCURRENCY', '1')))
+    poll_sec = float(os.getenv('WORK_QUEUE_POLL_SEC', '5'))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        # Finish the tasks in hand, then exit; unfinished leases simply expire back onto the queue
+        loop.add_signal_handler(sig, stop.set)
+    queue = get_work_queue()
+    task_stages = build_task_stages()
+    start_metrics_server()
+    logging.info(f"Worker started with {concurrency} task loop(s)")
+    try:
+        async with BlobSession():
+            await asyncio.gather(*(worker_loop(queue, task_stages, stop, poll_sec) for _ in range(concurrency)))
+    finally:
+        await queue.close()
+    logging.info("Worker stopped")
+
+
+async def enqueue(kind: str, names):
+    queue = get_work_queue()
+    try:
+        for name in names:
+            task = video_task(name) if kind == 'video' else audio_task(name)
+            await queue.enqueue(task)
+            logging.info(f"Enqueued {task}")
+    finally:
+        await queue.close()
+
+
+async def backfill():
+    """One-off migration from container polling: enqueue every video and every prepared-but-unvideoed audio set."""
+    videos_container = os.getenv('AZURE_BLOB_VIDEOS_CONTAINER', 'videos')
+    audio_container = os.getenv('AZURE_BLOB_AUDIO_CONTAINER', 'audio')
+    async with BlobSession():
+        video_blobs = await list_blobs_async(videos_container)
+        audio_blobs = await list_blobs_async(audio_container)
+    video_ids = {os.path.splitext(os.path.basename(blob))[0] for blob in video_blobs}
+    audio_ids = sorted({blob.split('_chunk_')[0] for blob in audio_blobs if '_chunk_' in blob} - video_ids)
+    await enqueue('video', video_blobs)
+    await enqueue('audio', audio_ids)
+
+
+async def stats():
+    queue = get_work_queue()
+    try:
+        print(await queue.stats())
+    finally:
+        await queue.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pull pipeline tasks from the work queue")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="Process tasks until SIGTERM/SIGINT (default)")
+    enqueue_cmd = commands.add_parser("enqueue", help="Add tasks to the queue")
+    enqueue_cmd.add_argument("kind", choices=["video", "audio"])
+    enqueue_cmd.add_argument("names", nargs="+", help="video blob names or video ids")
+    commands.add_parser("backfill", help="Enqueue everything currently in the videos and audio containers")
+    commands.add_parser("stats", help="Show queue depth and dead-lettered tasks")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "enqueue":
+            asyncio.run(enqueue(args.kind, args.names))
+        elif args.command == "backfill":
+            asyncio.run(backfill())
+        elif args.command == "stats":
+            asyncio.run(stats())
+        else:
+            asyncio.run(run_worker())
+    finally:
+        shutdown_executors()